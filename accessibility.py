@@ -0,0 +1,208 @@
+"""
+Accessibility grid: how many destinations each part of the city reaches
+within 10/20/30 minutes by car, in 2018 and 2025.
+
+Origins are the centres of a regular grid over config.BBOX (cell size in
+metres, tunable), snapped to the 2025 road network like generate_points.py
+snaps its points; cells with no road within ACCESS_SNAP_M (river, parks) are
+left out, so they never reach the engines. Destinations are the points in
+points.csv. Each year's
+cells x destinations matrix is computed in row chunks through the tiled
+matrix path (resumable, either backend), and every threshold is counted
+from the same chunk in one vectorized pass. Writes accessibility.csv and
+regenerates heatmap_improvements.html.
+"""
+import argparse
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from config import (
+    MIN_LON, MIN_LAT, MAX_LON, MAX_LAT,
+    VALHALLA_2018, VALHALLA_2025, POINTS_CSV, MATRIX_TILES_DIR,
+    ACCESS_CELL_M, ACCESS_SNAP_M, ACCESS_THRESHOLDS_MIN, ACCESSIBILITY_CSV, HEATMAP_HTML
+)
+from build_snapshots import check_snapshots
+from run_matrix_and_delta import call_matrix_tiled
+from valhalla_client import run_concurrent
+
+M_PER_DEG_LAT = 111320.0
+
+# Grid cells per matrix pass (one chunk of rows in memory at a time)
+CHUNK_CELLS = 2000
+
+
+def make_grid(cell_m: float = ACCESS_CELL_M) -> pd.DataFrame:
+    """Cell centres of a regular grid (cell_m metres) over the bounding box."""
+    mid_lat = (MIN_LAT + MAX_LAT) / 2
+    dlat = cell_m / M_PER_DEG_LAT
+    dlon = cell_m / (M_PER_DEG_LAT * math.cos(math.radians(mid_lat)))
+    lats = np.arange(MIN_LAT + dlat / 2, MAX_LAT, dlat)
+    lons = np.arange(MIN_LON + dlon / 2, MAX_LON, dlon)
+    glat, glon = np.meshgrid(lats, lons, indexing="ij")
+    return pd.DataFrame({
+        "cell": np.arange(glat.size),
+        "row": np.repeat(np.arange(len(lats)), len(lons)),
+        "col": np.tile(np.arange(len(lons)), len(lats)),
+        "lat": glat.ravel().round(6),
+        "lon": glon.ravel().round(6),
+    })
+
+
+def snap_cells(cells: pd.DataFrame, max_snap_m: float = ACCESS_SNAP_M, backend: str = "valhalla") -> pd.DataFrame:
+    """
+    Cells with a road within max_snap_m of their centre, with the snapped
+    position the matrix starts from (snap_lat, snap_lon, snap_m). Snapped
+    against 2025 offline (snap_index.py) with the local backend, else with
+    batched /locate calls as in generate_points.py.
+    """
+    lat, lon = cells["lat"].to_numpy(dtype=float), cells["lon"].to_numpy(dtype=float)
+    if backend == "local":
+        from snap_index import index_for
+
+        slat, slon, snap_m, _ = index_for(VALHALLA_2025).snap(lat, lon, max_snap_m)
+    else:
+        from generate_points import haversine_m_vec, locate_batch_size, snap_batch
+
+        size = locate_batch_size()
+        chunks = [(lat[i:i + size], lon[i:i + size]) for i in range(0, len(lat), size)]
+        snapped = run_concurrent(lambda c: snap_batch(*c), chunks, VALHALLA_2025)
+        slat = np.concatenate([s[0] for s in snapped])
+        slon = np.concatenate([s[1] for s in snapped])
+        snap_m = haversine_m_vec(lat, lon, slat, slon)
+    keep = snap_m <= max_snap_m
+    if not keep.any():
+        raise RuntimeError(f"no grid cell snapped within {max_snap_m:g} m; is the 2025 engine up?")
+    return cells[keep].assign(snap_lat=slat[keep].round(6), snap_lon=slon[keep].round(6),
+                              snap_m=snap_m[keep].round(1)).reset_index(drop=True)
+
+
+def reach_counts(time_s: np.ndarray, thresholds_s: np.ndarray) -> np.ndarray:
+    """
+    (rows, len(thresholds)) destinations reachable within each threshold,
+    from one bucketing pass over the matrix (NaN = unreachable).
+    """
+    k = len(thresholds_s)
+    t = np.where(np.isnan(time_s), np.inf, time_s)
+    # bucket b means "within thresholds[b] but not thresholds[b-1]"; k = beyond all
+    bucket = np.searchsorted(thresholds_s, t, side="left")
+    rows = np.arange(t.shape[0])[:, None]
+    hist = np.bincount((rows * (k + 1) + bucket).ravel(),
+                       minlength=t.shape[0] * (k + 1)).reshape(t.shape[0], k + 1)
+    return np.cumsum(hist[:, :k], axis=1)
+
+
+def accessibility(base_url: str, cells: pd.DataFrame, dests: list[dict], label: str,
+                  thresholds_min=ACCESS_THRESHOLDS_MIN, max_pairs: int | None = None,
+                  checkpoint_dir: str | None = MATRIX_TILES_DIR, backend: str = "valhalla") -> np.ndarray:
+    """(cells, thresholds) reach counts for one snapshot."""
+    thresholds_s = np.asarray(sorted(thresholds_min), dtype=np.float64) * 60
+    locs = [{"lat": float(a), "lon": float(b)} for a, b in zip(cells["snap_lat"], cells["snap_lon"])]
+    counts = np.zeros((len(locs), len(thresholds_s)), dtype=np.int32)
+    for c0 in range(0, len(locs), CHUNK_CELLS):
+        chunk = locs[c0:c0 + CHUNK_CELLS]
+        with metrics.stage(f"matrix_{label}"):
+            time_s = call_matrix_tiled(base_url, chunk, dests, max_pairs=max_pairs,
+                                       checkpoint_dir=checkpoint_dir, label=f"access_{label}",
+                                       backend=backend)[0]
+        with metrics.stage("reach_counts"):
+            counts[c0:c0 + len(chunk)] = reach_counts(time_s, thresholds_s)
+        print(f"  [{label}] cells {c0 + len(chunk):,}/{len(locs):,}")
+    return counts
+
+
+def draw_heatmap(df: pd.DataFrame, points: pd.DataFrame, thresholds_min, out_html: str) -> None:
+    """One HeatMap layer of 2018 -> 2025 gains per threshold, plus the destinations."""
+    import folium
+    from folium.plugins import HeatMap
+
+    m = folium.Map(location=[(MIN_LAT + MAX_LAT) / 2, (MIN_LON + MAX_LON) / 2], zoom_start=13)
+    default = sorted(thresholds_min)[len(thresholds_min) // 2]
+    for minutes in sorted(thresholds_min):
+        gain = df[f"delta_{minutes}min"].clip(lower=0)
+        hot = df[gain > 0]
+        fg = folium.FeatureGroup(name=f"More destinations within {minutes} min", show=minutes == default)
+        HeatMap(
+            np.column_stack((hot["lat"], hot["lon"], gain[gain > 0])).tolist(),
+            min_opacity=0.3, max_zoom=13, radius=15, blur=20,
+            gradient={0.4: "blue", 0.6: "lime", 0.8: "yellow", 1.0: "red"},
+        ).add_to(fg)
+        fg.add_to(m)
+
+    for r in points.itertuples(index=False):
+        folium.CircleMarker(
+            [r.lat, r.lon], radius=3, color="black", fill=True, fill_color="black", fill_opacity=0.6,
+            popup=f"Point {r.id}",
+        ).add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    m.save(out_html)
+
+
+def main(cell_m=ACCESS_CELL_M, thresholds_min=ACCESS_THRESHOLDS_MIN, max_pairs=None,
+         checkpoint_dir=MATRIX_TILES_DIR, backend="valhalla", max_snap_m=ACCESS_SNAP_M):
+    thresholds_min = sorted(thresholds_min)
+    points = pd.read_csv(POINTS_CSV)
+    dests = [{"lat": float(r.lat), "lon": float(r.lon)} for r in points.itertuples(index=False)]
+    if backend == "local" and max_pairs is None:
+        # No request size limit offline: one search per chunk
+        max_pairs = CHUNK_CELLS * len(dests)
+    if backend == "valhalla":
+        check_snapshots([VALHALLA_2018, VALHALLA_2025])
+    grid = make_grid(cell_m)
+    with metrics.stage("snap_cells"):
+        cells = snap_cells(grid, max_snap_m, backend)
+    print(f"{len(cells):,} of {len(grid):,} cells of {cell_m:g} m within {max_snap_m:g} m of a road "
+          f"x {len(dests)} destinations, thresholds {', '.join(f'{t} min' for t in thresholds_min)}")
+
+    with ThreadPoolExecutor(max_workers=2) as years:
+        f2018 = years.submit(accessibility, VALHALLA_2018, cells, dests, "2018",
+                             thresholds_min, max_pairs, checkpoint_dir, backend)
+        f2025 = years.submit(accessibility, VALHALLA_2025, cells, dests, "2025",
+                             thresholds_min, max_pairs, checkpoint_dir, backend)
+        c2018, c2025 = f2018.result(), f2025.result()
+
+    df = cells.copy()
+    for k, minutes in enumerate(thresholds_min):
+        df[f"reach_{minutes}min_2018"] = c2018[:, k]
+        df[f"reach_{minutes}min_2025"] = c2025[:, k]
+        df[f"delta_{minutes}min"] = c2025[:, k] - c2018[:, k]
+    df.to_csv(ACCESSIBILITY_CSV, index=False)
+    print(f"✅ {ACCESSIBILITY_CSV} saved")
+
+    print("\n" + "=" * 60)
+    print("ACCESSIBILITY (destinations reachable per cell)")
+    print("=" * 60)
+    for minutes in thresholds_min:
+        a, b, d = (df[f"reach_{minutes}min_2018"], df[f"reach_{minutes}min_2025"],
+                   df[f"delta_{minutes}min"])
+        print(f"{minutes:>3} min: mean {a.mean():.1f} -> {b.mean():.1f} ({d.mean():+.2f}), "
+              f"cells gaining {(d > 0).sum():,}, losing {(d < 0).sum():,}")
+
+    with metrics.stage("draw_heatmap"):
+        draw_heatmap(df, points, thresholds_min, HEATMAP_HTML)
+    print(f"✅ {HEATMAP_HTML} saved")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reachable destinations per grid cell, 2018 vs 2025")
+    parser.add_argument("--cell-m", type=float, default=ACCESS_CELL_M,
+                        help=f"Grid cell size in metres (default: {ACCESS_CELL_M})")
+    parser.add_argument("--max-snap-m", type=float, default=ACCESS_SNAP_M,
+                        help=f"Leave out cells whose centre is further from a road (default: {ACCESS_SNAP_M})")
+    parser.add_argument("--thresholds", type=int, nargs="+", default=list(ACCESS_THRESHOLDS_MIN),
+                        help="Travel-time thresholds in minutes (default: %(default)s)")
+    parser.add_argument("--max-pairs", type=int, default=None,
+                        help="Pairs per matrix tile (default: max_matrix_location_pairs from valhalla.json)")
+    parser.add_argument("--checkpoint-dir", default=MATRIX_TILES_DIR,
+                        help=f"Directory for finished tiles, used to resume (default: {MATRIX_TILES_DIR})")
+    parser.add_argument("--backend", choices=["valhalla", "local"], default="valhalla",
+                        help="Matrix engine: the Valhalla containers, or the offline graph from local_graph.py")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    with metrics.session(args):
+        main(cell_m=args.cell_m, thresholds_min=args.thresholds, max_pairs=args.max_pairs,
+             checkpoint_dir=args.checkpoint_dir, backend=args.backend, max_snap_m=args.max_snap_m)
@@ -1,6 +1,8 @@
-import pandas as pd
-
-from config import MATRIX_DELTA_CSV
+import metrics
+from bootstrap import bootstrap, print_report
+from config import MATRIX_2018_BIN, MATRIX_2025_BIN, BOOTSTRAP_RESAMPLES, BOOTSTRAP_SEED, BOOTSTRAP_LEVEL
+from delta_stream import delta_stats, store_chunks
+from matrix_store import load_matrix
 
 # Color pairs used in visualization (forward, return)
 COLOR_PAIRS = [
@@ -18,64 +20,81 @@ COLOR_PAIRS = [
     ("Blue", "Orange"),
 ]
 
-df = pd.read_csv(MATRIX_DELTA_CSV)
-
-summary = {
-    "rows": len(df),
-    "null_2018_time": int(df["time_s_2018"].isna().sum()),
-    "null_2025_time": int(df["time_s_2025"].isna().sum()),
-    "avg_delta_time_s": df["delta_time_s"].dropna().mean(),
-    "avg_delta_distance_km": df["delta_distance_km"].dropna().mean(),
-    "median_delta_time_s": df["delta_time_s"].dropna().median(),
-    "median_delta_distance_km": df["delta_distance_km"].dropna().median(),
-}
-
-top_faster = (
-    df.dropna(subset=["delta_time_s"])
-      .sort_values("delta_time_s")
-      .head(20)[["src","dst","time_s_2018","time_s_2025","delta_time_s"]]
-)
-
-top_slower = (
-    df.dropna(subset=["delta_time_s"])
-      .sort_values("delta_time_s", ascending=False)
-      .head(20)[["src","dst","time_s_2018","time_s_2025","delta_time_s"]]
-)
-
-# Top 10 for visualization with colors
-top_10_viz = (
-    df.dropna(subset=["delta_time_s"])
-      .sort_values("delta_time_s")
-      .head(10)[["src","dst","delta_time_s"]]
-      .reset_index(drop=True)
-)
-
-print("="*60)
-print("SUMMARY STATISTICS")
-print("="*60)
-for key, value in summary.items():
-    print(f"{key}: {value}")
-print()
-
-print("="*60)
-print("TOP 20 FASTER ROUTES IN 2025 (negative delta = faster)")
-print("="*60)
-print(top_faster.to_string(index=False))
-print()
-
-print("="*60)
-print("TOP 20 SLOWER ROUTES IN 2025 (positive delta = slower)")
-print("="*60)
-print(top_slower.to_string(index=False))
-print()
-
-print("="*60)
-print("VISUALIZATION COLOR MAPPING (Top 10 by delta_time_s)")
-print("="*60)
-print("Each OD pair has unique colors: Forward / Return")
-print("-"*60)
-for i, row in top_10_viz.iterrows():
-    fwd_color, ret_color = COLOR_PAIRS[i % len(COLOR_PAIRS)]
-    print(f"OD {int(row['src']):2d}↔{int(row['dst']):2d}  |  Δtime: {row['delta_time_s']:+8.0f}s  |  {fwd_color} / {ret_color}")
-print("-"*60)
-print("Line style: Solid = 2018, Dashed = 2025")
+
+def compute_stats(path_2018=MATRIX_2018_BIN, path_2025=MATRIX_2025_BIN, top=20):
+    """Summary and bounded-heap top/bottom rows of the delta, in one pass over the stores."""
+    return delta_stats(store_chunks(load_matrix(path_2018), load_matrix(path_2025)), top=top)
+
+
+def color_mapping(top_faster, k=10) -> list[tuple]:
+    """(src, dst, delta_time_s, forward color, return color) for the top k pairs, as drawn on the map."""
+    out = []
+    for i, row in top_faster.head(k)[["src", "dst", "delta_time_s"]].iterrows():
+        fwd_color, ret_color = COLOR_PAIRS[i % len(COLOR_PAIRS)]
+        out.append((int(row["src"]), int(row["dst"]), row["delta_time_s"], fwd_color, ret_color))
+    return out
+
+
+def print_tables(stats, top=20) -> None:
+    # Ties in row order, from the same pass as the summary
+    top_faster = stats.top_frame()
+    top_slower = stats.top_frame(largest=True)
+
+    print("="*60)
+    print("SUMMARY STATISTICS")
+    print("="*60)
+    for key, value in stats.summary().items():
+        print(f"{key}: {value}")
+    print()
+
+    print("="*60)
+    print(f"TOP {top} FASTER ROUTES IN 2025 (negative delta = faster)")
+    print("="*60)
+    print(top_faster.to_string(index=False))
+    print()
+
+    print("="*60)
+    print(f"TOP {top} SLOWER ROUTES IN 2025 (positive delta = slower)")
+    print("="*60)
+    print(top_slower.to_string(index=False))
+    print()
+
+    print("="*60)
+    print("VISUALIZATION COLOR MAPPING (Top 10 by delta_time_s)")
+    print("="*60)
+    print("Each OD pair has unique colors: Forward / Return")
+    print("-"*60)
+    for src, dst, delta, fwd_color, ret_color in color_mapping(top_faster):
+        print(f"OD {src:2d}↔{dst:2d}  |  Δtime: {delta:+8.0f}s  |  {fwd_color} / {ret_color}")
+    print("-"*60)
+    print("Line style: Solid = 2018, Dashed = 2025")
+    print()
+
+
+def main(top=20, resamples=BOOTSTRAP_RESAMPLES, seed=BOOTSTRAP_SEED, level=BOOTSTRAP_LEVEL, workers=None, ci=True):
+    with metrics.stage("delta_stats"):
+        stats = compute_stats(top=top)
+    print_tables(stats, top)
+
+    if ci:
+        # Uncertainty of the headline numbers: resample points, not OD cells
+        with metrics.stage("bootstrap"):
+            intervals = bootstrap(MATRIX_2018_BIN, MATRIX_2025_BIN, resamples, seed, level, workers)
+        print_report(intervals, resamples, level)
+
+
+def run(args) -> None:
+    """Entry point for parsed cli.analyze_arguments() flags."""
+    with metrics.session(args):
+        main(top=args.top, resamples=args.resamples, seed=args.seed, level=args.level,
+             workers=args.workers, ci=not args.no_ci)
+
+
+# The bootstrap's process pool may re-import this module, so keep the CLI under the guard
+if __name__ == "__main__":
+    import argparse
+    import cli
+
+    parser = argparse.ArgumentParser(description="Summary, top faster/slower routes and bootstrap confidence intervals")
+    cli.analyze_arguments(parser)
+    run(parser.parse_args())
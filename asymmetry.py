@@ -0,0 +1,162 @@
+"""
+Whole-matrix one-way asymmetry analysis.
+
+For each snapshot, compares every pair with its reverse (M - M^T) for time
+and distance in row blocks over the dense stores, flags pairs over the
+asymmetry thresholds, keeps the worst ones ranked by return penalty and
+reports each point's asymmetry burden.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    MATRIX_2018_BIN, MATRIX_2025_BIN,
+    ASYMMETRY_TIME_S, ASYMMETRY_DISTANCE_KM, ASYMMETRY_MAX_PAIRS,
+    ASYMMETRY_PAIRS_CSV, ASYMMETRY_POINTS_CSV
+)
+from matrix_store import load_matrix, DISTANCE_DECIMALS
+
+BLOCK_ROWS = 1024
+
+
+def _top_pairs(i, j, time_pen, dist_pen, k):
+    """The k pairs with the largest time (then distance) penalty, ties by index."""
+    if k is not None and len(i) > k:
+        # Cheap cut on time first, keeping everything tied at the threshold
+        kth = np.partition(time_pen, len(i) - k)[len(i) - k]
+        keep = time_pen >= kth
+        i, j, time_pen, dist_pen = i[keep], j[keep], time_pen[keep], dist_pen[keep]
+    order = np.lexsort((j, i, -dist_pen, -time_pen))
+    if k is not None:
+        order = order[:k]
+    return i[order], j[order], time_pen[order], dist_pen[order]
+
+
+def asymmetry(store, time_s=ASYMMETRY_TIME_S, distance_km=ASYMMETRY_DISTANCE_KM,
+              max_pairs=ASYMMETRY_MAX_PAIRS, block_rows=BLOCK_ROWS):
+    """
+    One vectorized pass over M - M^T in row blocks.
+
+    Returns (pairs, points, n_flagged):
+      pairs     - the max_pairs worst flagged unordered pairs (all if None),
+                  oriented so src -> dst is the faster direction, ranked by
+                  return time penalty
+      points    - per-point burden: number of flagged pairs it belongs to and
+                  mean/max absolute time asymmetry against all other points
+      n_flagged - total number of flagged unordered pairs
+    """
+    t = store.time_s
+    d = store.distance_km
+    n = store.n
+
+    top = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+           np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32))
+    abs_sum = np.zeros(n)
+    abs_max = np.zeros(n)
+    valid = np.zeros(n, dtype=np.int64)
+    flagged_count = np.zeros(n, dtype=np.int64)
+
+    for r0 in range(0, n, block_rows):
+        r1 = min(n, r0 + block_rows)
+        # asym[i, j] = reverse - forward = M[j, i] - M[i, j]
+        at = np.asarray(t[:, r0:r1]).T - t[r0:r1]
+        ad = np.asarray(d[:, r0:r1]).T - d[r0:r1]
+        abs_t = np.abs(at)
+        abs_d = np.abs(ad)
+        ok = ~np.isnan(abs_t)
+
+        abs_sum[r0:r1] = np.nansum(abs_t, axis=1, dtype=np.float64)
+        abs_max[r0:r1] = np.where(ok, abs_t, 0).max(axis=1)
+        valid[r0:r1] = ok.sum(axis=1)
+
+        flag = ok & ((abs_t > time_s) | (abs_d > distance_km))
+        flagged_count[r0:r1] = flag.sum(axis=1)
+
+        # Each unordered pair once (j > i)
+        bi, bj = np.nonzero(flag)
+        upper = bj > bi + r0
+        bi, bj = bi[upper], bj[upper]
+        cand = (np.concatenate((top[0], bi + r0)), np.concatenate((top[1], bj)),
+                np.concatenate((top[2], abs_t[bi, bj])), np.concatenate((top[3], abs_d[bi, bj])))
+        top = _top_pairs(*cand, max_pairs)
+
+    i, j = top[0], top[1]
+
+    # Orient every pair so src -> dst is the faster direction
+    swap = t[i, j] > t[j, i]
+    src = np.where(swap, j, i)
+    dst = np.where(swap, i, j)
+
+    fwd_t = np.asarray(t[src, dst], dtype=np.float64)
+    ret_t = np.asarray(t[dst, src], dtype=np.float64)
+    fwd_d = np.round(np.asarray(d[src, dst], dtype=np.float64), DISTANCE_DECIMALS)
+    ret_d = np.round(np.asarray(d[dst, src], dtype=np.float64), DISTANCE_DECIMALS)
+
+    pairs = pd.DataFrame({
+        "year": store.snapshot,
+        "src": store.ids[src],
+        "dst": store.ids[dst],
+        "time_s_fwd": fwd_t,
+        "time_s_ret": ret_t,
+        "time_penalty_s": ret_t - fwd_t,
+        "distance_km_fwd": fwd_d,
+        "distance_km_ret": ret_d,
+        "distance_penalty_km": np.round(ret_d - fwd_d, DISTANCE_DECIMALS),
+    })
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_abs = np.where(valid > 0, abs_sum / valid, np.nan)
+    points = pd.DataFrame({
+        "year": store.snapshot,
+        "id": store.ids,
+        "flagged_pairs": flagged_count,
+        "mean_abs_time_asym_s": np.round(mean_abs, 2),
+        "max_abs_time_asym_s": abs_max.astype(np.float64),
+    }).sort_values(["flagged_pairs", "mean_abs_time_asym_s"], ascending=False,
+                   kind="stable").reset_index(drop=True)
+
+    return pairs, points, int(flagged_count.sum()) // 2
+
+
+def main(top=10, max_pairs=ASYMMETRY_MAX_PAIRS, block_rows=BLOCK_ROWS):
+    all_pairs, all_points = [], []
+    for path in (MATRIX_2018_BIN, MATRIX_2025_BIN):
+        store = load_matrix(path)
+        t0 = time.perf_counter()
+        pairs, points, n_flagged = asymmetry(store, max_pairs=max_pairs, block_rows=block_rows)
+        elapsed = time.perf_counter() - t0
+        all_pairs.append(pairs)
+        all_points.append(points)
+
+        n_pairs = store.n * (store.n - 1) // 2
+        print("=" * 60)
+        print(f"ONE-WAY ASYMMETRY {store.snapshot} "
+              f"(|Δt| > {ASYMMETRY_TIME_S}s or |Δd| > {ASYMMETRY_DISTANCE_KM}km)")
+        print("=" * 60)
+        print(f"Flagged pairs: {n_flagged:,} / {n_pairs:,} ({elapsed:.2f}s for N={store.n:,})")
+        if len(pairs):
+            view = pairs.head(top).copy()
+            view["od"] = view["src"].astype(str) + "↔" + view["dst"].astype(str)
+            print(view[["od", "time_s_fwd", "time_penalty_s", "distance_penalty_km"]].to_string(index=False))
+        print("\nHighest asymmetry burden (points in most flagged pairs):")
+        print(points.head(top)[["id", "flagged_pairs", "mean_abs_time_asym_s",
+                                "max_abs_time_asym_s"]].to_string(index=False))
+        print()
+
+    pd.concat(all_pairs, ignore_index=True).to_csv(ASYMMETRY_PAIRS_CSV, index=False)
+    pd.concat(all_points, ignore_index=True).to_csv(ASYMMETRY_POINTS_CSV, index=False)
+    print(f"✅ {ASYMMETRY_PAIRS_CSV} and {ASYMMETRY_POINTS_CSV} saved")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Whole-matrix one-way asymmetry for both snapshots")
+    parser.add_argument("--top", type=int, default=10, help="Rows to print per table (default: 10)")
+    parser.add_argument("--max-pairs", type=int, default=ASYMMETRY_MAX_PAIRS,
+                        help=f"Worst flagged pairs written per snapshot, 0 = all (default: {ASYMMETRY_MAX_PAIRS})")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS,
+                        help=f"Rows compared per vectorized block (default: {BLOCK_ROWS})")
+    args = parser.parse_args()
+    main(top=args.top, max_pairs=args.max_pairs or None, block_rows=args.block_rows)
@@ -0,0 +1,212 @@
+"""
+Local stand-in for a Valhalla engine, for benchmarks.
+
+Serves /locate, /sources_to_targets, /matrix and /route with the response
+shapes the pipeline reads (locate as a list of {"edges": [...]}, matrix as
+{"sources_to_targets": [[{"time", "distance"}]]}, route as a trip with a
+polyline6 or GeoJSON shape). Travel times come from a haversine distance
+with a per-pair detour factor hashed from the coordinates, so results are
+deterministic and two servers with different --seed/--speed-kmh give a
+non-trivial 2018 -> 2025 delta. Latency, failure rate and the matrix size
+limit are configurable:
+
+    python -m benchmarks.mock_valhalla --port 8004 --latency-ms 20 --fail-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EARTH_R_M = 6371000.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dp = p2 - p1
+    dl = np.radians(lon2 - lon1)
+    x = np.sin(dp / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_R_M * np.arcsin(np.sqrt(np.minimum(x, 1.0)))
+
+
+def _unit_hash(*arrays) -> np.ndarray:
+    """Deterministic pseudo-random numbers in [0, 1) from coordinates."""
+    x = sum(np.asarray(a, dtype=np.float64) * k for a, k in zip(arrays, (12.9898, 78.233, 37.719, 4.581, 93.989)))
+    return np.modf(np.abs(np.sin(x) * 43758.5453))[0]
+
+
+def _encode(values) -> str:
+    out = []
+    for v in values:
+        v = ~(v << 1) if v < 0 else v << 1
+        while v >= 0x20:
+            out.append(chr((0x20 | (v & 0x1F)) + 63))
+            v >>= 5
+        out.append(chr(v + 63))
+    return "".join(out)
+
+
+def encode_polyline6(lats, lons) -> str:
+    ilat = np.round(np.asarray(lats) * 1e6).astype(np.int64)
+    ilon = np.round(np.asarray(lons) * 1e6).astype(np.int64)
+    d = np.column_stack((np.diff(ilat, prepend=0), np.diff(ilon, prepend=0))).ravel()
+    return _encode(d.tolist())
+
+
+class MockEngine:
+    """Response model and knobs shared by every request to one mock server."""
+
+    def __init__(self, latency_ms=5.0, jitter=0.5, ms_per_kpair=0.0, fail_rate=0.0,
+                 max_pairs=2500, speed_kmh=30.0, unreachable=0.002, snap_miss=0.1,
+                 vertex_m=50.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.ms_per_kpair = ms_per_kpair
+        self.fail_rate = fail_rate
+        self.max_pairs = max_pairs
+        self.speed_ms = speed_kmh / 3.6
+        self.unreachable = unreachable
+        self.snap_miss = snap_miss
+        self.vertex_m = vertex_m
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _delay(self, pairs: int = 0) -> None:
+        with self._lock:
+            u = self._rng.random()
+        ms = self.latency_ms * (1 + self.jitter * (2 * u - 1)) + self.ms_per_kpair * pairs / 1000
+        if ms > 0:
+            time.sleep(ms / 1000)
+
+    def _fails(self) -> bool:
+        if not self.fail_rate:
+            return False
+        with self._lock:
+            return self._rng.random() < self.fail_rate
+
+    def _detour(self, lat1, lon1, lat2, lon2):
+        return 1.2 + 0.4 * _unit_hash(lat1, lon1, lat2, lon2, self.seed)
+
+    def matrix(self, body: dict) -> tuple[int, dict]:
+        sources, targets = body.get("sources") or [], body.get("targets") or []
+        pairs = len(sources) * len(targets)
+        if pairs > self.max_pairs:
+            return 400, {"error_code": 154, "error": f"Exceeded max_matrix_location_pairs: {self.max_pairs}"}
+        self._delay(pairs)
+        slat = np.array([s["lat"] for s in sources])[:, None]
+        slon = np.array([s["lon"] for s in sources])[:, None]
+        tlat = np.array([t["lat"] for t in targets])[None, :]
+        tlon = np.array([t["lon"] for t in targets])[None, :]
+        dist = haversine_m(slat, slon, tlat, tlon) * self._detour(slat, slon, tlat, tlon)
+        time_s = np.round(dist / self.speed_ms)
+        dist_km = np.round(dist / 1000, 3)
+        missing = _unit_hash(tlat, tlon, slat, slon, self.seed + 1) < self.unreachable
+        missing &= dist > 0
+        rows = [[{"time": None, "distance": None} if m else {"time": int(t), "distance": float(d)}
+                 for t, d, m in zip(tr, dr, mr)]
+                for tr, dr, mr in zip(time_s.tolist(), dist_km.tolist(), missing.tolist())]
+        return 200, {"sources_to_targets": rows}
+
+    def locate(self, body: dict) -> tuple[int, list]:
+        locs = body.get("locations") or []
+        self._delay()
+        lat = np.array([l["lat"] for l in locs])
+        lon = np.array([l["lon"] for l in locs])
+        # Snap 0-60 m away in a hashed direction; a fraction of points miss every road
+        h = _unit_hash(lat, lon, self.seed)
+        off_m = 60 * _unit_hash(lon, lat, self.seed + 2)
+        slat = lat + off_m * np.cos(2 * np.pi * h) / 111320.0
+        slon = lon + off_m * np.sin(2 * np.pi * h) / (111320.0 * np.cos(np.radians(lat)))
+        out = []
+        for a, b, miss in zip(slat.tolist(), slon.tolist(), (h < self.snap_miss).tolist()):
+            out.append({"edges": [] if miss else [{"correlated_lat": round(a, 6), "correlated_lon": round(b, 6)}]})
+        return 200, out
+
+    def route(self, body: dict) -> tuple[int, dict]:
+        a, b = body["locations"][:2]
+        self._delay()
+        detour = float(self._detour(a["lat"], a["lon"], b["lat"], b["lon"]))
+        dist = float(haversine_m(a["lat"], a["lon"], b["lat"], b["lon"])) * detour
+        # L-shaped path (first along the longitude, then the latitude), one vertex per vertex_m
+        n = max(2, int(dist / self.vertex_m))
+        t = np.linspace(0, 1, n + 1)
+        first = t < 0.5
+        lat = np.where(first, a["lat"], a["lat"] + (b["lat"] - a["lat"]) * (2 * t - 1))
+        lon = np.where(first, a["lon"] + (b["lon"] - a["lon"]) * 2 * t, b["lon"])
+        if body.get("shape_format") == "geojson":
+            shape = {"type": "LineString", "coordinates": np.column_stack((lon, lat)).round(6).tolist()}
+        else:
+            shape = encode_polyline6(lat, lon)
+        summary = {"length": round(dist / 1000, 3), "time": round(dist / self.speed_ms, 1)}
+        return 200, {"trip": {"legs": [{"shape": shape, "summary": summary}], "summary": summary}}
+
+    def handle(self, path: str, body: dict) -> tuple[int, object]:
+        if path in ("/sources_to_targets", "/matrix"):
+            handler = self.matrix
+        elif path == "/locate":
+            handler = self.locate
+        elif path == "/route":
+            handler = self.route
+        else:
+            return 404, {"error": f"no such endpoint: {path}"}
+        if self._fails():
+            self._delay()
+            return 503, {"error": "mock failure"}
+        return handler(body)
+
+
+def make_server(engine: MockEngine, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, like the real engines (the client pools connections)
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                code, out = engine.handle(self.path, body)
+            except (ValueError, KeyError, TypeError) as e:
+                code, out = 400, {"error": f"bad request: {e}"}
+            data = json.dumps(out).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock Valhalla engine for benchmarks")
+    parser.add_argument("--port", type=int, default=8004)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Mean latency per request (default: 5)")
+    parser.add_argument("--jitter", type=float, default=0.5,
+                        help="Latency spread, as a fraction of --latency-ms (default: 0.5)")
+    parser.add_argument("--ms-per-kpair", type=float, default=0.0,
+                        help="Extra matrix latency per 1,000 pairs (default: 0)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered 503 (default: 0)")
+    parser.add_argument("--max-pairs", type=int, default=2500,
+                        help="Matrix size limit; larger requests get error 154 (default: 2500)")
+    parser.add_argument("--speed-kmh", type=float, default=30.0, help="Travel speed (default: 30)")
+    parser.add_argument("--unreachable", type=float, default=0.002,
+                        help="Fraction of matrix cells with no route (default: 0.002)")
+    parser.add_argument("--snap-miss", type=float, default=0.1,
+                        help="Fraction of /locate points that snap to nothing (default: 0.1)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the detours and failures (default: 0)")
+    args = parser.parse_args()
+
+    engine = MockEngine(latency_ms=args.latency_ms, jitter=args.jitter, ms_per_kpair=args.ms_per_kpair,
+                        fail_rate=args.fail_rate, max_pairs=args.max_pairs, speed_kmh=args.speed_kmh,
+                        unreachable=args.unreachable, snap_miss=args.snap_miss, seed=args.seed)
+    server = make_server(engine, args.port)
+    print(f"✅ mock Valhalla on http://127.0.0.1:{args.port}", flush=True)
+    server.serve_forever()
@@ -0,0 +1,305 @@
+"""
+End-to-end benchmarks against two mock engines (benchmarks/mock_valhalla.py).
+
+For each point count N, in a scratch directory: generate and snap N points
+(generate_points.py), build both matrices (run_matrix_and_delta.py), stream
+the delta (delta_stream.py), run the bootstrap behind analysis.py, and
+render the route comparison map (draw_compare_routes.py). Every stage is
+timed; request latencies come from metrics.py. Results are written as JSON
+named after the commit, and --compare prints the change between two runs:
+
+    python -m benchmarks.run_benchmarks --sizes 50 500
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+SIZES = (50, 500, 5000)
+STAGES = ("points", "matrix", "delta", "analysis", "map")
+
+# The 2025 engine is a little faster, with other detours, so the delta is not trivial
+ENGINES = {"2018": {"speed_kmh": 28.0, "seed": 2018}, "2025": {"speed_kmh": 30.0, "seed": 2025}}
+
+# Bootstrap resamples in the analysis stage (the full 10,000 dominates at large N)
+ANALYSIS_RESAMPLES = 200
+
+# A slower stage is flagged by --compare above this ratio
+REGRESSION_RATIO = 1.10
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mocks(args) -> tuple[dict, list]:
+    """Two mock engines in their own processes (so they do not share the client's GIL)."""
+    urls, procs = {}, []
+    for year, knobs in ENGINES.items():
+        port = _free_port()
+        cmd = [sys.executable, "-m", "benchmarks.mock_valhalla", "--port", str(port),
+               "--latency-ms", str(args.latency_ms), "--ms-per-kpair", str(args.ms_per_kpair),
+               "--fail-rate", str(args.fail_rate), "--max-pairs", str(args.max_pairs),
+               "--speed-kmh", str(knobs["speed_kmh"]), "--seed", str(knobs["seed"])]
+        procs.append(subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL))
+        urls[year] = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 10
+    for url in urls.values():
+        port = int(url.rsplit(":", 1)[1])
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    stop_mocks(procs)
+                    raise RuntimeError(f"mock engine on {url} did not start")
+                time.sleep(0.05)
+    return urls, procs
+
+
+def stop_mocks(procs: list) -> None:
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.wait()
+
+
+def point_engines(urls: dict) -> None:
+    """Send every pipeline module to the mock engines instead of the configured ones."""
+    import draw_compare_routes
+    import generate_points
+    import run_matrix_and_delta
+
+    run_matrix_and_delta.BASE_2018 = urls["2018"]
+    run_matrix_and_delta.BASE_2025 = urls["2025"]
+    generate_points.VALHALLA_2025 = urls["2025"]
+    draw_compare_routes.BASE_2018 = urls["2018"]
+    draw_compare_routes.BASE_2025 = urls["2025"]
+
+
+def _stage_points(n: int, seed: int) -> dict:
+    import generate_points
+    from config import POINTS_CSV, POINTS_DATA_CSV
+
+    generate_points.main(n=n, seed=seed, max_tries=max(8000, 20 * n))
+    df = pd.read_csv(POINTS_DATA_CSV)
+    df.to_csv(POINTS_CSV, index=False)
+    return {"points": len(df)}
+
+
+def _stage_matrix(max_pairs: int) -> dict:
+    import run_matrix_and_delta
+    from config import MATRIX_2018_BIN, MATRIX_2025_BIN
+    from matrix_store import load_matrix
+
+    run_matrix_and_delta.main(max_pairs=max_pairs)
+    m = load_matrix(MATRIX_2025_BIN)
+    return {"cells": m.n * m.n,
+            "null_2018": int(np.isnan(load_matrix(MATRIX_2018_BIN).time_s).sum()),
+            "null_2025": int(np.isnan(m.time_s).sum())}
+
+
+def _stage_delta() -> dict:
+    from config import MATRIX_2018_BIN, MATRIX_2025_BIN
+    from delta_stream import delta_stats, store_chunks
+    from matrix_store import load_matrix
+
+    summary = delta_stats(store_chunks(load_matrix(MATRIX_2018_BIN), load_matrix(MATRIX_2025_BIN))).summary()
+    return {"median_delta_time_s": summary["median_delta_time_s"]}
+
+
+def _stage_analysis(resamples: int) -> dict:
+    from bootstrap import bootstrap
+    from config import MATRIX_2018_BIN, MATRIX_2025_BIN
+
+    ci = bootstrap(MATRIX_2018_BIN, MATRIX_2025_BIN, resamples=resamples, workers=1)
+    return {"resamples": resamples, "statistics": len(ci)}
+
+
+def _stage_map(top_k: int, stream: bool) -> dict:
+    import draw_compare_routes
+
+    draw_compare_routes.main(top_k=top_k, use_cache=False, stream=stream)
+    return {"html_kb": round(os.path.getsize(draw_compare_routes.OUT_HTML) / 1024, 1)}
+
+
+def _size_worker(n: int, args, urls: dict, work: str, conn) -> None:
+    """Run every stage for one N, sending ("stage" | "error" | "done", ...) messages as it goes."""
+    import metrics
+
+    sys.path.insert(0, ROOT)
+    point_engines(urls)
+    # Pipeline files are relative to the working directory, so every run is in scratch space
+    os.chdir(work)
+    metrics.enable()
+    stages = {
+        "points": lambda: _stage_points(n, args.seed),
+        "matrix": lambda: _stage_matrix(args.max_pairs),
+        "delta": _stage_delta,
+        "analysis": lambda: _stage_analysis(args.resamples),
+        "map": lambda: _stage_map(args.top_k, args.stream_map),
+    }
+    for name in args.stages:
+        t0 = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                info = stages[name]()
+        except Exception as e:
+            conn.send(("error", name, f"{type(e).__name__}: {e}"))
+            break
+        conn.send(("stage", name, {"seconds": round(time.perf_counter() - t0, 4), **info}))
+    conn.send(("done", metrics.snapshot()["requests"],
+               round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)))
+
+
+def run_size(n: int, args, urls: dict, work: str) -> dict:
+    """
+    One N in a child process, so its peak memory is its own and a crash
+    (e.g. the OOM killer) is recorded instead of ending the benchmark.
+    """
+    out = {"n": n, "stages": {}}
+    ctx = multiprocessing.get_context("fork")
+    recv, send = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_size_worker, args=(n, args, urls, work, send))
+    proc.start()
+    send.close()
+    stage = None
+    while True:
+        try:
+            msg = recv.recv()
+        except EOFError:
+            pending = [s for s in args.stages if s not in out["stages"]]
+            out["error"] = f"worker died (exit code {proc.exitcode}) during {pending[0] if pending else 'cleanup'}"
+            print(f"  ⚠️ N={n:,} {out['error']}")
+            break
+        if msg[0] == "stage":
+            _, stage, info = msg
+            out["stages"][stage] = info
+            print(f"  N={n:,} {stage}: {info['seconds']:.2f}s "
+                  f"{ {k: v for k, v in info.items() if k != 'seconds'} }")
+        elif msg[0] == "error":
+            out["error"] = f"{msg[1]}: {msg[2]}"
+            print(f"  ⚠️ N={n:,} {out['error']}")
+        else:
+            out["requests"], out["peak_rss_mb"] = msg[1], msg[2]
+            break
+    proc.join()
+    return out
+
+
+def _git(*cmd) -> str:
+    try:
+        return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def environment(args) -> dict:
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "mock": {"latency_ms": args.latency_ms, "ms_per_kpair": args.ms_per_kpair,
+                 "fail_rate": args.fail_rate, "max_pairs": args.max_pairs, "engines": ENGINES},
+        "seed": args.seed,
+    }
+
+
+def run(args) -> str:
+    result = environment(args)
+    result["runs"] = []
+    urls, procs = start_mocks(args)
+    work = tempfile.mkdtemp(prefix="hcm_bench_")
+    try:
+        for n in sorted(args.sizes):
+            print(f"N={n:,}")
+            os.makedirs(os.path.join(work, str(n)))
+            result["runs"].append(run_size(n, args, urls, os.path.join(work, str(n))))
+    finally:
+        stop_mocks(procs)
+        shutil.rmtree(work, ignore_errors=True)
+
+    path = args.out or os.path.join(
+        RESULTS_DIR, f"{time.strftime('%Y%m%d_%H%M%S')}_{(result['commit'] or 'nogit')[:10]}.json")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"✅ results saved to {path}")
+    return path
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Per size and stage: old and new seconds, and the ratio (flagged above REGRESSION_RATIO)."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('commit', '')[:10]} -> {new.get('commit', '')[:10]}")
+    old_runs = {r["n"]: r for r in old["runs"]}
+    for r in new["runs"]:
+        base = old_runs.get(r["n"])
+        if base is None:
+            continue
+        for label, run in (("old", base), ("new", r)):
+            if "error" in run:
+                print(f"  ⚠️ N={r['n']:,} {label}: {run['error']}")
+        for name, st in r["stages"].items():
+            if name not in base["stages"]:
+                continue
+            a, b = base["stages"][name]["seconds"], st["seconds"]
+            ratio = b / a if a else float("inf")
+            flag = "  ⚠️ slower" if ratio > REGRESSION_RATIO else ""
+            print(f"  N={r['n']:>6,} {name:<9} {a:9.2f}s -> {b:9.2f}s  x{ratio:.2f}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmarks against mock engines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES),
+                        help="Point counts to run (default: %(default)s)")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES),
+                        help="Stages to run, in pipeline order (default: all)")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="Mock latency per request (default: 5)")
+    parser.add_argument("--ms-per-kpair", type=float, default=0.0,
+                        help="Extra mock matrix latency per 1,000 pairs (default: 0)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Mock 503 rate (default: 0)")
+    parser.add_argument("--max-pairs", type=int, default=2500, help="Matrix pairs per request (default: 2500)")
+    parser.add_argument("--resamples", type=int, default=ANALYSIS_RESAMPLES,
+                        help=f"Bootstrap resamples in the analysis stage (default: {ANALYSIS_RESAMPLES})")
+    parser.add_argument("--top-k", type=int, default=10, help="OD pairs drawn in the map stage (default: 10)")
+    parser.add_argument("--stream-map", action="store_true",
+                        help="Map stage with the streaming writer (draw --stream) instead of folium")
+    parser.add_argument("--seed", type=int, default=42, help="Point generation seed (default: 42)")
+    parser.add_argument("--out", default=None, help=f"Results file (default: {RESULTS_DIR}/<time>_<commit>.json)")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two results files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
@@ -0,0 +1,69 @@
+"""
+Startup time of the command line (cli.py).
+
+Each command runs in a fresh interpreter --repeat times; the median wall
+time is reported next to a bare `python -c pass`, so the overhead of our
+own imports is visible apart from the interpreter's. The light commands
+(--help of the CLI and of every subcommand) must stay under BUDGET_MS;
+the heavy rows show what a subcommand pays in imports before it starts
+working:
+
+    python -m benchmarks.startup --repeat 20
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Light commands above this (median, including the interpreter) fail the run
+BUDGET_MS = 100.0
+
+SUBCOMMAND_MODULES = {
+    "points": "generate_points",
+    "matrix": "run_matrix_and_delta",
+    "delta": "run_matrix_and_delta",
+    "analyze": "analysis",
+    "draw": "draw_compare_routes",
+    "serve": "od_service",
+}
+
+
+def time_command(args: list[str], repeat: int) -> float:
+    """Median wall time of `python <args>` in milliseconds."""
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        runs.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(runs)
+
+
+def main(repeat=10) -> bool:
+    baseline = time_command(["-c", "pass"], repeat)
+    light = [("cli --help", ["-m", "cli", "--help"])]
+    light += [(f"cli {name} --help", ["-m", "cli", name, "--help"]) for name in SUBCOMMAND_MODULES]
+    heavy = [(f"import {module}", ["-c", f"import {module}"])
+             for module in dict.fromkeys(SUBCOMMAND_MODULES.values())]
+
+    print(f"Median of {repeat} runs; bare interpreter {baseline:.1f} ms\n")
+    print(f"  {'command':<28} {'ms':>8} {'over bare':>10}")
+    ok = True
+    for label, args in light + heavy:
+        ms = time_command(args, repeat)
+        flag = ""
+        if (label, args) in light and ms > BUDGET_MS:
+            ok, flag = False, f"  ⚠️ over {BUDGET_MS:.0f} ms"
+        print(f"  {label:<28} {ms:8.1f} {ms - baseline:+10.1f}{flag}")
+    print(f"\n{'✅' if ok else '⚠️ '} light commands {'within' if ok else 'over'} {BUDGET_MS:.0f} ms")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Startup time of the cli.py commands")
+    parser.add_argument("--repeat", type=int, default=10, help="Runs per command (default: 10)")
+    args = parser.parse_args()
+    sys.exit(0 if main(args.repeat) else 1)
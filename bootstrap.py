@@ -0,0 +1,180 @@
+"""
+Bootstrap confidence intervals for the headline deltas.
+
+Points (not OD cells) are resampled with replacement, so a resample is the
+full matrix over the drawn points, repeats included. With w the per-point
+draw counts, the resample mean is w.D.w / w.V.w (V = valid cells), computed
+for a batch of resamples with two matrix products. Medians walk the valid
+cells in value order with weight w[src] * w[dst]; only a band of ranks
+around the full-sample median is walked, with the mass below the band again
+from a matrix product. Resamples run in fixed-size tasks seeded from
+SeedSequence.spawn, spread over a process pool, so results depend only on
+the seed.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import MATRIX_2018_BIN, MATRIX_2025_BIN, BOOTSTRAP_RESAMPLES, BOOTSTRAP_SEED, BOOTSTRAP_LEVEL
+from matrix_store import load_matrix, DISTANCE_DECIMALS
+
+VARIABLES = ("delta_time_s", "delta_distance_km")
+
+# Resamples per task (fixed, so the random streams do not depend on the pool size)
+TASK_RESAMPLES = 100
+
+# Median band: cells within this fraction of the median rank on either side
+MEDIAN_BAND = 0.04
+
+
+def delta_matrices(m_a, m_b) -> dict:
+    """N x N float64 deltas (NaN = no route in either year), as in delta_frame."""
+    if m_a.meta["points_hash"] != m_b.meta["points_hash"]:
+        raise ValueError(f"{m_a.path} and {m_b.path} were computed on different point sets")
+    ta = np.asarray(m_a.time_s, dtype=np.float64)
+    tb = np.asarray(m_b.time_s, dtype=np.float64)
+    da = np.round(np.asarray(m_a.distance_km, dtype=np.float64), DISTANCE_DECIMALS)
+    db = np.round(np.asarray(m_b.distance_km, dtype=np.float64), DISTANCE_DECIMALS)
+    return {"delta_time_s": tb - ta, "delta_distance_km": db - da}
+
+
+class _Variable:
+    """Per-variable arrays shared by every resample."""
+
+    def __init__(self, d: np.ndarray, band: float = MEDIAN_BAND):
+        n = d.shape[0]
+        valid = ~np.isnan(d)
+        self.n = n
+        self.valid = valid.astype(np.float64)
+        self.values0 = np.where(valid, d, 0.0)
+
+        flat = np.flatnonzero(valid)
+        order = flat[np.argsort(d.ravel()[flat], kind="stable")]
+        self.sorted = d.ravel()[order]
+        self.src = (order // n).astype(np.int32)
+        self.dst = (order % n).astype(np.int32)
+
+        # Band of sorted positions around the median; cells before it are
+        # counted with a matrix product, cells inside it one by one
+        m = len(order)
+        self.lo = max(0, int(m * (0.5 - band)))
+        self.hi = min(m, int(m * (0.5 + band)) + 1)
+        below = np.zeros(n * n)
+        below[order[:self.lo]] = 1.0
+        self.below = below.reshape(n, n)
+
+    def _at_ranks(self, w: np.ndarray, ranks, start: int, stop: int, offset: int):
+        """Values at the given weighted ranks within sorted[start:stop], or None if outside."""
+        cum = offset + np.cumsum(w[self.src[start:stop]] * w[self.dst[start:stop]])
+        pos = np.searchsorted(cum, ranks, side="right")
+        if (pos >= len(cum)).any():
+            return None
+        return self.sorted[start + pos]
+
+    def stats(self, w: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Mean and median of the resample for each row of draw counts w (B x N)."""
+        total = np.einsum("bi,bi->b", w @ self.valid, w)
+        mean = np.einsum("bi,bi->b", w @ self.values0, w) / total
+        below = np.einsum("bi,bi->b", w @ self.below, w)
+
+        wi = w.astype(np.int64)
+        median = np.empty(len(w))
+        for k in range(len(w)):
+            t = int(total[k])
+            # Two middle ranks (equal for an odd count), averaged like pandas
+            ranks = np.array([(t - 1) // 2, t // 2])
+            v = None
+            if below[k] <= ranks[0]:
+                v = self._at_ranks(wi[k], ranks, self.lo, self.hi, int(below[k]))
+            if v is None:
+                v = self._at_ranks(wi[k], ranks, 0, len(self.sorted), 0)
+            median[k] = (v[0] + v[1]) / 2
+        return mean, median
+
+
+_variables = {}
+
+
+def _init(path_a: str, path_b: str) -> None:
+    deltas = delta_matrices(load_matrix(path_a), load_matrix(path_b))
+    for name in VARIABLES:
+        _variables[name] = _Variable(deltas[name])
+
+
+def _task(seed: np.random.SeedSequence, count: int) -> np.ndarray:
+    """(count, 2 * len(VARIABLES)) resampled [mean, median] per variable."""
+    n = next(iter(_variables.values())).n
+    rng = np.random.default_rng(seed)
+    w = rng.multinomial(n, np.full(n, 1.0 / n), size=count).astype(np.float64)
+    out = []
+    for name in VARIABLES:
+        out.extend(_variables[name].stats(w))
+    return np.column_stack(out)
+
+
+def _estimate(n: int) -> list:
+    """Statistics of the full sample (every point drawn once)."""
+    w = np.ones((1, n))
+    out = []
+    for name in VARIABLES:
+        out.extend(float(s[0]) for s in _variables[name].stats(w))
+    return out
+
+
+def bootstrap(path_a=MATRIX_2018_BIN, path_b=MATRIX_2025_BIN, resamples=BOOTSTRAP_RESAMPLES,
+              seed=BOOTSTRAP_SEED, level=BOOTSTRAP_LEVEL, workers=None) -> pd.DataFrame:
+    """
+    Percentile confidence intervals for mean and median delta_time_s and
+    delta_distance_km. One row per statistic: estimate (all points), ci_low, ci_high.
+    """
+    counts = [TASK_RESAMPLES] * (resamples // TASK_RESAMPLES)
+    if resamples % TASK_RESAMPLES:
+        counts.append(resamples % TASK_RESAMPLES)
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    workers = min(workers or os.cpu_count() or 1, len(counts))
+
+    _init(path_a, path_b)
+    n = next(iter(_variables.values())).n
+    estimate = _estimate(n)
+    if workers <= 1:
+        results = [_task(s, c) for s, c in zip(seeds, counts)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init,
+                                 initargs=(path_a, path_b)) as pool:
+            results = list(pool.map(_task, seeds, counts))
+    samples = np.vstack(results)
+
+    alpha = (1 - level) / 2
+    rows = []
+    for k, (name, stat) in enumerate((v, s) for v in VARIABLES for s in ("mean", "median")):
+        lo, hi = np.quantile(samples[:, k], [alpha, 1 - alpha])
+        rows.append({"statistic": f"{stat}_{name}", "estimate": estimate[k], "ci_low": lo, "ci_high": hi})
+    return pd.DataFrame(rows)
+
+
+def print_report(ci: pd.DataFrame, resamples: int, level: float) -> None:
+    print("=" * 60)
+    print(f"BOOTSTRAP CONFIDENCE INTERVALS ({level:.0%}, {resamples:,} point resamples)")
+    print("=" * 60)
+    for r in ci.itertuples(index=False):
+        print(f"{r.statistic}: {r.estimate:.3f}  [{r.ci_low:.3f}, {r.ci_high:.3f}]")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap CIs for the 2018 -> 2025 deltas (resampling points)")
+    parser.add_argument("--resamples", type=int, default=BOOTSTRAP_RESAMPLES,
+                        help=f"Number of point resamples (default: {BOOTSTRAP_RESAMPLES})")
+    parser.add_argument("--seed", type=int, default=BOOTSTRAP_SEED, help=f"Random seed (default: {BOOTSTRAP_SEED})")
+    parser.add_argument("--level", type=float, default=BOOTSTRAP_LEVEL,
+                        help=f"Confidence level (default: {BOOTSTRAP_LEVEL})")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    ci = bootstrap(resamples=args.resamples, seed=args.seed, level=args.level, workers=args.workers)
+    print_report(ci, args.resamples, args.level)
+    print(f"✅ {args.resamples:,} resamples in {time.perf_counter() - t0:.1f}s")
@@ -0,0 +1,268 @@
+"""
+Build the snapshots in config.SNAPSHOTS: cut each year's extract for
+config.BBOX_STR with osmium, then build its routing tiles with the Valhalla
+image (serve_tiles=False), all years in parallel.
+
+Every step is keyed by the hashes of its inputs: the extract by the source
+PBF's hash, the bounding box and the osmium options; the tiles by the
+extract's hash, the valhalla.json hash and the image. A step whose key
+matches the manifest (snapshots.json) and whose output is still on disk is
+skipped, so changing the bounding box or one year's config rebuilds only
+what depends on it. The tile key is the snapshot's tileset_id, which
+valhalla_client.engine_id() reports for every engine serving those tiles,
+so matrix stores and cached routes record which tile set produced them.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import BBOX_STR, SNAPSHOTS, SNAPSHOT_MANIFEST, VALHALLA_IMAGE
+
+# osmium extract options that shape the output (part of the extract key)
+EXTRACT_STRATEGY = "complete_ways"
+
+# Tile artifacts the image writes into the custom_files directory
+TILE_ARTIFACTS = ("valhalla_tiles.tar", "valhalla_tiles")
+
+HASH_CHUNK = 1 << 20
+
+_manifest_lock = threading.Lock()
+
+
+# =============================================================================
+# Manifest and hashing
+# =============================================================================
+
+def load_manifest(path: str = SNAPSHOT_MANIFEST) -> dict:
+    if not os.path.exists(path):
+        return {"snapshots": {}, "hashes": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, path: str = SNAPSHOT_MANIFEST) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def file_sha256(path: str, memo: dict | None = None) -> str:
+    """
+    sha256 of a file. With a memo (the manifest's "hashes"), a file whose
+    size and mtime are unchanged is not read again.
+    """
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    seen = (memo or {}).get(key)
+    if seen and seen["size"] == st.st_size and seen["mtime_ns"] == st.st_mtime_ns:
+        return seen["sha256"]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK):
+            h.update(chunk)
+    digest = h.hexdigest()
+    if memo is not None:
+        with _manifest_lock:
+            memo[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}
+    return digest
+
+
+def _key(**parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _paths(year: int) -> dict:
+    snap = SNAPSHOTS[year]
+    return {
+        "dir": snap["dir"],
+        "source": snap.get("source"),
+        "extract": os.path.join(snap["dir"], f"hcm_{year}.osm.pbf"),
+        "config": os.path.join(snap["dir"], "valhalla.json"),
+    }
+
+
+def _tiles_present(snap_dir: str) -> bool:
+    return any(os.path.exists(os.path.join(snap_dir, a)) for a in TILE_ARTIFACTS)
+
+
+# =============================================================================
+# Build steps
+# =============================================================================
+
+def extract_key(source_sha: str, bbox: str) -> str:
+    return _key(source=source_sha, bbox=bbox, strategy=EXTRACT_STRATEGY)
+
+
+def tiles_key(extract_sha: str, config_sha: str, image: str) -> str:
+    return _key(extract=extract_sha, config=config_sha, image=image)
+
+
+def _run(cmd: list[str], label: str) -> None:
+    print(f"  [{label}] {' '.join(cmd)}")
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"[{label}] {cmd[0]} failed ({result.returncode}):\n{result.stderr[-2000:]}")
+
+
+def build_extract(year: int, manifest: dict, force: bool = False, dry_run: bool = False) -> dict:
+    """Cut hcm_<year>.osm.pbf from the source extract unless its key is unchanged."""
+    p = _paths(year)
+    entry = manifest["snapshots"].get(str(year), {}).get("extract", {})
+    if not p["source"] or not os.path.exists(p["source"]):
+        # No source to cut from: the extract in custom_<year>/ is the input as it is
+        if not os.path.exists(p["extract"]):
+            raise FileNotFoundError(f"[{year}] neither the source {p['source']} nor {p['extract']} exists")
+        sha = file_sha256(p["extract"], manifest["hashes"])
+        return {"path": p["extract"], "sha256": sha, "key": None, "status": "given"}
+
+    key = extract_key(file_sha256(p["source"], manifest["hashes"]), BBOX_STR)
+    if (not force and entry.get("key") == key and os.path.exists(p["extract"])
+            and file_sha256(p["extract"], manifest["hashes"]) == entry.get("sha256")):
+        return {**entry, "status": "cached"}
+    if dry_run:
+        return {**entry, "key": key, "status": "would build"}
+    if shutil.which("osmium") is None:
+        raise RuntimeError("osmium not found (brew install osmium-tool / apt install osmium-tool)")
+    t0 = time.perf_counter()
+    _run(["osmium", "extract", "-b", BBOX_STR, "-s", EXTRACT_STRATEGY, "--overwrite",
+          p["source"], "-o", p["extract"]], f"{year} extract")
+    return {"path": p["extract"], "sha256": file_sha256(p["extract"], manifest["hashes"]), "key": key,
+            "bbox": BBOX_STR, "source": p["source"], "seconds": round(time.perf_counter() - t0, 1),
+            "status": "built"}
+
+
+def build_tiles(year: int, extract: dict, manifest: dict, force: bool = False, dry_run: bool = False) -> dict:
+    """Build the year's tiles with the Valhalla image unless the tile key is unchanged."""
+    p = _paths(year)
+    entry = manifest["snapshots"].get(str(year), {}).get("tiles", {})
+    config_sha = file_sha256(p["config"], manifest["hashes"])
+    key = tiles_key(extract["sha256"], config_sha, VALHALLA_IMAGE)
+    if not force and entry.get("key") == key and _tiles_present(p["dir"]):
+        return {**entry, "status": "cached"}
+    if dry_run:
+        return {**entry, "key": key, "status": "would build"}
+    if shutil.which("docker") is None:
+        raise RuntimeError("docker not found; it runs the tile build")
+    t0 = time.perf_counter()
+    _run(["docker", "run", "--rm",
+          "-v", f"{os.path.abspath(p['dir'])}:/custom_files",
+          "-e", f"tile_urls=/custom_files/{os.path.basename(p['extract'])}",
+          "-e", "serve_tiles=False", "-e", "force_rebuild=True", "-e", "build_elevation=false",
+          VALHALLA_IMAGE], f"{year} tiles")
+    return {"key": key, "extract_sha256": extract["sha256"], "config_sha256": config_sha,
+            "image": VALHALLA_IMAGE, "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "seconds": round(time.perf_counter() - t0, 1), "status": "built"}
+
+
+def build_year(year: int, manifest: dict, force: bool = False, dry_run: bool = False) -> dict:
+    extract = build_extract(year, manifest, force, dry_run)
+    if extract["status"] == "would build":
+        # Its hash is unknown until it exists, so the tiles will follow
+        return {"extract": extract, "tiles": {"status": "would build"}}
+    tiles = build_tiles(year, extract, manifest, force, dry_run)
+    return {"extract": extract, "tiles": tiles}
+
+
+def build(years=None, jobs=None, force=False, dry_run=False, manifest_path=SNAPSHOT_MANIFEST) -> dict:
+    years = sorted(years or SNAPSHOTS)
+    manifest = load_manifest(manifest_path)
+    print(f"Snapshots {', '.join(map(str, years))} for bbox {BBOX_STR}")
+
+    results, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=jobs or len(years)) as pool:
+        futures = {year: pool.submit(build_year, year, manifest, force, dry_run) for year in years}
+        for year, fut in futures.items():
+            try:
+                results[year] = fut.result()
+            except (OSError, RuntimeError) as e:
+                failed[year] = e
+                print(f"⚠️  {year}: {e}")
+
+    for year, r in results.items():
+        print(f"{'✅' if r['tiles']['status'] != 'would build' else '  '} {year}: "
+              f"extract {r['extract']['status']}, tiles {r['tiles']['status']}"
+              + (f" (tileset {r['tiles']['key']})" if r["tiles"].get("key") else ""))
+        if dry_run:
+            continue
+        entry = {"dir": SNAPSHOTS[year]["dir"], "replicas": SNAPSHOTS[year]["replicas"],
+                 "extract": {k: v for k, v in r["extract"].items() if k != "status"},
+                 "tiles": {k: v for k, v in r["tiles"].items() if k != "status"}}
+        entry["tileset_id"] = entry["tiles"]["key"]
+        manifest["snapshots"][str(year)] = entry
+    if not dry_run:
+        # Years that did build are recorded even when another one failed
+        save_manifest(manifest, manifest_path)
+        print(f"✅ {manifest_path} saved")
+    if failed:
+        raise RuntimeError(f"snapshot build failed for {sorted(failed)}")
+    return manifest
+
+
+# =============================================================================
+# Checks used by the matrix / route stages
+# =============================================================================
+
+def _snapshot_year(base_url: str):
+    url = base_url.rstrip("/")
+    for year, snap in SNAPSHOTS.items():
+        if url in (u.rstrip("/") for u in snap["replicas"]):
+            return year
+    return None
+
+
+def tileset_id(base_url: str, manifest_path: str = SNAPSHOT_MANIFEST) -> str | None:
+    """Tile set of the snapshot served at base_url, per the manifest (None without one)."""
+    year = _snapshot_year(base_url)
+    if year is None or not os.path.exists(manifest_path):
+        return None
+    return load_manifest(manifest_path)["snapshots"].get(str(year), {}).get("tileset_id")
+
+
+def check_snapshots(base_urls, manifest_path: str = SNAPSHOT_MANIFEST) -> bool:
+    """
+    Warn about snapshots whose extract or valhalla.json changed since their
+    tiles were built (so the engine may serve tiles that no longer match).
+    Returns True when every snapshot in the manifest is current.
+    """
+    if not os.path.exists(manifest_path):
+        return True
+    manifest = load_manifest(manifest_path)
+    ok = True
+    for base in base_urls:
+        year = _snapshot_year(base)
+        entry = manifest["snapshots"].get(str(year)) if year is not None else None
+        if not entry:
+            continue
+        p = _paths(year)
+        changed = []
+        for name, recorded in (("extract", entry["tiles"].get("extract_sha256")),
+                               ("config", entry["tiles"].get("config_sha256"))):
+            if os.path.exists(p[name]) and file_sha256(p[name], manifest["hashes"]) != recorded:
+                changed.append(os.path.basename(p[name]))
+        if changed:
+            ok = False
+            print(f"⚠️  {year}: {', '.join(changed)} changed since tileset {entry['tileset_id']} was built; "
+                  f"run build_snapshots.py and restart the engine")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract and build routing tiles for every snapshot")
+    parser.add_argument("--years", type=int, nargs="+", default=None,
+                        help=f"Snapshots to build (default: all of {sorted(SNAPSHOTS)})")
+    parser.add_argument("--jobs", type=int, default=None, help="Years built at once (default: all)")
+    parser.add_argument("--force", action="store_true", help="Rebuild even when the inputs are unchanged")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be rebuilt")
+    parser.add_argument("--manifest", default=SNAPSHOT_MANIFEST,
+                        help=f"Manifest file (default: {SNAPSHOT_MANIFEST})")
+    args = parser.parse_args()
+
+    build(years=args.years, jobs=args.jobs, force=args.force, dry_run=args.dry_run,
+          manifest_path=args.manifest)
@@ -0,0 +1,144 @@
+"""
+One entry point for the 2018 -> 2025 workflow:
+
+    python -m cli points --n 50        # generate_points.py
+    python -m cli matrix --tiled       # run_matrix_and_delta.py
+    python -m cli delta --csv          # summary of the existing stores, no engine calls
+    python -m cli analyze              # analysis.py
+    python -m cli draw --top-k 10      # draw_compare_routes.py
+    python -m cli serve                # od_service.py
+
+This module only imports argparse, config and metrics. Each subcommand's
+module (and with it pandas, requests, folium...) is imported after the
+arguments are parsed, so --help and argument errors return immediately.
+The scripts build their parsers from the same functions, so
+`python run_matrix_and_delta.py --tiled` keeps working with the same flags.
+"""
+import argparse
+import importlib
+
+import metrics
+from config import (
+    MIN_LON, MIN_LAT, MAX_LON, MAX_LAT, MATRIX_TILES_DIR, SWEEP_DATE, SWEEP_TIMES, SWEEP_2018_BIN,
+    SWEEP_2025_BIN, BOOTSTRAP_RESAMPLES, BOOTSTRAP_SEED, BOOTSTRAP_LEVEL, MAP_TOLERANCE_PX, MAP_MAX_ZOOM,
+    SNAPSHOTS, OD_SERVICE_PORT, OD_RELOAD_S,
+)
+
+
+def points_arguments(parser) -> None:
+    parser.add_argument("--n", type=int, default=50, help="Number of points to generate (default: 50)")
+    parser.add_argument("--min-lon", type=float, default=MIN_LON, help=f"Minimum longitude (default: {MIN_LON})")
+    parser.add_argument("--min-lat", type=float, default=MIN_LAT, help=f"Minimum latitude (default: {MIN_LAT})")
+    parser.add_argument("--max-lon", type=float, default=MAX_LON, help=f"Maximum longitude (default: {MAX_LON})")
+    parser.add_argument("--max-lat", type=float, default=MAX_LAT, help=f"Maximum latitude (default: {MAX_LAT})")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument("--max-snap-m", type=float, default=40, help="Maximum snap distance in meters (default: 40)")
+    parser.add_argument("--max-tries", type=int, default=8000, help="Maximum attempts to generate points (default: 8000)")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Locations per /locate request (default: engine max_locations; 0 = one request per candidate)")
+    parser.add_argument("--snapper", choices=["valhalla", "local"], default="valhalla",
+                        help="Snap with /locate on the 2025 engine, or offline against the OSM extracts")
+    metrics.add_arguments(parser)
+
+
+def matrix_arguments(parser) -> None:
+    parser.add_argument("--tiled", action="store_true",
+                        help="Force tiled mode (automatic when N*N exceeds the engine limit)")
+    parser.add_argument("--max-pairs", type=int, default=None,
+                        help="Pairs per tile (default: max_matrix_location_pairs from valhalla.json)")
+    parser.add_argument("--checkpoint-dir", default=MATRIX_TILES_DIR,
+                        help=f"Directory for finished tiles, used to resume (default: {MATRIX_TILES_DIR})")
+    parser.add_argument("--csv", action="store_true",
+                        help="Also export the long-format matrix_2018/2025/delta CSVs")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse the existing stores; only request rows/columns of added or moved points")
+    parser.add_argument("--backend", choices=["valhalla", "local"], default="valhalla",
+                        help="Matrix engine: the Valhalla containers, or the offline graph from local_graph.py")
+    parser.add_argument("--sweep", nargs="*", metavar="HH:MM", default=None,
+                        help=f"Time-of-day sweep into {SWEEP_2018_BIN}/{SWEEP_2025_BIN} "
+                             f"(default times: {' '.join(SWEEP_TIMES)})")
+    parser.add_argument("--sweep-date", default=SWEEP_DATE,
+                        help=f"Date the sweep departures fall on (default: {SWEEP_DATE})")
+    metrics.add_arguments(parser)
+
+
+def delta_arguments(parser) -> None:
+    parser.add_argument("--csv", action="store_true",
+                        help="Also export the long-format matrix_2018/2025/delta CSVs")
+    metrics.add_arguments(parser)
+
+
+def analyze_arguments(parser) -> None:
+    parser.add_argument("--top", type=int, default=20, help="Rows in the faster/slower tables (default: 20)")
+    parser.add_argument("--resamples", type=int, default=BOOTSTRAP_RESAMPLES,
+                        help=f"Bootstrap resamples for the confidence intervals (default: {BOOTSTRAP_RESAMPLES})")
+    parser.add_argument("--seed", type=int, default=BOOTSTRAP_SEED, help=f"Random seed (default: {BOOTSTRAP_SEED})")
+    parser.add_argument("--level", type=float, default=BOOTSTRAP_LEVEL,
+                        help=f"Confidence level (default: {BOOTSTRAP_LEVEL})")
+    parser.add_argument("--workers", type=int, default=None, help="Bootstrap worker processes (default: all CPUs)")
+    parser.add_argument("--no-ci", action="store_true", help="Skip the bootstrap confidence intervals")
+    metrics.add_arguments(parser)
+
+
+def draw_arguments(parser) -> None:
+    parser.add_argument("--top-k", type=int, default=10, help="OD pairs drawn (default: 10)")
+    parser.add_argument("--metric", default="delta_distance_km",
+                        help="Delta column the pairs are ranked by (default: delta_distance_km)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call /route, bypassing the route cache")
+    parser.add_argument("--optimize", action="store_true",
+                        help="Simplify, quantize and share route geometry to shrink the HTML")
+    parser.add_argument("--tolerance-px", type=float, default=MAP_TOLERANCE_PX,
+                        help=f"Max on-screen deviation at --max-zoom, in pixels (default: {MAP_TOLERANCE_PX})")
+    parser.add_argument("--max-zoom", type=int, default=MAP_MAX_ZOOM,
+                        help=f"Deepest zoom the map allows; the tolerance is scaled to it (default: {MAP_MAX_ZOOM})")
+    parser.add_argument("--stream", action="store_true",
+                        help="Render the layers in a process pool and stream them into the HTML (flat memory)")
+    parser.add_argument("--sidecar", action="store_true",
+                        help="With --stream: write the layers to a .geojson the page loads after opening "
+                             "(serve the directory over HTTP)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Render processes with --stream (default: all CPUs)")
+    metrics.add_arguments(parser)
+
+
+def serve_arguments(parser) -> None:
+    parser.add_argument("--port", type=int, default=OD_SERVICE_PORT, help=f"Port (default: {OD_SERVICE_PORT})")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: 127.0.0.1)")
+    parser.add_argument("--years", type=int, nargs="+", default=None,
+                        help=f"Snapshots to serve (default: every matrix_<year>.bin of {sorted(SNAPSHOTS)})")
+    parser.add_argument("--reload-s", type=float, default=OD_RELOAD_S,
+                        help=f"Seconds between checks for new stores (default: {OD_RELOAD_S})")
+    parser.add_argument("--presort", action="store_true",
+                        help="Sort every row's destinations at load (N x N argsort) instead of on first /top query")
+
+
+# name: (module, function called with the parsed args, arguments, help)
+COMMANDS = {
+    "points": ("generate_points", "run", points_arguments, "Generate snapped points for this region"),
+    "matrix": ("run_matrix_and_delta", "run", matrix_arguments, "Compute 2018/2025 matrices and their delta"),
+    "delta": ("run_matrix_and_delta", "run_delta", delta_arguments,
+              "Delta summary of the existing matrix stores (no engine calls)"),
+    "analyze": ("analysis", "run", analyze_arguments,
+                "Summary, top faster/slower routes and bootstrap confidence intervals"),
+    "draw": ("draw_compare_routes", "run", draw_arguments, "Map the routes that changed most"),
+    "serve": ("od_service", "run", serve_arguments, "HTTP queries over the computed matrices"),
+}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="HCMC road network comparison, 2018 vs 2025")
+    sub = parser.add_subparsers(dest="command", required=True, metavar="COMMAND")
+    for name, (_, _, add_arguments, help_text) in COMMANDS.items():
+        add_arguments(sub.add_parser(name, help=help_text, description=help_text))
+    return parser
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    module, func, _, _ = COMMANDS[args.command]
+    # The heavy imports happen here, only for the command that runs
+    getattr(importlib.import_module(module), func)(args)
+
+
+if __name__ == "__main__":
+    main()
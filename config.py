@@ -22,6 +22,46 @@ BBOX_STR = f"{MIN_LON},{MIN_LAT},{MAX_LON},{MAX_LAT}"
 VALHALLA_2018 = "http://localhost:8004"
 VALHALLA_2025 = "http://localhost:8005"
 
+# Snapshot registry: one entry per year. "dir" holds the year's valhalla.json
+# and hcm_<year>.osm.pbf, cut from the "source" extract by build_snapshots.py;
+# "replicas" are engines serving the same tiles (one container each, e.g.
+# run_2018.sh on another host port). The first replica is the snapshot's name
+# everywhere else (stores, caches, BASE_* constants); requests are spread
+# over all of them. Add years here for timeline.py.
+SNAPSHOTS = {
+    2018: {"dir": "custom_2018", "source": "vietnam-180101.osm.pbf", "replicas": [VALHALLA_2018]},
+    2025: {"dir": "custom_2025", "source": "vietnam-251201.osm.pbf", "replicas": [VALHALLA_2025]},
+}
+
+# Snapshot builds (build_snapshots.py): the image that builds the tiles, and
+# the manifest of which inputs produced each year's extract and tile set
+VALHALLA_IMAGE = "ghcr.io/gis-ops/docker-valhalla/valhalla:3.5.1"
+SNAPSHOT_MANIFEST = "snapshots.json"
+
+# Engine configs mounted into each container (used to read service limits)
+VALHALLA_2018_CONFIG = "custom_2018/valhalla.json"
+VALHALLA_2025_CONFIG = "custom_2025/valhalla.json"
+ENGINE_CONFIGS = {
+    url: f"{snap['dir']}/valhalla.json" for snap in SNAPSHOTS.values() for url in snap["replicas"]
+}
+
+# OSM extracts each engine was built from, and where local_graph.py keeps
+# the offline graph built from them
+ENGINE_PBFS = {
+    snap["replicas"][0]: f"{snap['dir']}/hcm_{year}.osm.pbf" for year, snap in SNAPSHOTS.items()
+}
+LOCAL_GRAPH_DIRS = {
+    snap["replicas"][0]: f"graph_{year}" for year, snap in SNAPSHOTS.items()
+}
+
+# Grid cell size of the offline snapping index (snap_index.py)
+SNAP_CELL_M = 50
+# Offline matrix (local_graph.py): points snap to the nearest road within
+# LOCAL_SNAP_RADIUS_M, a radius that doubles for points with no road in range,
+# up to LOCAL_SNAP_MAX_M; points beyond that have no route
+LOCAL_SNAP_RADIUS_M = 100
+LOCAL_SNAP_MAX_M = 1600
+
 # =============================================================================
 # ROUTING CONFIGURATION
 # =============================================================================
@@ -30,6 +70,16 @@ VALHALLA_2025 = "http://localhost:8005"
 # Includes: motorway, trunk, primary, secondary, tertiary, residential, service
 COSTING = "auto"
 
+# A pair is one-way asymmetric when A→B and B→A differ by more than either
+ASYMMETRY_TIME_S = 60
+ASYMMETRY_DISTANCE_KM = 0.3
+
+# Bootstrap confidence intervals in analysis.py (bootstrap.py): points are
+# resampled with replacement, BOOTSTRAP_RESAMPLES times from BOOTSTRAP_SEED
+BOOTSTRAP_RESAMPLES = 10_000
+BOOTSTRAP_SEED = 42
+BOOTSTRAP_LEVEL = 0.95
+
 # =============================================================================
 # FILE PATHS
 # =============================================================================
@@ -39,9 +89,95 @@ MATRIX_2018_CSV = "matrix_2018.csv"
 MATRIX_2025_CSV = "matrix_2025.csv"
 MATRIX_DELTA_CSV = "matrix_delta.csv"
 
+# Persistent /route response cache (route_cache.py), LRU-evicted above the size cap
+ROUTE_CACHE_DB = "route_cache.sqlite"
+ROUTE_CACHE_MAX_MB = 512
+
+# Dense N x N stores (matrix_store.py); the CSVs above are optional exports
+MATRIX_2018_BIN = "matrix_2018.bin"
+MATRIX_2025_BIN = "matrix_2025.bin"
+
+# Timeline over every snapshot (timeline.py): one store per year, named with
+# the year, and the pairwise delta summary
+TIMELINE_MATRIX_BIN = "matrix_{year}.bin"
+TIMELINE_DELTAS_CSV = "timeline_deltas.csv"
+
+# Whole-matrix asymmetry report (asymmetry.py)
+ASYMMETRY_PAIRS_CSV = "asymmetry_pairs.csv"
+ASYMMETRY_POINTS_CSV = "asymmetry_points.csv"
+ASYMMETRY_MAX_PAIRS = 100_000  # worst flagged pairs kept per snapshot
+
+# Time-of-day sweep (run_matrix_and_delta.py --sweep): departure times on a
+# reference weekday, stacked into bucket x N x N stores. An engine whose
+# valhalla.json disables time-dependent matrices (max_timedep_distance_matrix
+# = 0) computes the first bucket only; the others are copies of it.
+SWEEP_DATE = "2025-01-15"
+SWEEP_TIMES = ("07:30", "10:00", "12:00", "17:30", "22:00")
+SWEEP_2018_BIN = "sweep_2018.bin"
+SWEEP_2025_BIN = "sweep_2025.bin"
+
+# Accessibility grid (accessibility.py): cell size, how far a cell centre may be
+# from a road (cells further away are left out), travel-time thresholds, outputs
+ACCESS_CELL_M = 250
+ACCESS_SNAP_M = 150
+ACCESS_THRESHOLDS_MIN = (10, 20, 30)
+ACCESSIBILITY_CSV = "accessibility.csv"
+HEATMAP_HTML = "heatmap_improvements.html"
+
+# Route geometry for every OD pair (geometry_store.py)
+GEOMETRY_2018_BIN = "geometry_2018.bin"
+GEOMETRY_2025_BIN = "geometry_2025.bin"
+
+# Corridor attribution (corridors.py): route vertices are snapped to a grid of
+# CORRIDOR_CELL_M cells, and steps between neighbouring cells are the segments
+CORRIDOR_CELL_M = 25
+CORRIDORS_CSV = "corridor_shift.csv"
+CORRIDORS_HTML = "corridor_shift.html"
+CORRIDOR_MAP_SEGMENTS = 300  # largest usage shifts drawn on the map
+
+# Route comparison map (draw_compare_routes.py --optimize, map_optimize.py):
+# max on-screen deviation of simplified lines at the deepest zoom allowed
+MAP_TOLERANCE_PX = 1.0
+MAP_MAX_ZOOM = 18
+# OD pairs per render task in the streaming writer (--stream, map_stream.py)
+MAP_STREAM_CHUNK = 200
+
+# Finished matrix tiles are checkpointed here so long runs can resume
+MATRIX_TILES_DIR = "matrix_tiles"
+
+# Per-run metrics files (--metrics, metrics.py)
+METRICS_DIR = "metrics"
+
+# OD query service (od_service.py): port, and how often it checks for new stores
+OD_SERVICE_PORT = 8090
+OD_RELOAD_S = 2.0
+
 # =============================================================================
 # TIMEOUTS
 # =============================================================================
 LOCATE_TIMEOUT = 15
 ROUTE_TIMEOUT = 90
 MATRIX_TIMEOUT = 600
+
+# A matrix store with more failed cells than this share (timeouts, rejected
+# or bad responses) is not saved; the previous file stays in place
+MATRIX_MAX_FAILED_SHARE = 0.05
+
+# =============================================================================
+# HTTP CLIENT (valhalla_client.py)
+# =============================================================================
+# Keep-alive connections per engine and size of the shared worker pool
+HTTP_POOL_SIZE = 16
+HTTP_MAX_WORKERS = 16
+
+# Max in-flight requests per endpoint, per engine
+ENDPOINT_CONCURRENCY = {
+    "/sources_to_targets": 2,
+    "/matrix": 2,
+    "/locate": 8,
+    "/route": 8,
+}
+
+# Retries on timeouts / 5xx, with exponential backoff starting at HTTP_BACKOFF_S
+HTTP_RETRIES = 3
+HTTP_BACKOFF_S = 0.5
@@ -0,0 +1,314 @@
+"""
+Corridor-level change attribution from the all-pairs route geometry.
+
+Every route in geometry_2018.bin / geometry_2025.bin is densified so that
+consecutive samples fall in the same or neighbouring cells of a
+CORRIDOR_CELL_M grid, and each step between two cells becomes a segment
+key: the lower packed cell id and the direction to its neighbour. A segment is counted once per
+route that crosses it, giving a per-year load: how many OD routes use it.
+Routes are read in row blocks of bounded vertex count straight from the
+memory-mapped stores (the matrix time deltas too, block by block), and
+only the per-segment totals are kept, so memory follows the size of the
+road network, not N^2.
+
+Writes corridor_shift.csv (segments ranked by usage shift) and
+corridor_shift.html (map layer of the largest shifts).
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import (
+    MIN_LAT, MIN_LON, MAX_LAT, MAX_LON,
+    GEOMETRY_2018_BIN, GEOMETRY_2025_BIN, MATRIX_2018_BIN, MATRIX_2025_BIN,
+    CORRIDOR_CELL_M, CORRIDORS_CSV, CORRIDORS_HTML, CORRIDOR_MAP_SEGMENTS
+)
+from geometry_store import load_geometry, PRECISION
+
+M_PER_DEG_LAT = 111320.0
+
+# Route vertices decoded per block, and densified samples processed at once
+VERTEX_BUDGET = 1_000_000
+SAMPLE_BUDGET = 1_000_000
+
+# Grid origin sits this far (degrees) outside the bounding box
+GRID_MARGIN_DEG = 0.05
+
+# Cell ids are row << 16 | col; a segment joins cell a to a + STEP_OFFSETS[code]
+STEP_OFFSETS = np.array([1, (1 << 16) - 1, 1 << 16, (1 << 16) + 1], dtype=np.int64)
+SEGMENT_BITS = 34
+
+
+class Grid:
+    """Cell arithmetic in the stores' integer microdegrees."""
+
+    def __init__(self, cell_m: float = CORRIDOR_CELL_M):
+        scale = 10 ** PRECISION
+        self.cell_m = cell_m
+        self.lat0 = round((MIN_LAT - GRID_MARGIN_DEG) * scale)
+        self.lon0 = round((MIN_LON - GRID_MARGIN_DEG) * scale)
+        self.dlat = cell_m / M_PER_DEG_LAT * scale
+        self.dlon = self.dlat / math.cos(math.radians((MIN_LAT + MAX_LAT) / 2))
+
+    def cell_coords(self, lat_u, lon_u) -> tuple[np.ndarray, np.ndarray]:
+        """Continuous (row, col) grid coordinates of microdegree positions."""
+        return (lat_u - self.lat0) / self.dlat, (lon_u - self.lon0) / self.dlon
+
+    @staticmethod
+    def ends(segment: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The two cell ids of segment keys."""
+        a = segment >> 2
+        return a, a + STEP_OFFSETS[segment & 3]
+
+    def centre(self, cell: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """lat/lon of packed cell ids."""
+        row, col = cell >> 16, cell & 0xFFFF
+        scale = 10 ** PRECISION
+        return ((self.lat0 + (row + 0.5) * self.dlat) / scale,
+                (self.lon0 + (col + 0.5) * self.dlon) / scale)
+
+
+def _step_keys(y, x, pair, same, steps) -> tuple[np.ndarray, np.ndarray]:
+    """Densify whole routes; (pair, key) of each distinct cell step per route."""
+    at = np.repeat(np.arange(len(steps)), steps)
+    k = np.arange(len(at)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = np.where(same[at], k / steps[at], 0.0)
+    sy = np.append(y[at] + (y[at + 1] - y[at]) * t, y[-1])
+    sx = np.append(x[at] + (x[at + 1] - x[at]) * t, x[-1])
+    spair = np.append(pair[at], pair[-1])
+
+    cell = (np.floor(sy).astype(np.int64) << 16) | (np.floor(sx).astype(np.int64) & 0xFFFF)
+    step = (spair[1:] == spair[:-1]) & (cell[1:] != cell[:-1])
+    a, b = cell[:-1][step], cell[1:][step]
+    lo = np.minimum(a, b)
+    gap = np.maximum(a, b) - lo
+    key = (lo << 2) | np.where(gap == 1, 0, gap - STEP_OFFSETS[1] + 1)
+    pair = spair[1:][step]
+
+    # Each segment once per route: route and segment packed in one int64
+    p0 = pair[0] if len(pair) else 0
+    packed = np.sort(((pair - p0) << SEGMENT_BITS) | key)
+    packed = packed[np.append(True, packed[1:] != packed[:-1])]
+    return p0 + (packed >> SEGMENT_BITS), packed & ((1 << SEGMENT_BITS) - 1)
+
+
+def route_segments(store, r0: int, r1: int, grid: Grid,
+                   sample_budget: int = SAMPLE_BUDGET) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (pair index, segment key) for every distinct segment of every route with
+    a source in rows r0:r1. Pair index is src * N + dst.
+    """
+    n = store.n
+    offsets = np.asarray(store.offsets[r0 * n:r1 * n + 1])
+    start, stop = int(offsets[0]), int(offsets[-1])
+    if stop - start < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Absolute microdegrees: each route's first row is absolute, the rest are deltas
+    lengths = np.diff(offsets)
+    pair = np.repeat(np.arange(r0 * n, r1 * n, dtype=np.int64), lengths)
+    c = np.cumsum(np.asarray(store.coords[start:stop], dtype=np.int64), axis=0)
+    first = np.repeat(offsets[:-1] - start, lengths)
+    c -= np.where(first[:, None] > 0, c[np.maximum(first - 1, 0)], 0)
+    y, x = grid.cell_coords(c[:, 0], c[:, 1])
+
+    # At most half a cell per step, so a route never skips a cell
+    same = pair[1:] == pair[:-1]
+    span = np.maximum(np.abs(np.diff(y)), np.abs(np.diff(x)))
+    steps = np.where(same, np.maximum(np.ceil(span * 2), 1), 1).astype(np.int64)
+
+    # Densify whole routes, grouped by the budget window their last sample falls in
+    ends = np.append(np.flatnonzero(~same) + 1, len(y))
+    window = np.cumsum(np.append(steps, 1))[ends - 1] // sample_budget
+    bounds = np.concatenate(([0], ends[np.flatnonzero(np.diff(window))], [len(y)]))
+    parts = [_step_keys(y[v0:v1], x[v0:v1], pair[v0:v1], same[v0:v1 - 1], steps[v0:v1 - 1])
+             for v0, v1 in zip(bounds[:-1], bounds[1:])]
+    return np.concatenate([p for p, _ in parts]), np.concatenate([k for _, k in parts])
+
+
+class SegmentLoad:
+    """Running per-segment route counts (and summed route deltas) of one snapshot."""
+
+    def __init__(self):
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.routes = np.zeros(0, dtype=np.int64)
+        self.delta_sum = np.zeros(0)
+        self.delta_n = np.zeros(0, dtype=np.int64)
+
+    def add(self, key: np.ndarray, delta: np.ndarray | None = None) -> None:
+        if not len(key):
+            return
+        order = np.argsort(key)
+        key = key[order]
+        starts = np.flatnonzero(np.append(True, key[1:] != key[:-1]))
+        ukey = key[starts]
+        routes = np.diff(np.append(starts, len(key)))
+        if delta is None:
+            dsum = np.zeros(len(ukey))
+            dn = np.zeros(len(ukey), dtype=np.int64)
+        else:
+            delta = delta[order]
+            ok = ~np.isnan(delta)
+            dsum = np.add.reduceat(np.where(ok, delta, 0.0), starts)
+            dn = np.add.reduceat(ok.astype(np.int64), starts)
+
+        # Merge into the sorted running totals
+        pos = np.minimum(np.searchsorted(self.keys, ukey), max(len(self.keys) - 1, 0))
+        hit = (pos < len(self.keys)) & (self.keys[pos] == ukey) if len(self.keys) else np.zeros(len(ukey), bool)
+        np.add.at(self.routes, pos[hit], routes[hit])
+        np.add.at(self.delta_sum, pos[hit], dsum[hit])
+        np.add.at(self.delta_n, pos[hit], dn[hit])
+        new = ~hit
+        if new.any():
+            keys = np.concatenate((self.keys, ukey[new]))
+            merged = np.argsort(keys, kind="stable")
+            self.keys = keys[merged]
+            self.routes = np.concatenate((self.routes, routes[new]))[merged]
+            self.delta_sum = np.concatenate((self.delta_sum, dsum[new]))[merged]
+            self.delta_n = np.concatenate((self.delta_n, dn[new]))[merged]
+
+
+def _row_blocks(store, budget: int):
+    """Row ranges whose routes hold at most ~budget vertices (at least one row each)."""
+    n = store.n
+    row_start = np.asarray(store.offsets[::n])
+    r0 = 0
+    while r0 < n:
+        r1 = int(np.searchsorted(row_start, row_start[r0] + budget, side="right")) - 1
+        r1 = min(n, max(r1, r0 + 1))
+        yield r0, r1
+        r0 = r1
+
+
+def segment_load(store, grid: Grid, matrices: tuple | None = None,
+                 budget: int = VERTEX_BUDGET) -> SegmentLoad:
+    """
+    Segment usage of every route in a geometry store, one row block at a
+    time. matrices = (2018, 2025) matrix stores adds each route's time delta,
+    read for the same row block from the memory-mapped time_s arrays.
+    """
+    load = SegmentLoad()
+    n = store.n
+    for r0, r1 in _row_blocks(store, budget):
+        pair, key = route_segments(store, r0, r1, grid)
+        delta = None
+        if matrices is not None:
+            m_a, m_b = matrices
+            delta = (np.asarray(m_b.time_s[r0:r1], dtype=np.float64)
+                     - np.asarray(m_a.time_s[r0:r1], dtype=np.float64)).ravel()[pair - r0 * n]
+        load.add(key, delta)
+    return load
+
+
+def _delta_matrices(g_2025) -> tuple | None:
+    """The (2018, 2025) matrix stores, when they were computed on the geometry points."""
+    from matrix_store import load_matrix
+
+    try:
+        m_a, m_b = load_matrix(MATRIX_2018_BIN), load_matrix(MATRIX_2025_BIN)
+    except OSError:
+        return None
+    if not (m_a.meta["points_hash"] == m_b.meta["points_hash"] == g_2025.meta["points_hash"]):
+        return None
+    return m_a, m_b
+
+
+def corridor_shift(load_2018: SegmentLoad, load_2025: SegmentLoad, routes_2018: int,
+                   routes_2025: int, grid: Grid) -> pd.DataFrame:
+    """Segments of either year ranked by |routes_2025 - routes_2018|, then by total use."""
+    keys = np.union1d(load_2018.keys, load_2025.keys)
+
+    def on(load, values, fill):
+        out = np.full(len(keys), fill, dtype=np.asarray(values).dtype)
+        out[np.searchsorted(keys, load.keys)] = values
+        return out
+
+    r18 = on(load_2018, load_2018.routes, 0)
+    r25 = on(load_2025, load_2025.routes, 0)
+    dsum = on(load_2025, load_2025.delta_sum, 0.0)
+    dn = on(load_2025, load_2025.delta_n, 0)
+    cell_a, cell_b = grid.ends(keys)
+    lat_a, lon_a = grid.centre(cell_a)
+    lat_b, lon_b = grid.centre(cell_b)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_delta = np.where(dn > 0, dsum / dn, np.nan)
+
+    df = pd.DataFrame({
+        "segment": keys,
+        "lat_a": lat_a.round(6), "lon_a": lon_a.round(6),
+        "lat_b": lat_b.round(6), "lon_b": lon_b.round(6),
+        "routes_2018": r18,
+        "routes_2025": r25,
+        "shift": r25 - r18,
+        "share_2018_pct": (100 * r18 / max(routes_2018, 1)).round(3),
+        "share_2025_pct": (100 * r25 / max(routes_2025, 1)).round(3),
+        "mean_delta_time_s_2025": mean_delta.round(1),
+    })
+    order = np.lexsort((keys, -(r18 + r25), -np.abs(r25 - r18)))
+    return df.iloc[order].reset_index(drop=True)
+
+
+def draw_map(df: pd.DataFrame, out_html: str, segments: int = CORRIDOR_MAP_SEGMENTS) -> None:
+    """Largest usage shifts as line layers: gained (2025 > 2018) and lost."""
+    import folium
+
+    m = folium.Map(location=[(MIN_LAT + MAX_LAT) / 2, (MIN_LON + MAX_LON) / 2], zoom_start=14)
+    top = df[df["shift"] != 0].head(segments)
+    scale = max(1, int(top["shift"].abs().max())) if len(top) else 1
+    for name, sel, color in (("More routes in 2025", top["shift"] > 0, "#1a9850"),
+                             ("Fewer routes in 2025", top["shift"] < 0, "#d73027")):
+        fg = folium.FeatureGroup(name=name)
+        for r in top[sel].itertuples(index=False):
+            folium.PolyLine(
+                [[r.lat_a, r.lon_a], [r.lat_b, r.lon_b]], color=color, opacity=0.8,
+                weight=2 + 8 * abs(r.shift) / scale,
+                tooltip=f"{r.routes_2018:,} → {r.routes_2025:,} routes ({r.shift:+,})",
+            ).add_to(fg)
+        fg.add_to(m)
+    folium.LayerControl(collapsed=False).add_to(m)
+    m.save(out_html)
+
+
+def main(cell_m=CORRIDOR_CELL_M, top=15, map_segments=CORRIDOR_MAP_SEGMENTS, budget=VERTEX_BUDGET):
+    g_2018, g_2025 = load_geometry(GEOMETRY_2018_BIN), load_geometry(GEOMETRY_2025_BIN)
+    if g_2018.meta["points_hash"] != g_2025.meta["points_hash"]:
+        raise ValueError(f"{GEOMETRY_2018_BIN} and {GEOMETRY_2025_BIN} were harvested on different point sets")
+    grid = Grid(cell_m)
+    matrices = _delta_matrices(g_2025)
+
+    loads, routes = [], []
+    for store in (g_2018, g_2025):
+        t0 = time.perf_counter()
+        loads.append(segment_load(store, grid, matrices, budget))
+        routes.append(int((np.diff(np.asarray(store.offsets)) > 1).sum()))
+        print(f"  [{store.meta['snapshot']}] {routes[-1]:,} routes, {len(loads[-1].keys):,} segments "
+              f"({time.perf_counter() - t0:.1f}s)")
+
+    df = corridor_shift(loads[0], loads[1], routes[0], routes[1], grid)
+    df.to_csv(CORRIDORS_CSV, index=False)
+    print(f"✅ {CORRIDORS_CSV} saved ({len(df):,} segments of {cell_m:g} m cells)")
+
+    print("\n" + "=" * 60)
+    print("LARGEST CORRIDOR USAGE SHIFTS (routes through segment)")
+    print("=" * 60)
+    print(df.head(top)[["lat_a", "lon_a", "lat_b", "lon_b", "routes_2018", "routes_2025", "shift",
+                        "mean_delta_time_s_2025"]].to_string(index=False))
+
+    draw_map(df, CORRIDORS_HTML, map_segments)
+    print(f"✅ {CORRIDORS_HTML} saved")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank road segments by how many OD routes use them, 2018 vs 2025")
+    parser.add_argument("--cell-m", type=float, default=CORRIDOR_CELL_M,
+                        help=f"Grid cell size for segment keys in metres (default: {CORRIDOR_CELL_M})")
+    parser.add_argument("--top", type=int, default=15, help="Segments to print (default: 15)")
+    parser.add_argument("--map-segments", type=int, default=CORRIDOR_MAP_SEGMENTS,
+                        help=f"Segments drawn on the map (default: {CORRIDOR_MAP_SEGMENTS})")
+    parser.add_argument("--vertex-budget", type=int, default=VERTEX_BUDGET,
+                        help=f"Route vertices decoded per block (default: {VERTEX_BUDGET:,})")
+    args = parser.parse_args()
+    main(cell_m=args.cell_m, top=args.top, map_segments=args.map_segments, budget=args.vertex_budget)
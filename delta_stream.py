@@ -0,0 +1,268 @@
+"""
+One-pass, bounded-memory statistics over the 2018 -> 2025 delta.
+
+The delta is read in row chunks, either straight from the two dense stores
+or from matrix_delta.csv, and folded into a DeltaStats accumulator:
+counts, null counts and sums are exact, medians come from a mergeable
+quantile sketch (exact until it first compacts) and the fastest/slowest
+pairs are kept in bounded heaps. Memory does not grow with the number of
+OD rows, and accumulators built on different chunks can be merged.
+"""
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+
+from matrix_store import DISTANCE_DECIMALS
+
+# OD rows per chunk (whole store rows are taken, so a chunk is >= one row)
+CHUNK_ROWS = 1_000_000
+
+# Items per sketch level; the sketch is exact until level 0 overflows
+SKETCH_K = 200_000
+
+TOP_COLUMNS = ["src", "dst", "time_s_2018", "time_s_2025", "delta_time_s"]
+
+
+# =============================================================================
+# Chunk sources
+# =============================================================================
+
+def store_chunks(m_a, m_b, chunk_rows: int = CHUNK_ROWS):
+    """
+    Delta chunks (dict of column arrays) computed from two stores, row block
+    by row block; values match matrix_store.delta_frame.
+    """
+    if m_a.meta["points_hash"] != m_b.meta["points_hash"]:
+        raise ValueError(f"{m_a.path} and {m_b.path} were computed on different point sets")
+    n = m_a.n
+    block = max(1, chunk_rows // max(n, 1))
+    for r0 in range(0, n, block):
+        r1 = min(n, r0 + block)
+        ta = np.asarray(m_a.time_s[r0:r1], dtype=np.float64).ravel()
+        tb = np.asarray(m_b.time_s[r0:r1], dtype=np.float64).ravel()
+        da = np.round(np.asarray(m_a.distance_km[r0:r1], dtype=np.float64), DISTANCE_DECIMALS).ravel()
+        db = np.round(np.asarray(m_b.distance_km[r0:r1], dtype=np.float64), DISTANCE_DECIMALS).ravel()
+        yield {
+            "src": np.repeat(m_a.ids[r0:r1], n),
+            "dst": np.tile(m_a.ids, r1 - r0),
+            "time_s_2018": ta,
+            "time_s_2025": tb,
+            "delta_time_s": tb - ta,
+            "delta_distance_km": db - da,
+        }
+
+
+def csv_chunks(path: str, chunk_rows: int = CHUNK_ROWS):
+    """Delta chunks read from a matrix_delta.csv file."""
+    cols = ["src", "dst", "time_s_2018", "time_s_2025", "delta_time_s", "delta_distance_km"]
+    for chunk in pd.read_csv(path, usecols=cols, chunksize=chunk_rows):
+        out = {c: chunk[c].to_numpy(dtype=np.float64) for c in cols[2:]}
+        out["src"] = chunk["src"].to_numpy()
+        out["dst"] = chunk["dst"].to_numpy()
+        yield out
+
+
+# =============================================================================
+# Accumulators
+# =============================================================================
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch (a KLL-style stack of compactors). Level h
+    holds items of weight 2**h; a full level is sorted and every other item
+    (random offset) is promoted. While nothing has been compacted the sketch
+    holds every value and quantiles are exact (same as pandas/NumPy).
+    """
+
+    def __init__(self, k: int = SKETCH_K, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.levels = [[]]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.n += len(values)
+            self.levels[0].append(values)
+            self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        self.n += other.n
+        for h, parts in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append([])
+            self.levels[h].extend(parts)
+        self._compress()
+
+    def _compress(self) -> None:
+        h = 0
+        while h < len(self.levels):
+            size = sum(len(p) for p in self.levels[h])
+            if size > self.k:
+                items = np.sort(np.concatenate(self.levels[h]))
+                if len(items) % 2:
+                    # Odd item stays at this level so the total weight is kept
+                    keep, items = items[-1:], items[:-1]
+                else:
+                    keep = items[:0]
+                self.levels[h] = [keep] if len(keep) else []
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                self.levels[h + 1].append(items[self._rng.integers(2)::2])
+            h += 1
+
+    @property
+    def exact(self) -> bool:
+        return len(self.levels) == 1
+
+    def quantile(self, q: float) -> float:
+        """Linear-interpolated q-quantile (exact while nothing was compacted)."""
+        if self.n == 0:
+            return np.nan
+        if self.exact:
+            items = np.concatenate(self.levels[0])
+            return float(np.median(items) if q == 0.5 else np.quantile(items, q))
+        values, weights = [], []
+        for h, parts in enumerate(self.levels):
+            for p in parts:
+                values.append(p)
+                weights.append(np.full(len(p), 2 ** h, dtype=np.int64))
+        values = np.concatenate(values)
+        weights = np.concatenate(weights)
+        order = np.argsort(values, kind="stable")
+        values, cum = values[order], np.cumsum(weights[order])
+        # Rank of q among the n (weighted) values, interpolated like the exact case
+        pos = q * (cum[-1] - 1)
+        lo = values[np.searchsorted(cum, math.floor(pos) + 1)]
+        hi = values[np.searchsorted(cum, math.ceil(pos) + 1)]
+        return float(lo + (hi - lo) * (pos - math.floor(pos)))
+
+
+class TopK:
+    """
+    The k smallest (or largest) values seen, with their row payloads, in a
+    bounded heap. Ties keep the earlier row, as a stable sort would.
+    """
+
+    def __init__(self, k: int, largest: bool = False):
+        self.k = k
+        self.largest = largest
+        self._heap = []   # worst kept row on top
+
+    def _key(self, value: float, seq: int) -> tuple:
+        # heapq is a min-heap, so the key puts the worst row first
+        return (value, -seq) if self.largest else (-value, -seq)
+
+    def update(self, values: np.ndarray, seq: np.ndarray, rows: dict) -> None:
+        ok = ~np.isnan(values)
+        if not ok.any():
+            return
+        values, seq = values[ok], seq[ok]
+        # Only the chunk's own best k (ties in row order) can enter the heap
+        if len(values) > self.k:
+            ranked = -values if self.largest else values
+            kth = np.partition(ranked, self.k - 1)[self.k - 1]
+            cand = np.nonzero(ranked <= kth)[0]
+            cand = cand[np.argsort(ranked[cand], kind="stable")[:self.k]]
+        else:
+            cand = np.arange(len(values))
+        idx = np.nonzero(ok)[0][cand]
+        for c, i in zip(cand, idx):
+            item = (self._key(float(values[c]), int(seq[c])), {name: col[i] for name, col in rows.items()})
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def merge(self, other: "TopK") -> None:
+        for item in other._heap:
+            if len(self._heap) < self.k:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def rows(self) -> list[dict]:
+        """Kept rows, best first."""
+        return [row for _, row in sorted(self._heap, reverse=True)]
+
+
+class DeltaStats:
+    """Single-pass accumulator behind the analysis.py report."""
+
+    def __init__(self, top: int = 20, sketch_k: int = SKETCH_K):
+        self.rows = 0
+        self.nulls = {"time_s_2018": 0, "time_s_2025": 0}
+        self.count = {"delta_time_s": 0, "delta_distance_km": 0}
+        self.sums = {"delta_time_s": [], "delta_distance_km": []}
+        self.sketch = {"delta_time_s": QuantileSketch(sketch_k), "delta_distance_km": QuantileSketch(sketch_k)}
+        self.faster = TopK(top)
+        self.slower = TopK(top, largest=True)
+        # Columns shown as integers when every value is whole (as pandas infers)
+        self.integral = {c: True for c in TOP_COLUMNS}
+
+    def update(self, chunk: dict) -> None:
+        seq = self.rows + np.arange(len(chunk["delta_time_s"]))
+        self.rows += len(seq)
+        for col in self.nulls:
+            self.nulls[col] += int(np.isnan(chunk[col]).sum())
+        for col in self.count:
+            v = chunk[col][~np.isnan(chunk[col])]
+            self.count[col] += len(v)
+            self.sums[col].append(math.fsum(v))
+            self.sketch[col].update(v)
+        for col in TOP_COLUMNS:
+            a = chunk[col]
+            if self.integral[col] and a.dtype.kind == "f":
+                self.integral[col] = not np.isnan(a).any() and np.array_equal(a, np.rint(a))
+        rows = {c: chunk[c] for c in TOP_COLUMNS}
+        self.faster.update(chunk["delta_time_s"], seq, rows)
+        self.slower.update(chunk["delta_time_s"], seq, rows)
+
+    def merge(self, other: "DeltaStats") -> None:
+        """Fold in an accumulator built on the chunks that follow this one's."""
+        for h in (other.faster._heap, other.slower._heap):
+            for i, (key, row) in enumerate(h):
+                h[i] = ((key[0], key[1] - self.rows), row)
+        self.rows += other.rows
+        for col in self.nulls:
+            self.nulls[col] += other.nulls[col]
+        for col in self.count:
+            self.count[col] += other.count[col]
+            self.sums[col].extend(other.sums[col])
+            self.sketch[col].merge(other.sketch[col])
+        for col in self.integral:
+            self.integral[col] &= other.integral[col]
+        self.faster.merge(other.faster)
+        self.slower.merge(other.slower)
+
+    def mean(self, col: str) -> float:
+        return math.fsum(self.sums[col]) / self.count[col] if self.count[col] else np.nan
+
+    def summary(self) -> dict:
+        return {
+            "rows": self.rows,
+            "null_2018_time": self.nulls["time_s_2018"],
+            "null_2025_time": self.nulls["time_s_2025"],
+            "avg_delta_time_s": self.mean("delta_time_s"),
+            "avg_delta_distance_km": self.mean("delta_distance_km"),
+            "median_delta_time_s": self.sketch["delta_time_s"].quantile(0.5),
+            "median_delta_distance_km": self.sketch["delta_distance_km"].quantile(0.5),
+        }
+
+    def top_frame(self, largest: bool = False) -> pd.DataFrame:
+        df = pd.DataFrame((self.slower if largest else self.faster).rows(), columns=TOP_COLUMNS)
+        for col in TOP_COLUMNS:
+            if self.integral[col]:
+                df[col] = df[col].astype(np.int64)
+        return df
+
+
+def delta_stats(chunks, top: int = 20, sketch_k: int = SKETCH_K) -> DeltaStats:
+    stats = DeltaStats(top, sketch_k)
+    for chunk in chunks:
+        stats.update(chunk)
+    return stats
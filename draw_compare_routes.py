@@ -1,19 +1,30 @@
 import os
+import numpy as np
 import pandas as pd
-import requests
 import folium
 
+import metrics
+from build_snapshots import check_snapshots
 from config import (
     VALHALLA_2018, VALHALLA_2025, COSTING,
-    POINTS_CSV, MATRIX_DELTA_CSV, ROUTE_TIMEOUT
+    ASYMMETRY_TIME_S, ASYMMETRY_DISTANCE_KM,
+    POINTS_CSV, MATRIX_2018_BIN, MATRIX_2025_BIN, ROUTE_TIMEOUT
 )
+from map_stream import delta_columns, top_pairs
+from matrix_store import load_matrix
+from polyline import decode_many
+from map_optimize import GeometryTable, SharedPolyLine, DEFAULT_TOLERANCE_PX, DEFAULT_MAX_ZOOM
+from route_cache import RouteCache
+from valhalla_client import get_client, run_concurrent
 
 BASE_2018 = VALHALLA_2018
 BASE_2025 = VALHALLA_2025
-DELTA_CSV = MATRIX_DELTA_CSV
 OUT_HTML = "route_compare_layers.html"
 TIMEOUT_SEC = ROUTE_TIMEOUT
 
+# Set by main(); None disables the persistent route cache
+ROUTE_CACHE = None
+
 # Color pairs for each OD pair: (forward_color, return_color)
 # Each OD pair gets a unique visually distinct pair
 COLOR_PAIRS = [
@@ -35,83 +46,154 @@ def get_color_pair(index):
     """Get a unique (forward, return) color pair for an OD pair."""
     return COLOR_PAIRS[index % len(COLOR_PAIRS)]
 
-def decode_polyline(s, precision=6):
-    index, lat, lon = 0, 0, 0
-    coords = []
-    factor = 10 ** precision
-    while index < len(s):
-        shift = result = 0
-        while True:
-            b = ord(s[index]) - 63
-            index += 1
-            result |= (b & 0x1f) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlat = ~(result >> 1) if (result & 1) else (result >> 1)
-        lat += dlat
-        shift = result = 0
-        while True:
-            b = ord(s[index]) - 63
-            index += 1
-            result |= (b & 0x1f) << shift
-            shift += 5
-            if b < 0x20:
-                break
-        dlon = ~(result >> 1) if (result & 1) else (result >> 1)
-        lon += dlon
-        coords.append((lat / factor, lon / factor))
-    return coords
-
 def get_point(points_df, point_id):
     row = points_df.loc[points_df["id"] == point_id]
     if row.empty:
         raise ValueError(f"Point {point_id} not found")
     return float(row.iloc[0]["lat"]), float(row.iloc[0]["lon"])
 
-def get_delta_row(delta_df, src, dst):
-    """Get delta row for specific OD pair (for return route lookup)."""
-    row = delta_df[(delta_df["src"] == src) & (delta_df["dst"] == dst)]
-    return row.iloc[0] if not row.empty else None
-
-
-def route_coords(base_url, A, B):
+def route_response(base_url, A, B):
+    """Raw /route response for A -> B (from the route cache when possible), or None."""
     payload = {
         "locations": [{"lat": A[0], "lon": A[1]}, {"lat": B[0], "lon": B[1]}],
         "costing": COSTING,
-        "shape_format": "geojson",
+        "shape_format": "polyline6",
     }
     try:
-        r = requests.post(f"{base_url}/route", json=payload, timeout=TIMEOUT_SEC)
-        r.raise_for_status()
-        data = r.json()
-        leg = data["trip"]["legs"][0]
-        shape = leg.get("shape")
-        
-        if isinstance(shape, dict) and "coordinates" in shape:
-            coords = [(lat, lon) for lon, lat in shape["coordinates"]]
-            return coords, data["trip"]["summary"]
-        if isinstance(shape, str):
-            coords = decode_polyline(shape, 6)
-            return coords, data["trip"]["summary"]
+        data = ROUTE_CACHE.get(base_url, payload) if ROUTE_CACHE else None
+        if data is None:
+            r = get_client(base_url).post("/route", payload, timeout=TIMEOUT_SEC)
+            r.raise_for_status()
+            data = metrics.decode(r)
+            if ROUTE_CACHE:
+                ROUTE_CACHE.put(base_url, payload, data)
+        return data
     except:
-        return None, None
+        return None
 
-def main(top_k=10, metric="delta_distance_km"):
-    points = pd.read_csv(POINTS_CSV)
-    delta = pd.read_csv(DELTA_CSV)
-    
-    cand = delta.dropna(subset=["time_s_2018", "time_s_2025"]).copy()
-    cand = cand[cand["src"] != cand["dst"]]
-    cand["abs_metric"] = cand[metric].abs()
-    cand = cand.sort_values("abs_metric", ascending=False).head(top_k)
+def decode_routes(responses):
+    """
+    [(coords, summary)] for a list of /route responses; all polyline
+    shapes are decoded in one batch. (None, None) for failed responses.
+    """
+    out = [(None, None)] * len(responses)
+    encoded, encoded_at = [], []
+    for k, data in enumerate(responses):
+        try:
+            shape = data["trip"]["legs"][0].get("shape")
+            summary = data["trip"]["summary"]
+        except (TypeError, KeyError, IndexError):
+            continue
+        if isinstance(shape, dict) and "coordinates" in shape:
+            out[k] = ([(lat, lon) for lon, lat in shape["coordinates"]], summary)
+        elif isinstance(shape, str):
+            encoded.append(shape)
+            encoded_at.append((k, summary))
+
+    for (k, summary), coords in zip(encoded_at, decode_many(encoded, 6)):
+        out[k] = (coords.tolist(), summary)
+    return out
+
+def route_coords(base_url, A, B):
+    return decode_routes([route_response(base_url, A, B)])[0]
+
+def fetch_routes(points_df, pairs):
+    """
+    Fetch forward and return routes in both snapshots for every (src, dst)
+    concurrently. Returns {(base_url, src, dst): (coords, summary)}.
+    """
+    jobs = []
+    for src, dst in pairs:
+        try:
+            A = get_point(points_df, src)
+            B = get_point(points_df, dst)
+        except ValueError:
+            continue
+        for base in (BASE_2018, BASE_2025):
+            jobs.append((base, src, dst, A, B))
+            jobs.append((base, dst, src, B, A))
+
+    responses = run_concurrent(lambda job: route_response(job[0], job[3], job[4]), jobs)
+    results = decode_routes(responses)
+    return {(base, a, b): res for (base, a, b, _, _), res in zip(jobs, results)}
+
+def add_route_line(fg, coords, geom_table=None, **kwargs):
+    """PolyLine with full coordinates, or a simplified shared one when geom_table is given."""
+    if geom_table is not None:
+        SharedPolyLine(geom_table, coords, **kwargs).add_to(fg)
+    else:
+        folium.PolyLine(coords, **kwargs).add_to(fg)
+
+def print_cache_stats():
+    if ROUTE_CACHE:
+        st = ROUTE_CACHE.stats()
+        print(f"   Route cache: {st['hits']} hits / {st['misses']} misses "
+              f"({st['hit_rate']:.0%}), {st['size_mb']:.1f} MB, {st['evicted']} evicted")
+
+def main_stream(top_k, metric, sidecar=False, optimize=False, tolerance_px=DEFAULT_TOLERANCE_PX,
+                max_zoom=DEFAULT_MAX_ZOOM, workers=None):
+    """The same map, streamed layer chunk by layer chunk (map_stream.py)."""
+    import map_stream
+
+    bases = {2018: BASE_2018, 2025: BASE_2025}
+
+    def fetch(jobs):
+        # jobs: (year, src (lat, lon), dst (lat, lon)) -> /route responses, in order
+        return run_concurrent(lambda job: route_response(bases[job[0]], job[1], job[2]), jobs)
+
+    total = map_stream.write_map(load_matrix(MATRIX_2018_BIN), load_matrix(MATRIX_2025_BIN), fetch,
+                                 get_color_pair, OUT_HTML, top_k, metric, sidecar, optimize, tolerance_px,
+                                 max_zoom, workers)
+    print(f"\n✅ Saved: {OUT_HTML} ({total['html_kb']:.1f} KB)"
+          + (f" + {total['sidecar']} ({total['sidecar_kb']:.1f} KB)" if total["sidecar"] else ""))
+    print(f"   {total['drawn']} OD pairs with unique colors | Solid=2018, Dashed=2025 | "
+          f"{total['asymmetric']} one-way asymmetries | {total['seconds']:.1f}s")
+    if optimize:
+        print(f"   Simplified geometry: {total['vertices_in']:,} -> {total['vertices_out']:,} vertices")
+    print_cache_stats()
+
+def main(top_k=10, metric="delta_distance_km", use_cache=True, optimize=False,
+         tolerance_px=DEFAULT_TOLERANCE_PX, max_zoom=DEFAULT_MAX_ZOOM, stream=False, sidecar=False, workers=None):
+    global ROUTE_CACHE
+    check_snapshots([BASE_2018, BASE_2025])
+    ROUTE_CACHE = RouteCache() if use_cache else None
+    if stream or sidecar:
+        return main_stream(top_k, metric, sidecar, optimize, tolerance_px, max_zoom, workers)
+
+    with metrics.stage("read_inputs"):
+        points = pd.read_csv(POINTS_CSV)
+        m18, m25 = load_matrix(MATRIX_2018_BIN), load_matrix(MATRIX_2025_BIN)
+    if m18.meta["points_hash"] != m25.meta["points_hash"]:
+        raise ValueError(f"{m18.path} and {m25.path} were computed on different point sets")
+
+    # Top pairs straight from the stores, one row block at a time (no N^2 delta frame)
+    with metrics.stage("select_pairs"):
+        pi, pj = top_pairs(m18, m25, metric, top_k)
+        cand = pd.DataFrame({"src": np.asarray(m18.ids)[pi], "dst": np.asarray(m18.ids)[pj],
+                             **delta_columns(m18.time_s[pi, pj], m18.distance_km[pi, pj],
+                                             m25.time_s[pi, pj], m25.distance_km[pi, pj])})
+        cand["abs_metric"] = cand[metric].abs()
+        # Matrix cells of the return legs, row for row
+        ret = pd.DataFrame(delta_columns(m18.time_s[pj, pi], m18.distance_km[pj, pi],
+                                         m25.time_s[pj, pi], m25.distance_km[pj, pi]))
     
     center = (float(points["lat"].mean()), float(points["lon"].mean()))
-    m = folium.Map(location=center, zoom_start=14, control_scale=True)  # zoom=14 for Districts 1,2,3
+    m = folium.Map(location=center, zoom_start=14, control_scale=True, max_zoom=max_zoom)  # zoom=14 for Districts 1,2,3
+
+    # Shared, simplified geometry for all route lines (added first so it renders before the layers)
+    geom_table = None
+    if optimize:
+        geom_table = GeometryTable(tolerance_px, max_zoom, lat=center[0])
+        geom_table.add_to(m)
 
     # Track OD pairs and their colors for dynamic legend
     legend_entries = []
 
+    # All four legs of every pair, fetched across both engines at once
+    pairs = [(int(r.src), int(r.dst)) for r in cand.itertuples(index=False)]
+    with metrics.stage("fetch_routes"):
+        routes = fetch_routes(points, pairs)
+
     for i, row in cand.reset_index(drop=True).iterrows():
         src = int(row["src"])
         dst = int(row["dst"])
@@ -131,8 +213,8 @@ def main(top_k=10, metric="delta_distance_km"):
         fg = folium.FeatureGroup(name=layer_name, show=True)
 
         # Forward route (src → dst) - BLUE
-        coords18_fwd, sum18_fwd = route_coords(BASE_2018, A, B)
-        coords25_fwd, sum25_fwd = route_coords(BASE_2025, A, B)
+        coords18_fwd, sum18_fwd = routes[(BASE_2018, src, dst)]
+        coords25_fwd, sum25_fwd = routes[(BASE_2025, src, dst)]
 
         if not coords18_fwd or not coords25_fwd:
             print(f"[{i+1}/{top_k}] ✗ Failed {src}→{dst}")
@@ -152,14 +234,14 @@ def main(top_k=10, metric="delta_distance_km"):
         """
 
         # Forward 2018 - Solid
-        folium.PolyLine(coords18_fwd, weight=5, opacity=0.9, color=color_fwd,
+        add_route_line(fg, coords18_fwd, geom_table, weight=5, opacity=0.9, color=color_fwd,
                        tooltip=f"▶ FWD 2018: {src}→{dst}",
-                       popup=folium.Popup(popup_fwd, max_width=400)).add_to(fg)
+                       popup=folium.Popup(popup_fwd, max_width=400))
 
         # Forward 2025 - Dashed
-        folium.PolyLine(coords25_fwd, weight=5, opacity=0.9, color=color_fwd,
+        add_route_line(fg, coords25_fwd, geom_table, weight=5, opacity=0.9, color=color_fwd,
                        dash_array="12,8", tooltip=f"▶ FWD 2025: {src}→{dst}",
-                       popup=folium.Popup(popup_fwd, max_width=400)).add_to(fg)
+                       popup=folium.Popup(popup_fwd, max_width=400))
 
         # Markers: Green for Source, Orange for Destination
         folium.Marker(A, icon=folium.Icon(color="green", icon="play"),
@@ -168,11 +250,11 @@ def main(top_k=10, metric="delta_distance_km"):
                      tooltip=f"DST: Point {dst}").add_to(fg)
         
         # Return route (dst → src) - RED color, lookup actual B→A data
-        coords18_ret, sum18_ret = route_coords(BASE_2018, B, A)
-        coords25_ret, sum25_ret = route_coords(BASE_2025, B, A)
-        ret_row = get_delta_row(delta, dst, src)
+        coords18_ret, sum18_ret = routes[(BASE_2018, dst, src)]
+        coords25_ret, sum25_ret = routes[(BASE_2025, dst, src)]
+        ret_row = ret.iloc[i]
 
-        if coords18_ret and coords25_ret and ret_row is not None:
+        if coords18_ret and coords25_ret:
             # Calculate asymmetry between forward and return
             fwd_time_25 = row['time_s_2025']
             ret_time_25 = ret_row['time_s_2025']
@@ -183,7 +265,7 @@ def main(top_k=10, metric="delta_distance_km"):
             dist_asym = ret_dist_25 - fwd_dist_25 if pd.notna(ret_dist_25) and pd.notna(fwd_dist_25) else 0
 
             asym_note = ""
-            if abs(time_asym) > 60 or abs(dist_asym) > 0.3:
+            if abs(time_asym) > ASYMMETRY_TIME_S or abs(dist_asym) > ASYMMETRY_DISTANCE_KM:
                 asym_note = f"<br><b style='color:#dc2626'>⚠️ ASYMMETRY vs Forward: Δt={time_asym:+.0f}s, Δd={dist_asym:+.2f}km</b>"
 
             popup_ret = f"""
@@ -198,16 +280,16 @@ def main(top_k=10, metric="delta_distance_km"):
             """
 
             # Return 2018 - Solid
-            folium.PolyLine(coords18_ret, weight=5, opacity=0.9, color=color_ret,
+            add_route_line(fg, coords18_ret, geom_table, weight=5, opacity=0.9, color=color_ret,
                            tooltip=f"◀ RET 2018: {dst}→{src}",
-                           popup=folium.Popup(popup_ret, max_width=400)).add_to(fg)
+                           popup=folium.Popup(popup_ret, max_width=400))
 
             # Return 2025 - Dashed
-            folium.PolyLine(coords25_ret, weight=5, opacity=0.9, color=color_ret,
+            add_route_line(fg, coords25_ret, geom_table, weight=5, opacity=0.9, color=color_ret,
                            dash_array="12,8", tooltip=f"◀ RET 2025: {dst}→{src}",
-                           popup=folium.Popup(popup_ret, max_width=400)).add_to(fg)
+                           popup=folium.Popup(popup_ret, max_width=400))
 
-            if abs(time_asym) > 60 or abs(dist_asym) > 0.3:
+            if abs(time_asym) > ASYMMETRY_TIME_S or abs(dist_asym) > ASYMMETRY_DISTANCE_KM:
                 print(f"      ⚠️  Asymmetry: Δtime={time_asym:+.0f}s, Δdist={dist_asym:+.2f}km")
         
         fg.add_to(m)
@@ -249,14 +331,28 @@ def main(top_k=10, metric="delta_distance_km"):
     m.get_root().html.add_child(folium.Element(legend_html))
 
     folium.LayerControl(collapsed=False).add_to(m)
-    m.save(OUT_HTML)
+    with metrics.stage("save_html"):
+        m.save(OUT_HTML)
     print(f"\n✅ Saved: {OUT_HTML}")
     print(f"   {len(legend_entries)} OD pairs with unique colors | Solid=2018, Dashed=2025")
+    if geom_table is not None:
+        size = os.path.getsize(OUT_HTML)
+        print(f"   Optimized geometry: {geom_table.report()}")
+        print(f"   HTML size {size / 1024:.1f} KB, {geom_table.inline_bytes(size) / 1024:.1f} KB without --optimize")
+    print_cache_stats()
+
+def run(args) -> None:
+    """Entry point for parsed cli.draw_arguments() flags."""
+    with metrics.session(args):
+        main(args.top_k, args.metric, use_cache=not args.no_cache, optimize=args.optimize,
+             tolerance_px=args.tolerance_px, max_zoom=args.max_zoom, stream=args.stream,
+             sidecar=args.sidecar, workers=args.workers)
+
 
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--top-k", type=int, default=10)
-    parser.add_argument("--metric", default="delta_distance_km")
-    args = parser.parse_args()
-    main(args.top_k, args.metric)
+    import cli
+
+    parser = argparse.ArgumentParser(description="Map the routes that changed most")
+    cli.draw_arguments(parser)
+    run(parser.parse_args())
@@ -1,15 +1,23 @@
-import random, math, time
+import random, math, os, time
 import argparse
+import numpy as np
 import pandas as pd
-import requests
 
+import metrics
 from config import (
     MIN_LON, MIN_LAT, MAX_LON, MAX_LAT,
-    VALHALLA_2025, LOCATE_TIMEOUT, POINTS_DATA_CSV
+    VALHALLA_2018, VALHALLA_2025, ENGINE_PBFS, LOCATE_TIMEOUT, POINTS_DATA_CSV
 )
+from valhalla_client import get_client, run_concurrent, service_limits
 
 VALHALLA_LOCATE_URL = f"{VALHALLA_2025}/locate"
 
+# Concurrent /locate requests in batched mode
+LOCATE_CONNECTIONS = 4
+
+# Candidates snapped per vectorized step with the offline index
+LOCAL_SNAP_BLOCK = 4096
+
 def haversine_m(lat1, lon1, lat2, lon2):
     R = 6371000.0
     p1, p2 = math.radians(lat1), math.radians(lat2)
@@ -18,11 +26,45 @@ def haversine_m(lat1, lon1, lat2, lon2):
     a = math.sin(dp/2)**2 + math.cos(p1)*math.cos(p2)*math.sin(dl/2)**2
     return 2 * R * math.asin(math.sqrt(a))
 
+def haversine_m_vec(lat1, lon1, lat2, lon2):
+    """Vectorized haversine_m over NumPy arrays."""
+    R = 6371000.0
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dp = np.radians(lat2 - lat1)
+    dl = np.radians(lon2 - lon1)
+    a = np.sin(dp/2)**2 + np.cos(p1)*np.cos(p2)*np.sin(dl/2)**2
+    return 2 * R * np.arcsin(np.sqrt(a))
+
+def python_random_state(seed):
+    """
+    NumPy generator that replays exactly the stream of random.seed(seed),
+    so vectorized draws match the sequential random.uniform calls.
+    """
+    state = random.Random(seed).getstate()[1]
+    rs = np.random.RandomState()
+    rs.set_state(("MT19937", np.array(state[:-1], dtype=np.uint32), state[-1]))
+    return rs
+
+def draw_candidates(rs, k, min_lon, min_lat, max_lon, max_lat):
+    """
+    Next k candidates, in the same order as the sequential loop
+    (lat then lon for each candidate, like random.uniform).
+    """
+    u = rs.random_sample(2 * k).reshape(k, 2)
+    lats = min_lat + (max_lat - min_lat) * u[:, 0]
+    lons = min_lon + (max_lon - min_lon) * u[:, 1]
+    return lats, lons
+
+def locate_batch_size():
+    """Locations per /locate request, capped by the engine's max_locations."""
+    limit = service_limits(VALHALLA_2025).get("max_locations")
+    return int(limit) if limit else 100
+
 def locate(lat, lon, timeout=LOCATE_TIMEOUT):
     payload = {"locations": [{"lat": lat, "lon": lon}]}
-    r = requests.post(VALHALLA_LOCATE_URL, json=payload, timeout=timeout)
+    r = get_client(VALHALLA_2025).post("/locate", payload, timeout=timeout)
     r.raise_for_status()
-    return r.json()
+    return metrics.decode(r)
 
 def _unwrap_locate_response(resp):
     """
@@ -45,6 +87,15 @@ def _unwrap_locate_response(resp):
 
     return None
 
+def _unwrap_locate_batch(resp):
+    """Per-location results of a multi-location /locate call (dict or list form)."""
+    if isinstance(resp, dict):
+        locs = resp.get("locations")
+        return locs if isinstance(locs, list) else []
+    if isinstance(resp, list):
+        return resp
+    return []
+
 def pick_snapped_point(resp):
     """
     Extract snapped (correlated/projected) lat/lon from locate response.
@@ -76,7 +127,28 @@ def pick_snapped_point(resp):
 
     return float(slat), float(slon)
 
-def main(n=50, min_lon=MIN_LON, min_lat=MIN_LAT, max_lon=MAX_LON, max_lat=MAX_LAT, seed=42, max_snap_m=40, max_tries=8000, sleep_s=0.01):
+def snap_batch(lats, lons, timeout=LOCATE_TIMEOUT):
+    """
+    Snap one batch with a single /locate call.
+    Returns (slat, slon) arrays with NaN where a location did not snap.
+    """
+    payload = {"locations": [{"lat": float(a), "lon": float(b)} for a, b in zip(lats, lons)]}
+    slat = np.full(len(lats), np.nan)
+    slon = np.full(len(lats), np.nan)
+    try:
+        r = get_client(VALHALLA_2025).post("/locate", payload, timeout=timeout)
+        r.raise_for_status()
+        results = _unwrap_locate_batch(metrics.decode(r))
+    except Exception:
+        return slat, slon
+
+    for k, loc in enumerate(results[:len(lats)]):
+        snapped = pick_snapped_point([loc]) if isinstance(loc, dict) else None
+        if snapped:
+            slat[k], slon[k] = snapped
+    return slat, slon
+
+def generate_sequential(n, min_lon, min_lat, max_lon, max_lat, seed, max_snap_m, max_tries, sleep_s):
     random.seed(seed)
     accepted = []
     tries = 0
@@ -110,6 +182,82 @@ def main(n=50, min_lon=MIN_LON, min_lat=MIN_LAT, max_lon=MAX_LON, max_lat=MAX_LA
 
         time.sleep(sleep_s)
 
+    return accepted, tries
+
+def generate_batched(n, min_lon, min_lat, max_lon, max_lat, seed, max_snap_m, max_tries,
+                     batch_size, connections=LOCATE_CONNECTIONS, snap_block=None):
+    """
+    Same points as the sequential loop, but candidates are drawn in blocks,
+    snapped batch_size per request over several connections and filtered
+    with a vectorized haversine. snap_block(lats, lons) -> (slat, slon)
+    replaces the /locate calls (e.g. the offline snapping index).
+    """
+    rs = python_random_state(seed)
+    accepted = []
+    tries = 0
+    block = batch_size * connections
+
+    while len(accepted) < n and tries < max_tries:
+        k = min(block, max_tries - tries)
+        lats, lons = draw_candidates(rs, k, min_lon, min_lat, max_lon, max_lat)
+
+        if snap_block is not None:
+            slat, slon = snap_block(lats, lons)
+        else:
+            chunks = [(lats[i:i + batch_size], lons[i:i + batch_size]) for i in range(0, k, batch_size)]
+            snapped = run_concurrent(lambda c: snap_batch(*c), chunks, VALHALLA_2025)
+            slat = np.concatenate([s[0] for s in snapped])
+            slon = np.concatenate([s[1] for s in snapped])
+
+        d = haversine_m_vec(lats, lons, slat, slon)
+        # Small margin: the scalar haversine_m below makes the final call
+        candidates = np.flatnonzero(d <= max_snap_m + 1e-6)
+
+        for c in candidates:
+            d_exact = haversine_m(lats[c], lons[c], slat[c], slon[c])
+            if d_exact > max_snap_m:
+                continue
+            accepted.append({
+                "id": len(accepted) + 1,
+                "lat": float(slat[c]),
+                "lon": float(slon[c]),
+                "snap_m": round(d_exact, 2)
+            })
+            if len(accepted) == n:
+                tries += int(c) + 1
+                break
+        else:
+            tries += k
+
+    return accepted, tries
+
+def main(n=50, min_lon=MIN_LON, min_lat=MIN_LAT, max_lon=MAX_LON, max_lat=MAX_LAT, seed=42, max_snap_m=40, max_tries=8000, sleep_s=0.01, batch_size=None, snapper="valhalla"):
+    """
+    batch_size=None snaps in batches sized from the engine's max_locations;
+    batch_size=0 uses the original one-request-per-candidate loop.
+    snapper="local" snaps offline against the 2025 extract (snap_index.py)
+    and, when the 2018 extract is there too, flags points that lie on a
+    different road in 2018.
+    """
+    with metrics.stage("snap_points"):
+        if snapper == "local":
+            from snap_index import compare_snapshots, index_for
+
+            index = index_for(VALHALLA_2025)
+            accepted, tries = generate_batched(n, min_lon, min_lat, max_lon, max_lat, seed,
+                                               max_snap_m, max_tries, LOCAL_SNAP_BLOCK, connections=1,
+                                               snap_block=lambda la, lo: index.snap(la, lo, max_snap_m)[:2])
+        else:
+            if batch_size is None:
+                batch_size = locate_batch_size()
+
+            if batch_size > 0:
+                accepted, tries = generate_batched(n, min_lon, min_lat, max_lon, max_lat, seed,
+                                                   max_snap_m, max_tries, batch_size)
+            else:
+                accepted, tries = generate_sequential(n, min_lon, min_lat, max_lon, max_lat, seed,
+                                                      max_snap_m, max_tries, sleep_s)
+
     if len(accepted) < n:
         raise RuntimeError(
             f"We can just only create {len(accepted)}/{n} points after {tries} attempts. "
@@ -117,30 +265,41 @@ def main(n=50, min_lon=MIN_LON, min_lat=MIN_LAT, max_lon=MAX_LON, max_lat=MAX_LA
         )
 
     df = pd.DataFrame(accepted)
-    df.to_csv(POINTS_DATA_CSV, index=False)
+    if snapper == "local" and not os.path.exists(ENGINE_PBFS[VALHALLA_2018]):
+        print(f"⚠️  {ENGINE_PBFS[VALHALLA_2018]} not found: skipping the road_changed check against 2018 "
+              f"(cut it with `python build_snapshots.py --years 2018`)")
+    elif snapper == "local":
+        df["road_changed"] = compare_snapshots(df["lat"].to_numpy(), df["lon"].to_numpy(),
+                                               max_snap_m)["road_changed"]
+        if df["road_changed"].any():
+            print(f"⚠️  {int(df['road_changed'].sum())} points snap to a different road in 2018: "
+                  f"{df.loc[df['road_changed'], 'id'].tolist()}")
+    with metrics.stage("write_points"):
+        df.to_csv(POINTS_DATA_CSV, index=False)
     print(f"✅ {POINTS_DATA_CSV} generated")
     print(df["snap_m"].describe())
 
+
+def run(args) -> None:
+    """Entry point for parsed cli.points_arguments() flags."""
+    with metrics.session(args):
+        main(
+            n=args.n,
+            min_lon=args.min_lon,
+            min_lat=args.min_lat,
+            max_lon=args.max_lon,
+            max_lat=args.max_lat,
+            seed=args.seed,
+            max_snap_m=args.max_snap_m,
+            max_tries=args.max_tries,
+            batch_size=args.batch_size,
+            snapper=args.snapper
+        )
+
+
 if __name__ == "__main__":
+    import cli
+
     parser = argparse.ArgumentParser(description="Generate snapped points for this region")
-    parser.add_argument("--n", type=int, default=50, help="Number of points to generate (default: 50)")
-    parser.add_argument("--min-lon", type=float, default=MIN_LON, help=f"Minimum longitude (default: {MIN_LON})")
-    parser.add_argument("--min-lat", type=float, default=MIN_LAT, help=f"Minimum latitude (default: {MIN_LAT})")
-    parser.add_argument("--max-lon", type=float, default=MAX_LON, help=f"Maximum longitude (default: {MAX_LON})")
-    parser.add_argument("--max-lat", type=float, default=MAX_LAT, help=f"Maximum latitude (default: {MAX_LAT})")
-    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: 42)")
-    parser.add_argument("--max-snap-m", type=float, default=40, help="Maximum snap distance in meters (default: 40)")
-    parser.add_argument("--max-tries", type=int, default=8000, help="Maximum attempts to generate points (default: 8000)")
-    
-    args = parser.parse_args()
-    
-    main(
-        n=args.n,
-        min_lon=args.min_lon,
-        min_lat=args.min_lat,
-        max_lon=args.max_lon,
-        max_lat=args.max_lat,
-        seed=args.seed,
-        max_snap_m=args.max_snap_m,
-        max_tries=args.max_tries
-    )
+    cli.points_arguments(parser)
+    run(parser.parse_args())
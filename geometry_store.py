@@ -0,0 +1,251 @@
+"""
+Full-matrix route geometry harvesting and a compact columnar geometry store.
+
+Every src -> dst route of a snapshot is fetched as polyline6 and kept as
+int32 microdegree deltas (exactly the varints of the polyline: first vertex
+absolute, then differences) in one flat (total_vertices, 2) buffer. An
+int64 offsets array of length N*N + 1 points into it, so the geometry of
+pair (i, j) is coords[offsets[i*N + j]:offsets[i*N + j + 1]], an O(1) slice of
+a memory-mapped file.
+
+Layout:
+    b"HCMGEO1\\n" | uint32 header length | header JSON | padding | ids | offsets | coords
+"""
+import argparse
+import json
+import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from build_snapshots import check_snapshots
+from config import (
+    VALHALLA_2018, VALHALLA_2025, COSTING, POINTS_CSV, ROUTE_TIMEOUT,
+    GEOMETRY_2018_BIN, GEOMETRY_2025_BIN
+)
+from matrix_store import points_hash
+from polyline import deltas_many
+from valhalla_client import engine_id, get_client, run_concurrent
+
+MAGIC = b"HCMGEO1\n"
+ALIGN = 64
+PRECISION = 6
+
+# Source rows fetched (and checkpointed) per harvesting step
+BLOCK_ROWS = 4
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class GeometryStore:
+    """Opened geometry file; offsets/coords are memory-mapped views."""
+
+    def __init__(self, path: str, meta: dict, ids, offsets, coords):
+        self.path = path
+        self.meta = meta
+        self.ids = ids
+        self.offsets = offsets
+        self.coords = coords
+        self._index = {int(p): i for i, p in enumerate(ids)}
+
+    @property
+    def n(self) -> int:
+        return len(self.ids)
+
+    def deltas(self, i: int, j: int) -> np.ndarray:
+        """Raw int32 delta rows of pair (i, j) by index, zero-copy."""
+        k = i * self.n + j
+        return self.coords[self.offsets[k]:self.offsets[k + 1]]
+
+    def route(self, i: int, j: int) -> np.ndarray:
+        """(k, 2) float64 lat/lon of pair (i, j) by index; empty if no route."""
+        d = self.deltas(i, j)
+        return np.cumsum(d, axis=0, dtype=np.int64) / 10 ** PRECISION
+
+    def route_ids(self, src: int, dst: int) -> np.ndarray:
+        """Same as route(), by point id."""
+        return self.route(self._index[int(src)], self._index[int(dst)])
+
+
+def load_geometry(path: str) -> GeometryStore:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a geometry store")
+        (hlen,) = struct.unpack("<I", f.read(4))
+        meta = json.loads(f.read(hlen).decode("utf-8"))
+    data_start = _align(len(MAGIC) + 4 + hlen)
+    a = {k: data_start + v for k, v in meta["arrays"].items()}
+    n = meta["n"]
+    ids = np.memmap(path, dtype="<i4", mode="r", offset=a["ids"], shape=(n,))
+    offsets = np.memmap(path, dtype="<i8", mode="r", offset=a["offsets"], shape=(n * n + 1,))
+    n_vertices = int(offsets[-1])
+    coords = (np.memmap(path, dtype="<i4", mode="r", offset=a["coords"], shape=(n_vertices, 2))
+              if n_vertices else np.zeros((0, 2), dtype="<i4"))
+    return GeometryStore(path, meta, ids, offsets, coords)
+
+
+def _fetch_shape(base_url: str, A: tuple, B: tuple):
+    """polyline6 shape of the A -> B route, or None."""
+    payload = {
+        "locations": [{"lat": A[0], "lon": A[1]}, {"lat": B[0], "lon": B[1]}],
+        "costing": COSTING,
+        "shape_format": "polyline6",
+        "directions_type": "none",
+    }
+    try:
+        r = get_client(base_url).post("/route", payload, timeout=ROUTE_TIMEOUT)
+        r.raise_for_status()
+        return metrics.decode(r)["trip"]["legs"][0]["shape"]
+    except Exception:
+        return None
+
+
+def _write_store(out_path: str, meta: dict, ids, offsets, coords_path: str) -> None:
+    n = len(ids)
+    # Array offsets are relative to the (aligned) end of the header
+    a = {"ids": 0}
+    a["offsets"] = _align(4 * n)
+    a["coords"] = _align(a["offsets"] + 8 * (n * n + 1))
+    header = json.dumps({**meta, "arrays": a}).encode()
+    data_start = _align(len(MAGIC) + 4 + len(header))
+
+    tmp = f"{out_path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.seek(data_start + a["ids"])
+        f.write(np.asarray(ids, dtype="<i4").tobytes())
+        f.seek(data_start + a["offsets"])
+        f.write(np.asarray(offsets, dtype="<i8").tobytes())
+        f.seek(data_start + a["coords"])
+        with open(coords_path, "rb") as src:
+            shutil.copyfileobj(src, f, length=16 * 1024 * 1024)
+    os.replace(tmp, out_path)
+
+
+def harvest(base_url: str, points: pd.DataFrame, out_path: str, snapshot,
+            block_rows: int = BLOCK_ROWS) -> GeometryStore:
+    """
+    Fetch every src -> dst route of one snapshot and write a geometry store.
+    Rows are fetched block_rows at a time; progress is checkpointed next to
+    out_path, so an interrupted harvest resumes at the last finished block,
+    as long as the points, the engine's tile set and the costing are the same.
+    """
+    ids = points["id"].to_numpy()
+    lat = points["lat"].to_numpy(dtype=float)
+    lon = points["lon"].to_numpy(dtype=float)
+    n = len(ids)
+    phash = points_hash(ids, lat, lon)
+    eid = engine_id(base_url)
+    checkpoint = {"points_hash": phash, "engine_id": eid, "costing": COSTING}
+
+    coords_path = f"{out_path}.coords.part"
+    offsets_path = f"{out_path}.offsets.part"
+    progress_path = f"{out_path}.progress.json"
+
+    offsets = np.zeros(n * n + 1, dtype=np.int64)
+    start_row = failed = 0
+    if all(os.path.exists(p) for p in (coords_path, offsets_path, progress_path)):
+        with open(progress_path) as f:
+            prog = json.load(f)
+        if any(prog.get(k) != v for k, v in checkpoint.items()):
+            # Other points, rebuilt tiles or another costing: the rows so far do not belong to this run
+            print(f"  [{snapshot}] checkpoint is for other inputs or another tile set, restarting at row 0")
+        else:
+            start_row, failed = prog["rows_done"], prog.get("failed", 0)
+            done = np.fromfile(offsets_path, dtype="<i8", count=start_row * n)
+            offsets[1:len(done) + 1] = done
+            print(f"  [{snapshot}] resuming at row {start_row}/{n}")
+    mode = "r+b" if start_row else "wb"
+
+    with open(coords_path, mode) as out, open(offsets_path, mode) as out_offsets:
+        # Drop anything written after the last checkpoint
+        out.truncate(int(offsets[start_row * n]) * 8)
+        out.seek(0, os.SEEK_END)
+        out_offsets.truncate(start_row * n * 8)
+        out_offsets.seek(0, os.SEEK_END)
+
+        for i0 in range(start_row, n, block_rows):
+            rows = range(i0, min(n, i0 + block_rows))
+            pairs = [(i, j) for i in rows for j in range(n) if i != j]
+            shapes = run_concurrent(
+                lambda p: _fetch_shape(base_url, (lat[p[0]], lon[p[0]]), (lat[p[1]], lon[p[1]])),
+                pairs, base_url)
+
+            # Whole block decoded in one pass; the diagonal stays empty
+            failed += sum(1 for shape in shapes if not shape)
+            deltas, counts = deltas_many([shape or "" for shape in shapes])
+            out.write(deltas.astype("<i4").tobytes())
+
+            vertices = np.zeros(len(rows) * n, dtype=np.int64)
+            flat = np.array([(i - i0) * n + j for i, j in pairs], dtype=np.int64)
+            vertices[flat] = counts
+            start = int(offsets[i0 * n])
+            offsets[i0 * n + 1:(i0 + len(rows)) * n + 1] = start + np.cumsum(vertices)
+            pos = int(offsets[(i0 + len(rows)) * n])
+
+            rows_done = rows[-1] + 1
+            out_offsets.write(offsets[i0 * n + 1:rows_done * n + 1].tobytes())
+            out.flush()
+            out_offsets.flush()
+            tmp = f"{progress_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({**checkpoint, "rows_done": rows_done, "failed": failed}, f)
+            os.replace(tmp, progress_path)
+            print(f"  [{snapshot}] rows {rows_done}/{n}, {pos:,} vertices")
+
+    meta = {
+        "snapshot": snapshot,
+        "costing": COSTING,
+        "n": n,
+        "precision": PRECISION,
+        "points_hash": phash,
+        "engine": base_url,
+        "engine_id": eid,
+        "failed_routes": failed,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    _write_store(out_path, meta, ids, offsets, coords_path)
+    for p in (coords_path, offsets_path, progress_path):
+        os.remove(p)
+    return load_geometry(out_path)
+
+
+def _timed_harvest(base_url, points, out_path, snapshot, block_rows):
+    with metrics.stage(f"harvest_{snapshot}"):
+        return harvest(base_url, points, out_path, snapshot, block_rows)
+
+
+def main(block_rows=BLOCK_ROWS):
+    check_snapshots([VALHALLA_2018, VALHALLA_2025])
+    points = pd.read_csv(POINTS_CSV)
+    n = len(points)
+    print(f"Harvesting {n * (n - 1):,} routes per snapshot for {n} points")
+
+    jobs = [(VALHALLA_2018, GEOMETRY_2018_BIN, 2018), (VALHALLA_2025, GEOMETRY_2025_BIN, 2025)]
+    with ThreadPoolExecutor(max_workers=len(jobs)) as years:
+        futures = [years.submit(_timed_harvest, base, points, path, year, block_rows)
+                   for base, path, year in jobs]
+        for (_, path, _), fut in zip(jobs, futures):
+            store = fut.result()
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            print(f"✅ {path} saved ({len(store.coords):,} vertices, {size_mb:.1f} MB, "
+                  f"{store.meta['failed_routes']} failed routes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch route geometry for every OD pair in both snapshots")
+    parser.add_argument("--block-rows", type=int, default=BLOCK_ROWS,
+                        help=f"Source rows fetched per checkpoint (default: {BLOCK_ROWS})")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    with metrics.session(args):
+        main(block_rows=args.block_rows)
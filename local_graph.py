@@ -0,0 +1,567 @@
+"""
+Offline road graph and many-to-many travel times without Valhalla.
+
+The snapshot's OSM extract is read with pyosmium into a CSR graph (one
+directed edge per way segment and travel direction, with auto-style access
+and oneway rules and per-class speeds). The graph is saved as a directory of
+.npy arrays that load memory-mapped. Travel times come from one Dijkstra per
+source: scipy.sparse.csgraph when SciPy is installed, a heapq search that
+stops once every target is settled otherwise. Distances are summed along the
+fastest path, like Valhalla's matrix.
+
+Points snap to the nearest point of a road segment (snap_index.py's grid),
+restricted to the largest strongly connected component so an isolated
+service road never swallows a point. A route starts with the rest of the
+snapped segment towards either end, in each direction the segment can be
+driven, and ends with the part of the target's segment up to its position;
+both pay the segment's cost in proportion.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from config import (
+    VALHALLA_2018, VALHALLA_2025, POINTS_CSV,
+    MATRIX_2018_CSV, MATRIX_2025_CSV,
+    ENGINE_PBFS, LOCAL_GRAPH_DIRS, LOCAL_SNAP_RADIUS_M, LOCAL_SNAP_MAX_M, BBOX_STR
+)
+
+try:
+    import osmium
+except ImportError:  # only needed to build graphs
+    osmium = None
+
+try:
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import connected_components, dijkstra
+except ImportError:
+    csr_matrix = None
+
+GRAPH_VERSION = 2
+
+# Dijkstra roots per scipy call (each returns a row over all nodes)
+SEARCH_BATCH = 64
+EARTH_RADIUS_M = 6371000.0
+M_PER_DEG_LAT = 111320.0
+
+# Free-flow km/h per highway class (urban Valhalla auto defaults, roughly)
+AUTO_SPEEDS_KPH = {
+    "motorway": 90, "motorway_link": 55,
+    "trunk": 65, "trunk_link": 40,
+    "primary": 48, "primary_link": 35,
+    "secondary": 42, "secondary_link": 30,
+    "tertiary": 36, "tertiary_link": 30,
+    "unclassified": 30, "residential": 27, "road": 27,
+    "living_street": 12, "service": 18, "track": 12,
+}
+NO_ACCESS = {"no", "private", "agricultural", "forestry", "delivery"}
+ONEWAY_FORWARD = {"yes", "1", "true"}
+
+
+def _file_sha1(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dp = p2 - p1
+    dl = np.radians(lon2 - lon1)
+    a = np.sin(dp / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def _speed_kph(tags, highway: str) -> float:
+    """maxspeed when it is a plain km/h number, else the class default."""
+    default = AUTO_SPEEDS_KPH[highway]
+    raw = tags.get("maxspeed", "")
+    try:
+        return min(float(raw), default * 1.5)
+    except ValueError:
+        return default
+
+
+def _car_direction(tags) -> int | None:
+    """1 = both ways, 2 = forward only, 3 = backward only, None = no car access."""
+    highway = tags.get("highway")
+    if highway not in AUTO_SPEEDS_KPH or tags.get("area") == "yes":
+        return None
+    car = tags.get("motorcar", tags.get("motor_vehicle"))
+    if car in NO_ACCESS or (car is None and tags.get("access") in NO_ACCESS):
+        return None
+    oneway = tags.get("oneway", "")
+    if oneway == "reversible":
+        return None
+    if oneway == "-1":
+        return 3
+    if (oneway in ONEWAY_FORWARD or tags.get("junction") in ("roundabout", "circular")
+            or (highway in ("motorway", "motorway_link") and oneway != "no")):
+        return 2
+    return 1
+
+
+class RoadGraph:
+    """
+    CSR graph: node coordinates, indptr/indices for outgoing edges, and
+    per-edge time_s/length_m/way_id (source OSM way). Arrays may be
+    memory-mapped views.
+    """
+
+    def __init__(self, meta: dict, arrays: dict):
+        self.meta = meta
+        self.lat = arrays["lat"]
+        self.lon = arrays["lon"]
+        self.indptr = arrays["indptr"]
+        self.indices = arrays["indices"]
+        self.time_s = arrays["time_s"]
+        self.length_m = arrays["length_m"]
+        self.way_id = arrays["way_id"]
+        self.main = arrays["main"]
+        self._csr = None
+        self._csr_reversed = None
+        self._keys = None
+        self._lists = None
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.lat)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    def snap(self, lat, lon, index) -> tuple:
+        """
+        Nearest point on a main-component road segment for each point, found
+        in index (snap_index.SnapIndex over this graph). The search radius
+        starts at LOCAL_SNAP_RADIUS_M and doubles for points with nothing in
+        range, up to LOCAL_SNAP_MAX_M. Returns (a, b, t, snap_m): the segment's
+        end nodes, the position as a fraction of the way from a to b, and
+        the snap distance in metres; -1 / NaN where no road is in range.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        main = np.asarray(self.main)
+        allowed = main[index.seg_a] & main[index.seg_b]
+        seg = np.full(len(lat), -1, dtype=np.int64)
+        t = np.full(len(lat), np.nan)
+        snap_m = np.full(len(lat), np.nan)
+        todo = np.arange(len(lat))
+        radius = LOCAL_SNAP_RADIUS_M
+        while len(todo):
+            s, tt, _, _, m = index.nearest(lat[todo], lon[todo], radius, allowed)
+            seg[todo], t[todo], snap_m[todo] = s, tt, m
+            todo = todo[s < 0]
+            if radius >= LOCAL_SNAP_MAX_M:
+                break
+            radius = min(2 * radius, LOCAL_SNAP_MAX_M)
+        found = seg >= 0
+        a = np.where(found, np.asarray(index.seg_a)[np.maximum(seg, 0)], -1)
+        b = np.where(found, np.asarray(index.seg_b)[np.maximum(seg, 0)], -1)
+        return a, b, t, snap_m
+
+    def edge_ids(self, u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        """Index of edge u -> v (only the fastest parallel edge is kept), -1 where there is none."""
+        if self._keys is None:
+            # Edges are sorted by source, then target, so the keys are sorted too
+            src = np.repeat(np.arange(self.n_nodes, dtype=np.int64), np.diff(self.indptr))
+            self._keys = src * self.n_nodes + np.asarray(self.indices)
+        keys = np.asarray(u, dtype=np.int64) * self.n_nodes + np.asarray(v, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        return np.where((self._keys[pos] == keys) & (np.asarray(u) >= 0), pos, -1)
+
+    def _edge_costs(self, u: np.ndarray, v: np.ndarray, share: np.ndarray) -> tuple:
+        """share of the time and length of edges u -> v; inf / NaN where the edge does not exist."""
+        e = self.edge_ids(u, v)
+        ok = e >= 0
+        t = np.where(ok, np.asarray(self.time_s, dtype=np.float64)[np.maximum(e, 0)] * share, np.inf)
+        d = np.where(ok, np.asarray(self.length_m, dtype=np.float64)[np.maximum(e, 0)] * share, np.nan)
+        return t, d
+
+    def _access(self, a, b, t, leaving: bool) -> tuple:
+        """
+        (nodes, time, length), each (n, 2): the two nodes a route can leave a
+        snapped position towards (leaving) or reach it from, and the partial
+        segment costs in between; inf time where that direction is not allowed.
+        """
+        if leaving:
+            # Forward along a -> b to b, or backward along b -> a to a
+            fwd = self._edge_costs(a, b, 1 - t)
+            bwd = self._edge_costs(b, a, t)
+            nodes = np.column_stack((b, a))
+        else:
+            # Arrive from a along a -> b, or from b along b -> a
+            fwd = self._edge_costs(a, b, t)
+            bwd = self._edge_costs(b, a, 1 - t)
+            nodes = np.column_stack((a, b))
+        return nodes, np.column_stack((fwd[0], bwd[0])), np.column_stack((fwd[1], bwd[1]))
+
+    def point_matrix(self, src: tuple, tgt: tuple) -> tuple:
+        """
+        (time_s, distance_km) float64 arrays between snapped positions
+        (snap() results). Each pair takes the fastest of the node-to-node
+        routes between its segments' ends plus the partial segments, or
+        drives straight along a shared segment when its direction allows.
+        """
+        s_nodes, s_t, s_d = self._access(*src[:3], leaving=True)
+        g_nodes, g_t, g_d = self._access(*tgt[:3], leaving=False)
+        ns, nt = len(s_nodes), len(g_nodes)
+        t, d = self.many_to_many(np.maximum(s_nodes, 0).ravel(), np.maximum(g_nodes, 0).ravel())
+        t = np.where(np.isnan(t), np.inf, t).reshape(ns, 2, nt, 2)
+        d = d.reshape(ns, 2, nt, 2) * 1000.0
+        total = s_t[:, :, None, None] + t + g_t[None, None, :, :]
+        length = s_d[:, :, None, None] + d + g_d[None, None, :, :]
+
+        # Fastest of the four (leave by, arrive by) combinations
+        total = total.transpose(0, 2, 1, 3).reshape(ns, nt, 4)
+        length = length.transpose(0, 2, 1, 3).reshape(ns, nt, 4)
+        best = np.argmin(total, axis=2)[:, :, None]
+        time_s = np.take_along_axis(total, best, axis=2)[:, :, 0]
+        dist_m = np.take_along_axis(length, best, axis=2)[:, :, 0]
+
+        # Both on one segment: straight along it when the target lies ahead
+        (sa, sb, st), (ga, gb, gt) = src[:3], tgt[:3]
+        same = (sa[:, None] == ga[None, :]) & (sb[:, None] == gb[None, :]) & (sa[:, None] >= 0)
+        for u, v, ahead in ((sa, sb, gt[None, :] - st[:, None]), (sb, sa, st[:, None] - gt[None, :])):
+            e = self.edge_ids(u, v)
+            ok = same & (e[:, None] >= 0) & (ahead >= 0)
+            e = np.maximum(e, 0)[:, None]
+            direct_t = np.where(ok, np.asarray(self.time_s, dtype=np.float64)[e] * ahead, np.inf)
+            direct_d = np.asarray(self.length_m, dtype=np.float64)[e] * ahead
+            shorter = direct_t < time_s
+            time_s = np.where(shorter, direct_t, time_s)
+            dist_m = np.where(shorter, direct_d, dist_m)
+
+        unreachable = ~np.isfinite(time_s)
+        time_s[unreachable] = np.nan
+        dist_m[unreachable] = np.nan
+        return time_s, dist_m / 1000.0
+
+    def _tree_lengths(self, pred: np.ndarray, reverse: bool = False) -> np.ndarray:
+        """
+        Path length between the root of a shortest-path tree and every node
+        (pointer jumping). reverse=True for trees grown on the reversed graph,
+        where each node's path leads to the root.
+        """
+        node = np.arange(len(pred))
+        has_parent = pred >= 0
+        acc = np.zeros(len(pred))
+        u, v = pred[has_parent], node[has_parent]
+        e = self.edge_ids(v, u) if reverse else self.edge_ids(u, v)
+        acc[has_parent] = np.asarray(self.length_m, dtype=np.float64)[e]
+        anc = np.where(has_parent, pred, node)
+        while True:
+            step = anc != anc[anc]
+            if not step.any():
+                break
+            acc[step] += acc[anc[step]]
+            anc = anc[anc]
+        return acc
+
+    def one_to_many_scipy(self, sources: np.ndarray, targets: np.ndarray) -> tuple:
+        """
+        One Dijkstra per distinct source, or per distinct target on the
+        reversed graph when there are fewer targets (e.g. a grid of origins
+        against a few destinations).
+        """
+        if self._csr is None:
+            self._csr = csr_matrix(
+                (np.asarray(self.time_s, dtype=np.float64), np.asarray(self.indices),
+                 np.asarray(self.indptr)), shape=(self.n_nodes, self.n_nodes))
+        unique_src, inv_src = np.unique(sources, return_inverse=True)
+        unique_tgt, inv_tgt = np.unique(targets, return_inverse=True)
+        reverse = len(unique_tgt) < len(unique_src)
+        if reverse:
+            if self._csr_reversed is None:
+                self._csr_reversed = self._csr.T.tocsr()
+            graph, roots, ends = self._csr_reversed, unique_tgt, unique_src
+        else:
+            graph, roots, ends = self._csr, unique_src, unique_tgt
+
+        t = np.empty((len(roots), len(ends)))
+        d = np.empty((len(roots), len(ends)))
+        # Bounded batches: each search returns a full row over all nodes
+        for r0 in range(0, len(roots), SEARCH_BATCH):
+            times, preds = dijkstra(graph, directed=True, indices=roots[r0:r0 + SEARCH_BATCH],
+                                    return_predecessors=True)
+            for k in range(len(times)):
+                t[r0 + k] = times[k, ends]
+                d[r0 + k] = self._tree_lengths(preds[k], reverse)[ends]
+        d[~np.isfinite(t)] = np.nan
+        t[~np.isfinite(t)] = np.nan
+        if reverse:
+            t, d = t.T, d.T
+        return t[inv_src][:, inv_tgt], d[inv_src][:, inv_tgt]
+
+    def one_to_many_heapq(self, source: int, targets: np.ndarray) -> tuple:
+        """Dijkstra from one node until every target is settled."""
+        if self._lists is None:
+            # Plain lists: element access on (memory-mapped) arrays is slow in a Python loop
+            self._lists = (self.indptr.tolist(), self.indices.tolist(),
+                           self.time_s.tolist(), self.length_m.tolist())
+        indptr, indices, time_s, length_m = self._lists
+        remaining = set(int(t) for t in targets)
+        best = {source: (0.0, 0.0)}
+        done = set()
+        heap = [(0.0, 0.0, source)]
+        while heap and remaining:
+            t, d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            remaining.discard(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nt = t + time_s[e]
+                if v not in best or nt < best[v][0]:
+                    best[v] = (nt, d + length_m[e])
+                    heapq.heappush(heap, (nt, best[v][1], v))
+        out = np.array([best[int(v)] if int(v) in done else (np.nan, np.nan) for v in targets])
+        return out[:, 0], out[:, 1]
+
+    def many_to_many(self, sources: np.ndarray, targets: np.ndarray) -> tuple:
+        """(time_s, distance_km) float64 arrays for node ids sources x targets."""
+        if csr_matrix is not None:
+            t, d = self.one_to_many_scipy(sources, targets)
+        else:
+            rows = [self.one_to_many_heapq(int(s), targets) for s in sources]
+            t = np.array([r[0] for r in rows]).reshape(len(sources), len(targets))
+            d = np.array([r[1] for r in rows]).reshape(len(sources), len(targets))
+        return t, d / 1000.0
+
+
+def build_graph(pbf_path: str) -> RoadGraph:
+    """Read car-accessible ways from an OSM extract into a RoadGraph."""
+    if osmium is None:
+        raise ImportError("Building a local graph needs pyosmium: pip install osmium")
+
+    node_ids = {}
+    lats, lons = [], []
+    src, dst, speed, way = [], [], [], []
+
+    def node_index(n):
+        k = node_ids.get(n.ref)
+        if k is None:
+            k = node_ids[n.ref] = len(lats)
+            lats.append(n.location.lat)
+            lons.append(n.location.lon)
+        return k
+
+    class Ways(osmium.SimpleHandler):
+        def way(self, w):
+            direction = _car_direction(w.tags)
+            if direction is None:
+                return
+            try:
+                chain = [node_index(n) for n in w.nodes]
+            except osmium.InvalidLocationError:
+                return
+            kph = _speed_kph(w.tags, w.tags["highway"])
+            for a, b in zip(chain, chain[1:]):
+                if direction in (1, 2):
+                    src.append(a)
+                    dst.append(b)
+                    speed.append(kph)
+                    way.append(w.id)
+                if direction in (1, 3):
+                    src.append(b)
+                    dst.append(a)
+                    speed.append(kph)
+                    way.append(w.id)
+
+    Ways().apply_file(pbf_path, locations=True)
+
+    lat = np.array(lats)
+    lon = np.array(lons)
+    src = np.array(src, dtype=np.int64)
+    dst = np.array(dst, dtype=np.int64)
+    way = np.array(way, dtype=np.int64)
+    length = haversine_m(lat[src], lon[src], lat[dst], lon[dst])
+    time_s = length / (np.array(speed) / 3.6)
+
+    # Drop self loops, keep the fastest of parallel edges, sort by source (CSR)
+    keep = src != dst
+    src, dst, length, time_s, way = src[keep], dst[keep], length[keep], time_s[keep], way[keep]
+    order = np.lexsort((time_s, dst, src))
+    src, dst, length, time_s, way = src[order], dst[order], length[order], time_s[order], way[order]
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst, length, time_s, way = src[first], dst[first], length[first], time_s[first], way[first]
+
+    n = len(lat)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(indptr, src + 1, 1)
+    indptr = np.cumsum(indptr)
+
+    main = np.ones(n, dtype=bool)
+    if csr_matrix is not None:
+        adj = csr_matrix((np.ones(len(dst)), dst, indptr), shape=(n, n))
+        _, labels = connected_components(adj, directed=True, connection="strong")
+        main = labels == np.bincount(labels).argmax()
+
+    meta = {
+        "version": GRAPH_VERSION,
+        "pbf": pbf_path,
+        "pbf_sha1": _file_sha1(pbf_path),
+        "speeds_kph": AUTO_SPEEDS_KPH,
+        "nodes": int(n),
+        "edges": int(len(dst)),
+        "main_nodes": int(main.sum()),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    return RoadGraph(meta, {
+        "lat": lat, "lon": lon, "indptr": indptr, "indices": dst.astype(np.int32),
+        "time_s": time_s.astype(np.float32), "length_m": length.astype(np.float32),
+        "way_id": way, "main": main,
+    })
+
+
+ARRAYS = ("lat", "lon", "indptr", "indices", "time_s", "length_m", "way_id", "main")
+
+
+def save_graph(graph: RoadGraph, out_dir: str) -> None:
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(out_dir, f"{name}.npy"), np.asarray(getattr(graph, name)))
+    # meta.json last: a directory without it is an unfinished save
+    tmp = os.path.join(out_dir, "meta.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(graph.meta, f, indent=2)
+    os.replace(tmp, os.path.join(out_dir, "meta.json"))
+
+
+def load_graph(graph_dir: str, mmap: bool = True) -> RoadGraph:
+    with open(os.path.join(graph_dir, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(graph_dir, f"{name}.npy"), mmap_mode="r" if mmap else None)
+              for name in ARRAYS}
+    return RoadGraph(meta, arrays)
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def graph_for(base_url: str) -> RoadGraph:
+    """Graph of an engine's extract: loaded from disk, rebuilt when the extract or speeds changed."""
+    with _graphs_lock:
+        graph = _graphs.get(base_url)
+        if graph is None:
+            graph = _graphs[base_url] = _load_or_build(base_url)
+    return graph
+
+
+def require_extract(base_url: str) -> str:
+    """Path of an engine's OSM extract; FileNotFoundError saying how to make it when it is missing."""
+    pbf = ENGINE_PBFS[base_url]
+    if not os.path.exists(pbf):
+        raise FileNotFoundError(
+            f"{pbf} not found: the offline graph of {base_url} is built from it. Cut it with "
+            f"`python build_snapshots.py` (osmium extract -b {BBOX_STR} <source>.osm.pbf -o {pbf}), "
+            f"or copy the extract there")
+    return pbf
+
+
+def _load_or_build(base_url: str) -> RoadGraph:
+    graph = None
+    pbf, graph_dir = require_extract(base_url), LOCAL_GRAPH_DIRS[base_url]
+    meta_path = os.path.join(graph_dir, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta.get("version") == GRAPH_VERSION and meta.get("pbf_sha1") == _file_sha1(pbf)
+                and meta.get("speeds_kph") == AUTO_SPEEDS_KPH):
+            graph = load_graph(graph_dir)
+    if graph is None:
+        print(f"  building local graph from {pbf}...")
+        save_graph(build_graph(pbf), graph_dir)
+        graph = load_graph(graph_dir)
+    return graph
+
+
+def matrix(base_url: str, sources: list[dict], targets: list[dict]) -> list:
+    """Drop-in for call_matrix: rows of {"time", "distance"} cells (None when unreachable)."""
+    from snap_index import index_for
+
+    graph, index = graph_for(base_url), index_for(base_url)
+    src = graph.snap([p["lat"] for p in sources], [p["lon"] for p in sources], index)
+    tgt = graph.snap([p["lat"] for p in targets], [p["lon"] for p in targets], index)
+    t, d = graph.point_matrix(src, tgt)
+    return [[{"time": round(float(tt)), "distance": round(float(dd), 3)} if np.isfinite(tt) else None
+             for tt, dd in zip(t_row, d_row)] for t_row, d_row in zip(t, d)]
+
+
+def validate(base_url: str, matrix_csv: str, points_csv: str = POINTS_CSV, top: int = 10):
+    """Compare local results with an existing Valhalla matrix CSV; returns the merged frame."""
+    import pandas as pd
+
+    pts = pd.read_csv(points_csv)
+    ref = pd.read_csv(matrix_csv)
+    locs = [{"lat": float(r.lat), "lon": float(r.lon)} for r in pts.itertuples(index=False)]
+    from snap_index import index_for
+
+    graph = graph_for(base_url)
+    snapped = graph.snap(pts["lat"], pts["lon"], index_for(base_url))
+    snap_m = snapped[3]
+    t, d = graph.point_matrix(snapped, snapped)
+
+    n = len(locs)
+    local = pd.DataFrame({
+        "src": np.repeat(pts["id"].to_numpy(), n),
+        "dst": np.tile(pts["id"].to_numpy(), n),
+        "time_s_local": np.round(t.ravel()),
+        "distance_km_local": np.round(d.ravel(), 3),
+    })
+    df = ref.merge(local, on=["src", "dst"])
+    df = df[df["src"] != df["dst"]]
+    err_t = df["time_s_local"] - df["time_s"]
+    pct_t = err_t / df["time_s"] * 100
+    pct_d = (df["distance_km_local"] - df["distance_km"]) / df["distance_km"] * 100
+
+    print("=" * 60)
+    print(f"LOCAL ENGINE vs {matrix_csv}")
+    print("=" * 60)
+    print(f"Graph: {graph.meta['nodes']:,} nodes ({graph.meta['main_nodes']:,} connected), "
+          f"{graph.meta['edges']:,} edges")
+    print(f"Snap distance: median {np.median(snap_m):.1f} m, max {snap_m.max():.1f} m")
+    print(f"Pairs compared: {len(df):,}, unreachable locally: {int(df['time_s_local'].isna().sum())}")
+    print(f"Time error: median {pct_t.median():+.1f}%, median |error| {pct_t.abs().median():.1f}%, "
+          f"within 20%: {(pct_t.abs() <= 20).mean() * 100:.1f}%")
+    print(f"Distance error: median {pct_d.median():+.1f}%, median |error| {pct_d.abs().median():.1f}%, "
+          f"within 10%: {(pct_d.abs() <= 10).mean() * 100:.1f}%")
+    print(f"Correlation: time {df['time_s'].corr(df['time_s_local']):.3f}, "
+          f"distance {df['distance_km'].corr(df['distance_km_local']):.3f}")
+    worst = df.assign(pct_time=pct_t).reindex(pct_t.abs().sort_values(ascending=False).index).head(top)
+    print("\nLargest time differences:")
+    print(worst[["src", "dst", "time_s", "time_s_local", "distance_km", "distance_km_local",
+                 "pct_time"]].to_string(index=False))
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline road graph built from the snapshot extracts")
+    parser.add_argument("action", choices=["build", "validate"])
+    parser.add_argument("--year", choices=["2018", "2025", "both"], default="both")
+    args = parser.parse_args()
+
+    engines = {"2018": (VALHALLA_2018, MATRIX_2018_CSV), "2025": (VALHALLA_2025, MATRIX_2025_CSV)}
+    years = ["2018", "2025"] if args.year == "both" else [args.year]
+    for year in years:
+        base, matrix_csv = engines[year]
+        if not os.path.exists(ENGINE_PBFS[base]):
+            print(f"⚠️  {ENGINE_PBFS[base]} not found, skipping {year}")
+            continue
+        if args.action == "build":
+            graph = graph_for(base)
+            print(f"✅ {LOCAL_GRAPH_DIRS[base]}: {graph.meta['nodes']:,} nodes, {graph.meta['edges']:,} edges")
+        else:
+            validate(base, matrix_csv)
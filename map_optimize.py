@@ -0,0 +1,196 @@
+"""
+Output optimization for the generated Leaflet maps.
+
+Route lines are simplified with Douglas-Peucker and quantized so that the two
+errors together stay within a tolerance given in screen pixels at the deepest
+zoom the map allows, then stored once in a shared JS geometry table.
+A line that repeats an earlier one (e.g. the same route in 2018 and 2025,
+or a return trip along the forward path) reuses the stored geometry instead
+of embedding it again.
+
+Lines are simplified once, for max_zoom; at lower zooms Leaflet's own
+smoothFactor thins them further while drawing.
+"""
+import json
+import math
+
+import folium
+import numpy as np
+from branca.element import MacroElement
+from jinja2 import Template
+
+from config import MAP_TOLERANCE_PX, MAP_MAX_ZOOM
+
+EARTH_M_PER_PX_Z0 = 156543.03392  # metres per pixel at zoom 0 on the equator
+M_PER_DEG_LAT = 111320.0
+
+DEFAULT_TOLERANCE_PX = MAP_TOLERANCE_PX
+DEFAULT_MAX_ZOOM = MAP_MAX_ZOOM
+
+
+def metres_per_pixel(lat: float, zoom: int) -> float:
+    return EARTH_M_PER_PX_Z0 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def quantization_m(decimals: int) -> float:
+    """Furthest a point moves when lat and lon are rounded to decimals (half a step on each axis)."""
+    return 0.5 * 10 ** -decimals * M_PER_DEG_LAT * math.sqrt(2)
+
+
+def quantize_decimals(tolerance_m: float) -> int:
+    """Fewest decimals whose rounding error stays under half the tolerance."""
+    for decimals in range(3, 8):
+        if quantization_m(decimals) <= tolerance_m / 2:
+            return decimals
+    return 7
+
+
+def simplify_tolerance(tolerance_m: float, decimals: int) -> float:
+    """
+    Douglas-Peucker tolerance that leaves room for rounding to decimals:
+    rounding moves every kept vertex (and so every point of the line between
+    them) by at most quantization_m, so the two errors add up to tolerance_m.
+    """
+    return max(tolerance_m - quantization_m(decimals), 0.0)
+
+
+def simplify(coords, tolerance_m: float) -> np.ndarray:
+    """
+    Douglas-Peucker on (k, 2) lat/lon, measured in a local metric projection.
+    Returns the kept vertices (endpoints always kept).
+    """
+    pts = np.asarray(coords, dtype=np.float64)
+    if len(pts) < 3 or tolerance_m <= 0:
+        return pts
+
+    lat0 = math.radians(float(pts[:, 0].mean()))
+    xy = np.column_stack((pts[:, 1] * M_PER_DEG_LAT * math.cos(lat0), pts[:, 0] * M_PER_DEG_LAT))
+
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        a, b = xy[i], xy[j]
+        seg = b - a
+        rel = xy[i + 1:j] - a
+        seg_len2 = float(seg @ seg)
+        if seg_len2 == 0.0:
+            d = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            t = np.clip((rel @ seg) / seg_len2, 0.0, 1.0)
+            d = np.hypot(rel[:, 0] - t * seg[0], rel[:, 1] - t * seg[1])
+        k = int(np.argmax(d))
+        if d[k] > tolerance_m:
+            m = i + 1 + k
+            keep[m] = True
+            stack.append((i, m))
+            stack.append((m, j))
+    return pts[keep]
+
+
+class GeometryTable(MacroElement):
+    """
+    Shared coordinate table written once into the page as a JS array.
+    add() simplifies and quantizes a line and returns its index; identical
+    (or reversed) lines get the index of the first copy.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = {{ this.to_json() }};
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, tolerance_px: float = DEFAULT_TOLERANCE_PX,
+                 max_zoom: int = DEFAULT_MAX_ZOOM, lat: float = 10.79):
+        super().__init__()
+        self._name = "GeometryTable"
+        self.tolerance_px = tolerance_px
+        self.max_zoom = max_zoom
+        self.tolerance_m = tolerance_px * metres_per_pixel(lat, max_zoom)
+        self.decimals = quantize_decimals(self.tolerance_m)
+        self.simplify_m = simplify_tolerance(self.tolerance_m, self.decimals)
+        self.lines = []
+        self._index = {}
+        self.stats = {"lines": 0, "shared": 0, "vertices_in": 0, "vertices_out": 0,
+                      "bytes_in": 0, "bytes_out": 0, "bytes_refs": 0}
+
+    def add(self, coords) -> tuple[int, list]:
+        """Register a line; returns (index into the table, stored coordinates)."""
+        pts = np.asarray(coords, dtype=np.float64)
+        self.stats["lines"] += 1
+        self.stats["vertices_in"] += len(pts)
+        self.stats["bytes_in"] += len(json.dumps(pts.tolist()))
+
+        kept = np.round(simplify(pts, self.simplify_m), self.decimals)
+        key = kept.tobytes()
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._index.get(kept[::-1].tobytes())
+        if idx is not None:
+            self.stats["shared"] += 1
+            return idx, self.lines[idx]
+
+        line = kept.tolist()
+        idx = len(self.lines)
+        self.lines.append(line)
+        self._index[key] = idx
+        self.stats["vertices_out"] += len(line)
+        self.stats["bytes_out"] += len(self._dumps(line))
+        return idx, line
+
+    def _dumps(self, line) -> str:
+        fmt = f"{{:.{self.decimals}f}}"
+        return "[" + ",".join(f"[{fmt.format(a).rstrip('0').rstrip('.')},"
+                              f"{fmt.format(b).rstrip('0').rstrip('.')}]" for a, b in line) + "]"
+
+    def to_json(self) -> str:
+        return "[" + ",".join(self._dumps(line) for line in self.lines) + "]"
+
+    def inline_bytes(self, html_bytes: int) -> int:
+        """
+        Size of the same page with every line's raw coordinates inline, as
+        folium.PolyLine writes them: the table and the references to it are
+        swapped for the measured bytes_in. Exact up to the few bytes of
+        whitespace folium puts around the table element.
+        """
+        table_js = len(self._template.module.script(self, {}))
+        return html_bytes - table_js - self.stats["bytes_refs"] + self.stats["bytes_in"]
+
+    @property
+    def max_error_px(self) -> float:
+        """Upper bound on the on-screen deviation at max_zoom (simplification + quantization)."""
+        return (self.simplify_m + quantization_m(self.decimals)) / (self.tolerance_m / self.tolerance_px)
+
+    def report(self) -> str:
+        st = self.stats
+        return (f"{st['lines']} lines ({st['shared']} shared), "
+                f"vertices {st['vertices_in']:,} -> {st['vertices_out']:,}, "
+                f"coordinate JSON {st['bytes_in'] / 1024:.1f} KB -> {st['bytes_out'] / 1024:.1f} KB, "
+                f"max deviation <= {self.max_error_px:.2f}px at zoom {self.max_zoom}")
+
+
+class SharedPolyLine(folium.PolyLine):
+    """folium.PolyLine whose coordinates live in a GeometryTable."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.polyline(
+                {{ this.table.get_name() }}[{{ this.geom_index }}],
+                {{ this.options|tojson }}
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, table: GeometryTable, locations, popup=None, tooltip=None, **kwargs):
+        self.table = table
+        self.geom_index, line = table.add(locations)
+        table.stats["bytes_refs"] += len(f"{table.get_name()}[{self.geom_index}]")
+        super().__init__(line, popup=popup, tooltip=tooltip, **kwargs)
@@ -0,0 +1,483 @@
+"""
+Streaming writer for the route comparison map (draw_compare_routes.py --stream).
+
+The folium path keeps every layer of the map in one object tree until
+m.save(), so memory and render time grow with --top-k. Here the OD pairs
+are handled in chunks of MAP_STREAM_CHUNK pairs:
+  - the pairs are picked from the stores block by block;
+  - each chunk's routes are fetched;
+  - a process pool renders the chunk into layer fragments (lines, popups,
+    markers, legend row);
+  - the fragments are appended to the output as they come back, in order.
+At most a few chunks are held at any time, so peak memory does not depend
+on the number of layers.
+
+The page is plain Leaflet (same version as folium). Layers stream into the
+HTML as <script>addLayers([...])</script> blocks, with route shapes kept as
+encoded polylines that the page decodes. With a sidecar, the layers go to a
+GeoJSON file instead (one feature per line or marker) that the page fetches
+after it opens, so the HTML stays a few KB; that needs the directory to be
+served over HTTP (python -m http.server).
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import metrics
+from config import ASYMMETRY_TIME_S, ASYMMETRY_DISTANCE_KM, MAP_STREAM_CHUNK
+from map_optimize import metres_per_pixel, quantize_decimals, simplify, simplify_tolerance
+from matrix_store import DISTANCE_DECIMALS
+from polyline import decode_many, encode_polyline
+
+LEAFLET_JS = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.js"
+LEAFLET_CSS = "https://cdn.jsdelivr.net/npm/leaflet@1.9.3/dist/leaflet.css"
+TILE_URL = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+TILE_ATTRIBUTION = '&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
+
+# Cells per block while picking the top pairs from the stores
+SELECT_BLOCK_ELEMENTS = 500_000
+
+# Points per addPoints() block in the page
+POINTS_PER_BLOCK = 10_000
+
+SRC_COLOR = "#16a34a"
+DST_COLOR = "#f97316"
+
+
+# =============================================================================
+# Pair selection from the stores (no long delta frame)
+# =============================================================================
+
+def delta_columns(t18, d18, t25, d25) -> dict:
+    """The matrix_delta.csv columns for matching cells of both years, as delta_frame computes them."""
+    t18, t25 = np.asarray(t18, dtype=np.float64), np.asarray(t25, dtype=np.float64)
+    d18 = np.round(np.asarray(d18, dtype=np.float64), DISTANCE_DECIMALS)
+    d25 = np.round(np.asarray(d25, dtype=np.float64), DISTANCE_DECIMALS)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dt, dd = t25 - t18, d25 - d18
+        pct_t, pct_d = dt / t18 * 100, dd / d18 * 100
+    return {
+        "time_s_2018": t18, "distance_km_2018": d18, "time_s_2025": t25, "distance_km_2025": d25,
+        "delta_time_s": dt, "delta_distance_km": dd,
+        "pct_time": np.where(np.isfinite(pct_t), pct_t, np.nan),
+        "pct_distance": np.where(np.isfinite(pct_d), pct_d, np.nan),
+    }
+
+
+def _cells(m18, m25, i, j) -> dict:
+    return delta_columns(m18.time_s[i, j], m18.distance_km[i, j], m25.time_s[i, j], m25.distance_km[i, j])
+
+
+def top_pairs(m18, m25, metric: str, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Row and column indices of the k off-diagonal pairs with the largest
+    |metric| among pairs routed in both years, largest first (ties in row order).
+    """
+    n = m18.n
+    block = max(1, SELECT_BLOCK_ELEMENTS // max(1, n))
+    idx, val = np.zeros(0, dtype=np.int64), np.zeros(0)
+    for r0 in range(0, n, block):
+        r1 = min(n, r0 + block)
+        cols = delta_columns(m18.time_s[r0:r1], m18.distance_km[r0:r1], m25.time_s[r0:r1], m25.distance_km[r0:r1])
+        if metric not in cols:
+            raise ValueError(f"unknown metric {metric!r}; one of {', '.join(cols)}")
+        v = np.abs(cols[metric])
+        ok = ~(np.isnan(cols["time_s_2018"]) | np.isnan(cols["time_s_2025"]) | np.isnan(v))
+        rows = np.arange(r0, r1)
+        ok[rows - r0, rows] = False
+        flat = np.flatnonzero(ok)
+        idx = np.concatenate((idx, flat + r0 * n))
+        val = np.concatenate((val, v.ravel()[flat]))
+        if len(idx) > k:
+            # Keep the k largest; at the threshold value, the earliest cells
+            thr = np.partition(val, len(val) - k)[len(val) - k] if k else np.inf
+            above = np.flatnonzero(val > thr)
+            tie = np.flatnonzero(val == thr)
+            tie = tie[np.argsort(idx[tie], kind="stable")][:k - len(above)]
+            keep = np.concatenate((above, tie))
+            idx, val = idx[keep], val[keep]
+    order = np.lexsort((idx, -val))
+    return idx[order] // n, idx[order] % n
+
+
+# =============================================================================
+# Rendering (runs in the worker processes)
+# =============================================================================
+
+def _num(x, fmt: str) -> str:
+    return "nan" if x != x else format(x, fmt)
+
+
+def _popup(title_color, arrow, label, src, dst, cells, summaries, note="") -> str:
+    s18, s25 = summaries
+    return (f'<b style="color:{title_color}">{arrow} {label}: {src} → {dst}</b><br>'
+            f'<b>2018:</b> {_num(cells["time_s_2018"], ".0f")}s, {_num(cells["distance_km_2018"], ".3f")}km<br>'
+            f'<b>2025:</b> {_num(cells["time_s_2025"], ".0f")}s, {_num(cells["distance_km_2025"], ".3f")}km<br>'
+            f'<b>Δ:</b> {_num(cells["delta_time_s"], "+.0f")}s, {_num(cells["delta_distance_km"], "+.3f")}km<br>'
+            f'{note}<br><b>Valhalla /route:</b><br>'
+            f'2018: {s18.get("length"):.2f}km, {s18.get("time"):.0f}s<br>'
+            f'2025: {s25.get("length"):.2f}km, {s25.get("time"):.0f}s')
+
+
+def _shapes(records: list[dict], opts: dict) -> dict:
+    """(pair position, leg) -> encoded shape (HTML) or [lon, lat] list (GeoJSON), simplified when asked."""
+    legs = [(p, leg, shape) for p, r in enumerate(records) for leg, (shape, _) in r["routes"].items() if shape]
+    out, stats = {}, {"vertices_in": 0, "vertices_out": 0}
+    if not opts["optimize"] and not opts["sidecar"]:
+        # Valhalla's polyline6 goes into the page as it is
+        return {(p, leg): shape for p, leg, shape in legs}, stats
+    for (p, leg, _), coords in zip(legs, decode_many([s for _, _, s in legs], 6)):
+        stats["vertices_in"] += len(coords)
+        if opts["optimize"]:
+            coords = simplify(coords, opts["tolerance_m"])
+        stats["vertices_out"] += len(coords)
+        if opts["sidecar"]:
+            out[(p, leg)] = np.round(coords[:, ::-1], opts["precision"]).tolist()
+        else:
+            out[(p, leg)] = encode_polyline(coords, opts["precision"])
+    return out, stats
+
+
+def render_chunk(records: list[dict], opts: dict) -> tuple[list[str], dict]:
+    """
+    Fragments for one chunk of OD pairs: a JSON layer object per pair for
+    the HTML, or GeoJSON features with a sidecar. Also returns counters.
+    """
+    shapes, stats = _shapes(records, opts)
+    stats.update(drawn=0, asymmetric=0, failed=[])
+    fragments = []
+    for p, r in enumerate(records):
+        src, dst, (c_fwd, c_ret) = r["src"], r["dst"], r["colors"]
+        routes, fwd, ret = r["routes"], r["fwd"], r["ret"]
+        if (p, "fwd18") not in shapes or (p, "fwd25") not in shapes:
+            stats["failed"].append(f"{src}→{dst}")
+            continue
+        stats["drawn"] += 1
+        name = f"OD {src}↔{dst} |{opts['metric']}|={r['abs_metric']:.2f}"
+        popups = [_popup(c_fwd, "▶", "FORWARD", src, dst, fwd, (routes["fwd18"][1], routes["fwd25"][1]))]
+        lines = [("fwd18", c_fwd, False, f"▶ FWD 2018: {src}→{dst}", 0),
+                 ("fwd25", c_fwd, True, f"▶ FWD 2025: {src}→{dst}", 0)]
+        if (p, "ret18") in shapes and (p, "ret25") in shapes:
+            t_f, t_r, d_f, d_r = fwd["time_s_2025"], ret["time_s_2025"], fwd["distance_km_2025"], ret["distance_km_2025"]
+            time_asym = t_r - t_f if t_r == t_r and t_f == t_f else 0
+            dist_asym = d_r - d_f if d_r == d_r and d_f == d_f else 0
+            note = ""
+            if abs(time_asym) > ASYMMETRY_TIME_S or abs(dist_asym) > ASYMMETRY_DISTANCE_KM:
+                stats["asymmetric"] += 1
+                note = (f"<br><b style='color:#dc2626'>⚠️ ASYMMETRY vs Forward: "
+                        f"Δt={time_asym:+.0f}s, Δd={dist_asym:+.2f}km</b>")
+            popups.append(_popup(c_ret, "◀", "RETURN", dst, src, ret, (routes["ret18"][1], routes["ret25"][1]), note))
+            lines += [("ret18", c_ret, False, f"◀ RET 2018: {dst}→{src}", 1),
+                      ("ret25", c_ret, True, f"◀ RET 2025: {dst}→{src}", 1)]
+        markers = [(r["A"], SRC_COLOR, f"SRC: Point {src}", "src"), (r["B"], DST_COLOR, f"DST: Point {dst}", "dst")]
+
+        if opts["sidecar"]:
+            for leg, color, dashed, tooltip, pi in lines:
+                fragments.append(json.dumps({"type": "Feature",
+                                             "geometry": {"type": "LineString", "coordinates": shapes[(p, leg)]},
+                                             "properties": {"layer": name, "color": color, "dashed": dashed,
+                                                            "tooltip": tooltip, "popup": popups[pi]}},
+                                            ensure_ascii=False, separators=(",", ":")))
+            for (lat, lon), color, tooltip, role in markers:
+                props = {"layer": name, "role": role, "color": color, "tooltip": tooltip}
+                if role == "src":
+                    props["legend"] = [src, dst, c_fwd, c_ret]
+                fragments.append(json.dumps({"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                                             "properties": props}, ensure_ascii=False, separators=(",", ":")))
+            continue
+
+        # Identical shapes of a layer (2018 == 2025, usually) are written once
+        shape_list, shape_at = [], {}
+        for leg, *_ in lines:
+            s = shapes[(p, leg)]
+            if s not in shape_at:
+                shape_at[s] = len(shape_list)
+                shape_list.append(s)
+        layer = {"name": name, "shapes": shape_list, "popups": popups,
+                 "lines": [[shape_at[shapes[(p, leg)]], color, int(dashed), tooltip, pi]
+                           for leg, color, dashed, tooltip, pi in lines],
+                 "markers": [[lat, lon, color, tooltip] for (lat, lon), color, tooltip, _ in markers],
+                 "legend": [src, dst, c_fwd, c_ret]}
+        # "</" cannot appear inside a <script> block
+        fragments.append(json.dumps(layer, ensure_ascii=False, separators=(",", ":")).replace("</", "<\\/"))
+    return fragments, stats
+
+
+# =============================================================================
+# Page
+# =============================================================================
+
+_PAGE_HEAD = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Route comparison 2018 / 2025</title>
+<link rel="stylesheet" href="{leaflet_css}">
+<script src="{leaflet_js}"></script>
+<style>html, body, #map {{ width: 100%; height: 100%; margin: 0; padding: 0; }}</style>
+</head>
+<body>
+<div id="map"></div>
+<div style="position: fixed; bottom: 50px; left: 50px; z-index: 9999;
+            background: white; padding: 12px 16px; border: 2px solid #333;
+            border-radius: 8px; font-size: 12px; font-family: sans-serif;
+            box-shadow: 0 2px 8px rgba(0,0,0,0.2); max-height: 420px; overflow-y: auto;">
+    <b style="font-size:14px;">Route Colors</b><br>
+    <span style="color:#666; font-size:11px;">Solid = 2018 | Dashed = 2025</span>
+    <hr style="margin:8px 0;">
+    <div id="legend-rows"></div>
+    <hr style="margin:8px 0;">
+    <span style="color:green;">▶</span> Source &nbsp;
+    <span style="color:orange;">■</span> Destination<br>
+    <span style="color:#dc2626;">⚠️</span> = One-way asymmetry
+</div>
+<script>
+var PRECISION = {precision};
+var map = L.map("map", {{center: [{lat}, {lon}], zoom: 14, maxZoom: {max_zoom}, preferCanvas: true}});
+L.tileLayer("{tile_url}", {{maxZoom: {max_zoom}, attribution: '{attribution}'}}).addTo(map);
+L.control.scale().addTo(map);
+// Added to the map once every layer is in, so each overlay does not redraw the control
+var control = L.control.layers(null, null, {{collapsed: false}});
+
+function decode(s, precision) {{
+    var coords = [], index = 0, lat = 0, lon = 0, factor = Math.pow(10, precision);
+    while (index < s.length) {{
+        var shift = 0, result = 0, b;
+        do {{ b = s.charCodeAt(index++) - 63; result |= (b & 0x1f) << shift; shift += 5; }} while (b >= 0x20);
+        lat += (result & 1) ? ~(result >> 1) : (result >> 1);
+        shift = 0; result = 0;
+        do {{ b = s.charCodeAt(index++) - 63; result |= (b & 0x1f) << shift; shift += 5; }} while (b >= 0x20);
+        lon += (result & 1) ? ~(result >> 1) : (result >> 1);
+        coords.push([lat / factor, lon / factor]);
+    }}
+    return coords;
+}}
+
+function legendRow(e) {{
+    var div = document.createElement("div");
+    div.style.cssText = "margin:4px 0; display:flex; align-items:center; gap:8px;";
+    div.innerHTML = '<span style="font-weight:bold; min-width:60px;">OD ' + e[0] + '↔' + e[1] + '</span>'
+        + '<span style="display:inline-block; width:24px; height:4px; background:' + e[2] + ';"></span>'
+        + '<span style="font-size:11px;">Fwd</span>'
+        + '<span style="display:inline-block; width:24px; height:4px; background:' + e[3] + ';"></span>'
+        + '<span style="font-size:11px;">Ret</span>';
+    return div;
+}}
+
+function marker(lat, lon, color, tooltip) {{
+    return L.circleMarker([lat, lon], {{radius: 7, color: color, fillColor: color, fillOpacity: 0.9, weight: 2}})
+        .bindTooltip(tooltip);
+}}
+
+function addGroup(group, name) {{
+    group.addTo(map);
+    control.addOverlay(group, name);
+}}
+
+function addLayers(layers) {{
+    var rows = document.createDocumentFragment();
+    layers.forEach(function (l) {{
+        var group = L.featureGroup();
+        var coords = l.shapes.map(function (s) {{ return decode(s, PRECISION); }});
+        l.lines.forEach(function (x) {{
+            L.polyline(coords[x[0]], {{color: x[1], weight: 5, opacity: 0.9, dashArray: x[2] ? "12,8" : null}})
+                .bindTooltip(x[3]).bindPopup(l.popups[x[4]], {{maxWidth: 400}}).addTo(group);
+        }});
+        l.markers.forEach(function (m) {{ marker(m[0], m[1], m[2], m[3]).addTo(group); }});
+        addGroup(group, l.name);
+        rows.appendChild(legendRow(l.legend));
+    }});
+    document.getElementById("legend-rows").appendChild(rows);
+}}
+
+var allPoints = L.featureGroup();
+function addPoints(points) {{
+    points.forEach(function (p) {{
+        L.circleMarker(p, {{radius: 2, color: "#666", fill: true}}).addTo(allPoints);
+    }});
+}}
+
+function finish() {{
+    control.addOverlay(allPoints, "All points");
+    control.addTo(map);
+}}
+</script>
+"""
+
+_SIDECAR_LOADER = """<script>
+fetch("{geojson}").then(function (r) {{ return r.json(); }}).then(function (fc) {{
+    var groups = {{}}, names = [], rows = document.createDocumentFragment();
+    fc.features.forEach(function (f) {{
+        var p = f.properties, group = groups[p.layer];
+        if (!group) {{ group = groups[p.layer] = L.featureGroup(); names.push(p.layer); }}
+        var c = f.geometry.coordinates;
+        if (f.geometry.type === "LineString") {{
+            L.polyline(c.map(function (x) {{ return [x[1], x[0]]; }}),
+                       {{color: p.color, weight: 5, opacity: 0.9, dashArray: p.dashed ? "12,8" : null}})
+                .bindTooltip(p.tooltip).bindPopup(p.popup, {{maxWidth: 400}}).addTo(group);
+        }} else {{
+            marker(c[1], c[0], p.color, p.tooltip).addTo(group);
+            if (p.legend) rows.appendChild(legendRow(p.legend));
+        }}
+    }});
+    names.forEach(function (name) {{ addGroup(groups[name], name); }});
+    document.getElementById("legend-rows").appendChild(rows);
+    finish();
+}});
+</script>
+"""
+
+
+class MapWriter:
+    """Appends fragments to the HTML page (and the GeoJSON sidecar) as they arrive."""
+
+    def __init__(self, path: str, center, precision: int, max_zoom: int, sidecar: str | None = None):
+        self.path = path
+        self.sidecar = sidecar
+        self._html = open(path, "w", encoding="utf-8")
+        self._html.write(_PAGE_HEAD.format(leaflet_css=LEAFLET_CSS, leaflet_js=LEAFLET_JS, precision=precision,
+                                           lat=center[0], lon=center[1], max_zoom=max_zoom, tile_url=TILE_URL,
+                                           attribution=TILE_ATTRIBUTION))
+        self._geojson = None
+        self._features = 0
+        if sidecar:
+            self._geojson = open(sidecar, "w", encoding="utf-8")
+            self._geojson.write('{"type":"FeatureCollection","features":[\n')
+
+    def layers(self, fragments: list[str]) -> None:
+        if not fragments:
+            return
+        if self._geojson:
+            self._geojson.write((",\n" if self._features else "") + ",\n".join(fragments))
+            self._features += len(fragments)
+        else:
+            self._html.write("<script>addLayers([\n" + ",\n".join(fragments) + "\n]);</script>\n")
+
+    def points(self, lat, lon) -> None:
+        for p0 in range(0, len(lat), POINTS_PER_BLOCK):
+            pts = np.column_stack((lat[p0:p0 + POINTS_PER_BLOCK], lon[p0:p0 + POINTS_PER_BLOCK])).round(6)
+            self._html.write(f"<script>addPoints({json.dumps(pts.tolist(), separators=(',', ':'))});</script>\n")
+
+    def close(self) -> None:
+        if self._geojson:
+            self._geojson.write("\n]}\n")
+            self._geojson.close()
+            self._html.write(_SIDECAR_LOADER.format(geojson=os.path.basename(self.sidecar)))
+        else:
+            self._html.write("<script>finish();</script>\n")
+        self._html.write("</body>\n</html>\n")
+        self._html.close()
+
+
+# =============================================================================
+# Driver
+# =============================================================================
+
+def _route(response) -> tuple:
+    """(polyline6 shape, summary) of a /route response, or (None, None)."""
+    try:
+        shape = response["trip"]["legs"][0].get("shape")
+        summary = response["trip"]["summary"]
+    except (TypeError, KeyError, IndexError):
+        return None, None
+    return (shape, summary) if isinstance(shape, str) and shape else (None, None)
+
+
+def _records(m18, m25, i, j, abs_metric, offset, fetch, colors) -> list[dict]:
+    """Everything a worker needs for one chunk of pairs, routes included."""
+    fwd, ret = _cells(m18, m25, i, j), _cells(m18, m25, j, i)
+    lat, lon = m18.lat, m18.lon
+    jobs = []
+    for a, b in zip(i.tolist(), j.tolist()):
+        A, B = (float(lat[a]), float(lon[a])), (float(lat[b]), float(lon[b]))
+        jobs += [(2018, A, B), (2025, A, B), (2018, B, A), (2025, B, A)]
+    with metrics.stage("fetch_routes"):
+        routes = [_route(r) for r in fetch(jobs)]
+    out = []
+    for p, (a, b) in enumerate(zip(i.tolist(), j.tolist())):
+        out.append({
+            "src": int(m18.ids[a]), "dst": int(m18.ids[b]),
+            "A": jobs[4 * p][1], "B": jobs[4 * p][2],
+            "colors": colors(offset + p),
+            "abs_metric": float(abs_metric[p]),
+            "fwd": {k: float(v[p]) for k, v in fwd.items()},
+            "ret": {k: float(v[p]) for k, v in ret.items()},
+            "routes": dict(zip(("fwd18", "fwd25", "ret18", "ret25"), routes[4 * p:4 * p + 4])),
+        })
+    return out
+
+
+def write_map(m18, m25, fetch, colors, out_html: str, top_k=10, metric="delta_distance_km", sidecar=False,
+              optimize=False, tolerance_px=1.0, max_zoom=18, workers=None, chunk=MAP_STREAM_CHUNK) -> dict:
+    """
+    Stream the top_k pairs of the two stores into out_html (and a .geojson
+    sidecar next to it). fetch([(year, A, B), ...]) returns the /route
+    responses of those legs; colors(k) is the (forward, return) colors of
+    the k-th pair. Returns the run's counters.
+    """
+    if m18.meta["points_hash"] != m25.meta["points_hash"]:
+        raise ValueError(f"{m18.path} and {m25.path} were computed on different point sets")
+    t0 = time.perf_counter()
+    with metrics.stage("select_pairs"):
+        pi, pj = top_pairs(m18, m25, metric, top_k)
+    center = (float(np.mean(m18.lat)), float(np.mean(m18.lon)))
+    precision, tolerance_m = 6, 0.0
+    if optimize:
+        target_m = tolerance_px * metres_per_pixel(center[0], max_zoom)
+        precision = quantize_decimals(target_m)
+        # Simplification and rounding together stay within tolerance_px
+        tolerance_m = simplify_tolerance(target_m, precision)
+    opts = {"metric": metric, "optimize": optimize, "sidecar": bool(sidecar),
+            "tolerance_m": tolerance_m, "precision": precision}
+    sidecar_path = os.path.splitext(out_html)[0] + ".geojson" if sidecar else None
+    writer = MapWriter(out_html, center, precision, max_zoom, sidecar_path)
+    total = {"drawn": 0, "asymmetric": 0, "failed": [], "vertices_in": 0, "vertices_out": 0}
+    workers = max(1, workers or os.cpu_count() or 1)
+    print(f"Streaming {len(pi)} OD layers by |{metric}| in chunks of {chunk} ({workers} render worker"
+          f"{'s' if workers > 1 else ''})...")
+
+    def collect(result):
+        fragments, stats = result
+        with metrics.stage("write_layers"):
+            writer.layers(fragments)
+        for key in ("drawn", "asymmetric", "vertices_in", "vertices_out"):
+            total[key] += stats[key]
+        total["failed"] += stats["failed"]
+        print(f"  [{total['drawn'] + len(total['failed'])}/{len(pi)}] layers written")
+
+    def absolute(i, j):
+        return np.abs(_cells(m18, m25, i, j)[metric])
+
+    chunks = range(0, len(pi), chunk)
+    try:
+        if workers == 1:
+            for c0 in chunks:
+                i, j = pi[c0:c0 + chunk], pj[c0:c0 + chunk]
+                collect(render_chunk(_records(m18, m25, i, j, absolute(i, j), c0, fetch, colors), opts))
+        else:
+            # Fetch the next chunk while earlier ones render; a few chunks in flight at most
+            pending = []
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for c0 in chunks:
+                    i, j = pi[c0:c0 + chunk], pj[c0:c0 + chunk]
+                    records = _records(m18, m25, i, j, absolute(i, j), c0, fetch, colors)
+                    pending.append(pool.submit(render_chunk, records, opts))
+                    while len(pending) > workers:
+                        collect(pending.pop(0).result())
+                for fut in pending:
+                    collect(fut.result())
+        writer.points(np.asarray(m18.lat), np.asarray(m18.lon))
+    finally:
+        writer.close()
+
+    for pair in total["failed"]:
+        print(f"  ✗ Failed {pair}")
+    total["seconds"] = time.perf_counter() - t0
+    total["html_kb"] = os.path.getsize(out_html) / 1024
+    total["sidecar"] = sidecar_path
+    total["sidecar_kb"] = os.path.getsize(sidecar_path) / 1024 if sidecar_path else 0.0
+    return total
@@ -0,0 +1,341 @@
+"""
+Dense on-disk matrix store.
+
+One file per snapshot: a small JSON header followed by raw little-endian
+arrays (point ids/lat/lon, then N x N float32 time_s and distance_km, NaN =
+no route, and N x N uint8 status codes saying why a cell is NaN). Arrays
+are 64-byte aligned so they can be memory-mapped and returned as zero-copy
+NumPy views.
+
+Layout:
+    b"HCMMTX1\\n" | uint32 header length | header JSON | padding | arrays...
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+from config import (
+    COSTING, POINTS_CSV,
+    MATRIX_2018_CSV, MATRIX_2025_CSV, MATRIX_DELTA_CSV,
+    MATRIX_2018_BIN, MATRIX_2025_BIN
+)
+
+MAGIC = b"HCMMTX1\n"
+ALIGN = 64
+FORMAT_VERSION = 1
+
+# Valhalla reports distances in km with metre precision; float32 keeps them
+# to ~7 significant digits, so exports round back to this many decimals.
+DISTANCE_DECIMALS = 3
+
+# Per-cell status codes (index = code). Cells other than "ok" are NaN:
+# "no_route" means the engine answered without a route, the rest are
+# requests that kept failing down to that single cell.
+CELL_STATUS = ("ok", "no_route", "timeout", "too_large", "server_error",
+               "connection_error", "rejected", "bad_response")
+CELL_OK = 0
+CELL_NO_ROUTE = 1
+
+
+def points_hash(ids, lat, lon) -> str:
+    """Content hash of a point set (ids and coordinates)."""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(ids, dtype="<i4").tobytes())
+    h.update(np.ascontiguousarray(lat, dtype="<f8").tobytes())
+    h.update(np.ascontiguousarray(lon, dtype="<f8").tobytes())
+    return h.hexdigest()
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _layout(n: int, extra_shape: tuple = ()) -> tuple[dict, int]:
+    """Array descriptors (dtype, shape, offset relative to data start) and total data size."""
+    specs = [
+        ("ids", "<i4", (n,)),
+        ("lat", "<f8", (n,)),
+        ("lon", "<f8", (n,)),
+        ("time_s", "<f4", extra_shape + (n, n)),
+        ("distance_km", "<f4", extra_shape + (n, n)),
+        ("status", "u1", extra_shape + (n, n)),
+    ]
+    arrays, offset = {}, 0
+    for name, dtype, shape in specs:
+        offset = _align(offset)
+        arrays[name] = {"dtype": dtype, "shape": list(shape), "offset": offset}
+        offset += int(np.dtype(dtype).itemsize * np.prod(shape))
+    return arrays, offset
+
+
+class MatrixStore:
+    """
+    An opened matrix file. ids/lat/lon/time_s/distance_km are NumPy views
+    (memory-mapped unless loaded with mmap=False); meta is the header dict.
+    """
+
+    def __init__(self, path: str, meta: dict, arrays: dict, final_path: str | None = None):
+        self.path = path
+        self.final_path = final_path or path
+        self.meta = meta
+        self.ids = arrays["ids"]
+        self.lat = arrays["lat"]
+        self.lon = arrays["lon"]
+        self.time_s = arrays["time_s"]
+        self.distance_km = arrays["distance_km"]
+        # Stores written before status codes existed have none
+        self.status = arrays.get("status")
+        self._index = None
+
+    @property
+    def n(self) -> int:
+        return len(self.ids)
+
+    @property
+    def snapshot(self):
+        return self.meta.get("snapshot")
+
+    def index_of(self, point_id: int) -> int:
+        """Row/column index of a point id."""
+        if self._index is None:
+            self._index = {int(p): i for i, p in enumerate(self.ids)}
+        try:
+            return self._index[int(point_id)]
+        except KeyError:
+            raise ValueError(f"Point {point_id} not found in {self.path}") from None
+
+    def flush(self) -> None:
+        for a in (self.time_s, self.distance_km, self.status):
+            if isinstance(a, np.memmap):
+                a.flush()
+
+
+def _read_header(f) -> tuple[dict, int]:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{getattr(f, 'name', 'file')} is not a matrix store")
+    (hlen,) = struct.unpack("<I", f.read(4))
+    meta = json.loads(f.read(hlen).decode("utf-8"))
+    data_start = _align(len(MAGIC) + 4 + hlen)
+    return meta, data_start
+
+
+def _open_arrays(path: str, meta: dict, data_start: int, mode: str | None) -> dict:
+    arrays = {}
+    if mode is None:
+        with open(path, "rb") as f:
+            buf = f.read()
+    for name, spec in meta["arrays"].items():
+        shape = tuple(spec["shape"])
+        offset = data_start + spec["offset"]
+        if mode is None:
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(buf, dtype=spec["dtype"], count=count,
+                                         offset=offset).reshape(shape)
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode=mode,
+                                     offset=offset, shape=shape)
+    return arrays
+
+
+def create_matrix(path: str, ids, lat, lon, snapshot, costing: str = COSTING,
+                  extra_meta: dict | None = None, extra_shape: tuple = ()) -> MatrixStore:
+    """
+    Create a NaN-filled store on disk and return it opened for writing,
+    so callers can fill time_s/distance_km tile by tile without holding
+    the whole matrix in memory. extra_shape prepends leading axes
+    (e.g. departure-time buckets) to the N x N arrays.
+    """
+    ids = np.asarray(ids, dtype="<i4")
+    lat = np.asarray(lat, dtype="<f8")
+    lon = np.asarray(lon, dtype="<f8")
+    n = len(ids)
+    arrays, data_size = _layout(n, tuple(extra_shape))
+
+    meta = {
+        "version": FORMAT_VERSION,
+        "snapshot": snapshot,
+        "costing": costing,
+        "n": n,
+        "points_hash": points_hash(ids, lat, lon),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "arrays": arrays,
+    }
+    if extra_meta:
+        meta.update(extra_meta)
+
+    header = json.dumps(meta).encode("utf-8")
+    data_start = _align(len(MAGIC) + 4 + len(header))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.truncate(data_start + data_size)
+
+    store = MatrixStore(tmp, meta, _open_arrays(tmp, meta, data_start, "r+"), final_path=path)
+    store.ids[:] = ids
+    store.lat[:] = lat
+    store.lon[:] = lon
+    store.time_s[:] = np.nan
+    store.distance_km[:] = np.nan
+    store.status[:] = CELL_NO_ROUTE
+    return store
+
+
+def commit_matrix(store: MatrixStore) -> MatrixStore:
+    """Flush a store from create_matrix and move it into place atomically."""
+    store.flush()
+    os.replace(store.path, store.final_path)
+    return load_matrix(store.final_path)
+
+
+def save_matrix(path: str, ids, lat, lon, time_s, distance_km, snapshot,
+                costing: str = COSTING, extra_meta: dict | None = None) -> MatrixStore:
+    """Write complete arrays to a new store."""
+    time_s = np.asarray(time_s)
+    store = create_matrix(path, ids, lat, lon, snapshot, costing, extra_meta,
+                          extra_shape=time_s.shape[:-2])
+    store.time_s[:] = time_s
+    store.distance_km[:] = distance_km
+    store.status[:] = np.where(np.isnan(store.time_s), CELL_NO_ROUTE, CELL_OK)
+    return commit_matrix(store)
+
+
+def status_counts(store: MatrixStore) -> dict:
+    """Number of cells per status name, failures only (empty when the store has no status)."""
+    if store.status is None:
+        return {}
+    counts = np.bincount(np.asarray(store.status).ravel(), minlength=len(CELL_STATUS))
+    return {name: int(c) for name, c in zip(CELL_STATUS, counts) if c and name not in ("ok", "no_route")}
+
+
+def read_meta(path: str) -> dict:
+    """Header only, without touching the arrays."""
+    with open(path, "rb") as f:
+        meta, _ = _read_header(f)
+    return meta
+
+
+def load_matrix(path: str, mmap: bool = True) -> MatrixStore:
+    """Open a store; arrays are read-only zero-copy views."""
+    with open(path, "rb") as f:
+        meta, data_start = _read_header(f)
+    return MatrixStore(path, meta, _open_arrays(path, meta, data_start, "r" if mmap else None))
+
+
+# =============================================================================
+# Long-format (CSV) views
+# =============================================================================
+
+def _as_float64(a, decimals=None):
+    out = np.asarray(a, dtype=np.float64)
+    return np.round(out, decimals) if decimals is not None else out
+
+
+def _integral_or_float(a: np.ndarray) -> np.ndarray:
+    """int64 when every value is a whole number (as pandas infers from CSV), else float64."""
+    if not np.isnan(a).any() and np.array_equal(a, np.rint(a)):
+        return a.astype(np.int64)
+    return a
+
+
+def to_long(store: MatrixStore, year=None):
+    """Long DataFrame with the matrix_YYYY.csv columns (src, dst, time_s, distance_km, year)."""
+    import pandas as pd
+
+    n = store.n
+    return pd.DataFrame({
+        "src": np.repeat(store.ids, n),
+        "dst": np.tile(store.ids, n),
+        "time_s": _integral_or_float(_as_float64(store.time_s).ravel()),
+        "distance_km": _as_float64(store.distance_km, DISTANCE_DECIMALS).ravel(),
+        "year": year if year is not None else store.snapshot,
+    })
+
+
+def delta_frame(m_a: MatrixStore, m_b: MatrixStore, year_a=2018, year_b=2025):
+    """Long DataFrame with the matrix_delta.csv columns, computed from two stores."""
+    import pandas as pd
+
+    if m_a.meta["points_hash"] != m_b.meta["points_hash"]:
+        raise ValueError(f"{m_a.path} and {m_b.path} were computed on different point sets")
+
+    n = m_a.n
+    ta = _integral_or_float(_as_float64(m_a.time_s).ravel())
+    tb = _integral_or_float(_as_float64(m_b.time_s).ravel())
+    da = _as_float64(m_a.distance_km, DISTANCE_DECIMALS).ravel()
+    db = _as_float64(m_b.distance_km, DISTANCE_DECIMALS).ravel()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dt = tb - ta
+        dd = db - da
+        pct_t = dt / ta * 100
+        pct_d = dd / da * 100
+
+    return pd.DataFrame({
+        "src": np.repeat(m_a.ids, n),
+        "dst": np.tile(m_a.ids, n),
+        f"time_s_{year_a}": ta,
+        f"distance_km_{year_a}": da,
+        "year": year_a,
+        f"time_s_{year_b}": tb,
+        f"distance_km_{year_b}": db,
+        "delta_time_s": dt,
+        "delta_distance_km": dd,
+        "pct_time": np.where(np.isfinite(pct_t), pct_t, np.nan),
+        "pct_distance": np.where(np.isfinite(pct_d), pct_d, np.nan),
+    })
+
+
+def from_long_csv(csv_path: str, points_csv: str, out_path: str, snapshot) -> MatrixStore:
+    """Convert a long matrix_YYYY.csv into a store (ids/coords from points_csv)."""
+    import pandas as pd
+
+    pts = pd.read_csv(points_csv)
+    ids = pts["id"].to_numpy()
+    pos = {int(p): i for i, p in enumerate(ids)}
+    df = pd.read_csv(csv_path)
+
+    n = len(ids)
+    time_s = np.full((n, n), np.nan, dtype=np.float32)
+    distance_km = np.full((n, n), np.nan, dtype=np.float32)
+    i = df["src"].map(pos).to_numpy()
+    j = df["dst"].map(pos).to_numpy()
+    time_s[i, j] = df["time_s"].to_numpy(dtype=np.float64)
+    distance_km[i, j] = df["distance_km"].to_numpy(dtype=np.float64)
+
+    return save_matrix(out_path, ids, pts["lat"], pts["lon"], time_s, distance_km, snapshot)
+
+
+def export_csv(m2018: MatrixStore, m2025: MatrixStore,
+               out_2018=MATRIX_2018_CSV, out_2025=MATRIX_2025_CSV, out_delta=MATRIX_DELTA_CSV):
+    """Write the legacy long-format CSVs from two stores."""
+    to_long(m2018, 2018).to_csv(out_2018, index=False)
+    to_long(m2025, 2025).to_csv(out_2025, index=False)
+    delta_frame(m2018, m2025).to_csv(out_delta, index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between matrix stores and long-format CSVs")
+    parser.add_argument("action", choices=["import-csv", "export-csv", "info"])
+    parser.add_argument("--points", default=POINTS_CSV, help=f"Points file (default: {POINTS_CSV})")
+    args = parser.parse_args()
+
+    if args.action == "import-csv":
+        for csv_path, bin_path, year in ((MATRIX_2018_CSV, MATRIX_2018_BIN, 2018),
+                                         (MATRIX_2025_CSV, MATRIX_2025_BIN, 2025)):
+            from_long_csv(csv_path, args.points, bin_path, year)
+            print(f"✅ {csv_path} -> {bin_path}")
+    elif args.action == "export-csv":
+        export_csv(load_matrix(MATRIX_2018_BIN), load_matrix(MATRIX_2025_BIN))
+        print(f"✅ {MATRIX_2018_CSV}, {MATRIX_2025_CSV}, {MATRIX_DELTA_CSV} saved")
+    else:
+        for bin_path in (MATRIX_2018_BIN, MATRIX_2025_BIN):
+            meta = read_meta(bin_path)
+            print(bin_path, {k: v for k, v in meta.items() if k != "arrays"})
@@ -0,0 +1,256 @@
+"""
+Run metrics: per-engine, per-endpoint request latency histograms, request
+and response bytes, retries and JSON decode time, plus wall-clock timers
+for pipeline stages (reads, matrix passes, writes).
+
+Collection is off until enable() is called; while off every hook is a
+single flag check. write() dumps one JSON file per run, and profiled()
+wraps a run in cProfile. Scripts expose both with add_arguments() and
+session():
+
+    python run_matrix_and_delta.py --metrics --profile run.pstats
+"""
+import contextlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from config import METRICS_DIR
+
+ENABLED = False
+
+# Histogram resolution: buckets per doubling (about 4% wide) above MIN_VALUE
+BUCKETS_PER_DOUBLING = 16
+MIN_VALUE = 1e-4
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Log-bucketed histogram of non-negative values; quantiles within one bucket width."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        b = 0 if value <= MIN_VALUE else 1 + int(math.log2(value / MIN_VALUE) * BUCKETS_PER_DOUBLING)
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """Upper edge of the bucket holding the q-quantile (capped at the max seen)."""
+        if not self.count:
+            return float("nan")
+        rank = q * (self.count - 1)
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen > rank:
+                return min(self.max, MIN_VALUE * 2 ** (b / BUCKETS_PER_DOUBLING))
+        return self.max
+
+    def summary(self) -> dict:
+        out = {"count": self.count, "total": round(self.total, 6),
+               "mean": round(self.total / self.count, 6) if self.count else None}
+        for q in QUANTILES:
+            out[f"p{round(q * 100)}"] = round(self.quantile(q), 6) if self.count else None
+        out["max"] = round(self.max, 6)
+        return out
+
+
+class _Endpoint:
+    def __init__(self):
+        self.errors = 0
+        self.retries = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.latency = Histogram()
+        self.parse = Histogram()
+
+
+_lock = threading.Lock()
+_endpoints: dict[tuple[str, str], _Endpoint] = {}
+_stages: dict[str, Histogram] = {}
+_started = time.time()
+
+
+def enable() -> None:
+    """Start collecting (and forget anything collected before)."""
+    global ENABLED, _started
+    with _lock:
+        _endpoints.clear()
+        _stages.clear()
+        _started = time.time()
+        ENABLED = True
+
+
+def _endpoint(engine: str, path: str) -> _Endpoint:
+    key = (engine.rstrip("/"), path)
+    ep = _endpoints.get(key)
+    if ep is None:
+        ep = _endpoints[key] = _Endpoint()
+    return ep
+
+
+def record_request(engine: str, path: str, seconds: float, response=None, retry: bool = False) -> None:
+    """
+    One HTTP attempt. response is None when the attempt raised (timeout,
+    connection error); 4xx/5xx responses count as errors too.
+    """
+    with _lock:
+        ep = _endpoint(engine, path)
+        ep.latency.add(seconds)
+        ep.retries += retry
+        if response is None:
+            ep.errors += 1
+            return
+        ep.errors += response.status_code >= 400
+        ep.bytes_out += len(response.request.body or b"")
+        ep.bytes_in += len(response.content)
+
+
+def decode(response):
+    """response.json(), timed against the response's engine and endpoint when enabled."""
+    if not ENABLED:
+        return response.json()
+    t0 = time.perf_counter()
+    try:
+        return response.json()
+    finally:
+        seconds = time.perf_counter() - t0
+        url = urlsplit(response.url)
+        with _lock:
+            _endpoint(f"{url.scheme}://{url.netloc}", url.path).parse.add(seconds)
+
+
+class _Stage:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.t0
+        with _lock:
+            h = _stages.get(self.name)
+            if h is None:
+                h = _stages[self.name] = Histogram()
+            h.add(seconds)
+        return False
+
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+def stage(name: str):
+    """Context manager timing one pipeline stage (a no-op while disabled)."""
+    return _Stage(name) if ENABLED else _NO_STAGE
+
+
+def snapshot() -> dict:
+    """Everything collected so far, as JSON-ready dicts."""
+    with _lock:
+        requests = [{
+            "engine": engine,
+            "endpoint": path,
+            "requests": ep.latency.count,
+            "errors": ep.errors,
+            "retries": ep.retries,
+            "bytes_out": ep.bytes_out,
+            "bytes_in": ep.bytes_in,
+            "latency_s": ep.latency.summary(),
+            "json_parse_s": ep.parse.summary(),
+        } for (engine, path), ep in sorted(_endpoints.items())]
+        stages = [{"stage": name, **h.summary()} for name, h in _stages.items()]
+    return {
+        "argv": sys.argv,
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(_started)),
+        "wall_s": round(time.time() - _started, 3),
+        "requests": requests,
+        "stages": stages,
+    }
+
+
+def default_path() -> str:
+    script = os.path.splitext(os.path.basename(sys.argv[0] or "run"))[0]
+    return os.path.join(METRICS_DIR, f"{script}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(_started))}.json")
+
+
+def write(path: str | None = None, data: dict | None = None) -> str:
+    path = path or default_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = data or snapshot()
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+    return path
+
+
+def print_report(data: dict | None = None) -> None:
+    data = data or snapshot()
+    for r in data["requests"]:
+        lat = r["latency_s"]
+        print(f"  {r['engine']}{r['endpoint']}: {r['requests']} requests ({r['errors']} errors, "
+              f"{r['retries']} retries), p50 {lat['p50']:.3f}s p95 {lat['p95']:.3f}s p99 {lat['p99']:.3f}s, "
+              f"{r['bytes_out'] / 1e6:.1f} MB out / {r['bytes_in'] / 1e6:.1f} MB in, "
+              f"JSON {r['json_parse_s']['total']:.2f}s")
+    for s in data["stages"]:
+        print(f"  {s['stage']}: {s['total']:.2f}s" + (f" over {s['count']} calls" if s["count"] > 1 else ""))
+
+
+@contextlib.contextmanager
+def profiled(path: str | None):
+    """cProfile the block (main thread only) into path and print the top functions."""
+    if not path:
+        yield
+        return
+    # Imported here: pstats alone costs more than the rest of a CLI's startup
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"\n✅ profile saved to {path} (top 15 by cumulative time):")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--metrics", nargs="?", const="", default=None, metavar="JSON",
+                        help=f"Collect request/stage metrics and write them to JSON "
+                             f"(default: {METRICS_DIR}/<script>_<time>.json)")
+    parser.add_argument("--profile", default=None, metavar="PSTATS",
+                        help="Run under cProfile and save the stats to this file")
+
+
+@contextlib.contextmanager
+def session(args):
+    """Collect metrics / profile for the block, as requested by add_arguments() flags."""
+    if args.metrics is not None:
+        enable()
+    try:
+        with profiled(args.profile):
+            yield
+    finally:
+        if args.metrics is not None:
+            data = snapshot()
+            path = write(args.metrics or None, data)
+            print("\nRun metrics:")
+            print_report(data)
+            print(f"✅ metrics saved to {path}")
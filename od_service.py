@@ -0,0 +1,342 @@
+"""
+Local OD query service over the computed matrices.
+
+Every snapshot store that exists (matrix_<year>.bin for the years in
+config.SNAPSHOTS) is memory-mapped and point ids are resolved through one
+id -> index map, so the service starts in milliseconds whatever N is. A
+source row's destinations are sorted by the delta between the earliest and
+latest year on its first top-k query (one O(N log N) argsort, cached), and
+later queries on the row are a slice. --presort sorts every row at load
+instead: an N x N argsort, seconds at N=5,000, and the time is reported.
+Row, column and pair queries read the mapped arrays directly.
+
+Reloads never block queries: a watcher polls the stores and, once a run has
+finished writing them, builds the new index (maps, and sort orders with
+--presort) on the side and swaps it in with a single assignment. A query holds on to the index it
+started with, and the old maps stay readable after their files are
+replaced, so in-flight requests finish on the old data.
+
+    python od_service.py --port 8090
+    curl 'localhost:8090/top?id=12&k=5'
+    curl 'localhost:8090/pair?src=12&dst=40'
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from config import SNAPSHOTS, TIMELINE_MATRIX_BIN, OD_SERVICE_PORT, OD_RELOAD_S
+from matrix_store import CELL_STATUS, DISTANCE_DECIMALS, load_matrix
+
+# Source rows argsorted per block while building the sort orders
+SORT_BLOCK_ROWS = 256
+
+
+def _floats(a, decimals=None) -> list:
+    """JSON-ready list: NaN -> None, optionally rounded."""
+    a = np.asarray(a, dtype=np.float64)
+    if decimals is not None:
+        a = np.round(a, decimals)
+    return [None if v != v else v for v in a.tolist()]
+
+
+class ODIndex:
+    """
+    One generation of the service: the stores of every year on the same
+    points, the id -> index map, and the delta sort order of each row
+    (all built at load with presort, else each on the row's first query).
+    """
+
+    def __init__(self, stores: dict, signature: tuple, presort: bool = False):
+        self.stores = stores
+        self.years = sorted(stores)
+        self.signature = signature
+        self.loaded_at = time.time()
+        first = stores[self.years[0]]
+        self.n = first.n
+        self.ids = first.ids
+        self.points_hash = first.meta["points_hash"]
+        self._index = {p: i for i, p in enumerate(self.ids.tolist())}
+        # Default delta: earliest -> latest year
+        self.delta_years = (self.years[0], self.years[-1]) if len(self.years) > 1 else None
+        self._order_dtype = np.uint16 if self.n <= 1 << 16 else np.int32
+        # Row -> (order, valid); a row sorted twice by racing queries gets the same result
+        self._orders = {}
+        self.sort_seconds = None
+        if presort and self.delta_years:
+            t0 = time.perf_counter()
+            self._sort_orders()
+            self.sort_seconds = time.perf_counter() - t0
+
+    def _sort_orders(self) -> None:
+        """Sort every row up front, a block of rows per argsort."""
+        a, b = (self.stores[y].time_s for y in self.delta_years)
+        for r0 in range(0, self.n, SORT_BLOCK_ROWS):
+            r1 = min(self.n, r0 + SORT_BLOCK_ROWS)
+            delta = np.asarray(b[r0:r1], dtype=np.float64) - a[r0:r1]
+            order = np.argsort(delta, axis=1, kind="stable").astype(self._order_dtype)
+            valid = (~np.isnan(delta)).sum(axis=1)
+            for r in range(r0, r1):
+                self._orders[r] = (order[r - r0], int(valid[r - r0]))
+
+    def _row_order(self, i: int) -> tuple[np.ndarray, int]:
+        """Destinations of row i, most improved first (NaN deltas last), and the count of non-NaN."""
+        cached = self._orders.get(i)
+        if cached is None:
+            a, b = (self.stores[y].time_s[i] for y in self.delta_years)
+            delta = np.asarray(b, dtype=np.float64) - a
+            cached = self._orders[i] = (np.argsort(delta, kind="stable").astype(self._order_dtype),
+                                        int((~np.isnan(delta)).sum()))
+        return cached
+
+    def index_of(self, point_id) -> int:
+        i = self._index.get(int(point_id))
+        if i is None:
+            raise LookupError(f"unknown point id {point_id}")
+        return i
+
+    def _store(self, year):
+        year = self.years[-1] if year is None else int(year)
+        if year not in self.stores:
+            raise LookupError(f"no matrix for {year} (loaded: {self.years})")
+        return year, self.stores[year]
+
+    def _years(self, year_from, year_to) -> tuple[int, int]:
+        if year_from is None and year_to is None:
+            if self.delta_years is None:
+                raise LookupError("deltas need at least two years")
+            return self.delta_years
+        a, b = int(year_from or self.years[0]), int(year_to or self.years[-1])
+        for y in (a, b):
+            self._store(y)
+        return a, b
+
+    # --- queries -----------------------------------------------------------
+
+    def row(self, src, year=None) -> dict:
+        """Times and distances from src to every point."""
+        year, m = self._store(year)
+        i = self.index_of(src)
+        return {"year": year, "src": int(src), "time_s": m.time_s[i], "distance_km": m.distance_km[i]}
+
+    def column(self, dst, year=None) -> dict:
+        """Times and distances from every point to dst."""
+        year, m = self._store(year)
+        j = self.index_of(dst)
+        return {"year": year, "dst": int(dst), "time_s": m.time_s[:, j], "distance_km": m.distance_km[:, j]}
+
+    def pair(self, src, dst) -> dict:
+        """One OD pair in every loaded year."""
+        i, j = self.index_of(src), self.index_of(dst)
+        out = {}
+        for year, m in self.stores.items():
+            t = float(m.time_s[i, j])
+            out[year] = {
+                "time_s": None if t != t else t,
+                "distance_km": _floats([m.distance_km[i, j]], DISTANCE_DECIMALS)[0],
+                "status": CELL_STATUS[int(m.status[i, j])] if m.status is not None else None,
+            }
+        return out
+
+    def top(self, src, k=10, worse=False, year_from=None, year_to=None) -> list[dict]:
+        """The k destinations from src whose time improved (or worsened) most between two years."""
+        a, b = self._years(year_from, year_to)
+        i = self.index_of(src)
+        ta, tb = self.stores[a].time_s[i], self.stores[b].time_s[i]
+        if (a, b) == self.delta_years:
+            order, valid = self._row_order(i)
+        else:
+            delta = np.asarray(tb, dtype=np.float64) - ta
+            order, valid = np.argsort(delta, kind="stable"), int((~np.isnan(delta)).sum())
+        # Most worsened = the non-NaN end of the same order, read backwards
+        cols = np.asarray(order[:valid][::-1][:k] if worse else order[:k], dtype=np.int64)
+        t_a, t_b = np.asarray(ta[cols], dtype=np.float64), np.asarray(tb[cols], dtype=np.float64)
+        delta = t_b - t_a
+        keep = delta > 0 if worse else delta < 0
+        return [{"dst": dst, "delta_time_s": d, f"time_s_{a}": x, f"time_s_{b}": y}
+                for dst, d, x, y in zip(self.ids[cols[keep]].tolist(), delta[keep].tolist(),
+                                        t_a[keep].tolist(), t_b[keep].tolist())]
+
+    def status(self) -> dict:
+        return {
+            "years": self.years,
+            "points": self.n,
+            "points_hash": self.points_hash,
+            "sorted_years": list(self.delta_years) if self.delta_years else None,
+            "sorted_rows": len(self._orders),
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded_at)),
+            "files": {y: {"path": m.path, "engine_id": m.meta.get("engine_id")} for y, m in self.stores.items()},
+        }
+
+
+def store_paths(years=None) -> dict:
+    return {y: TIMELINE_MATRIX_BIN.format(year=y) for y in sorted(years or SNAPSHOTS)}
+
+
+def signature(paths: dict) -> tuple:
+    """What identifies the files on disk: a finished run replaces them, changing inode and mtime."""
+    out = []
+    for year, path in paths.items():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        out.append((year, st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(out)
+
+
+def load_index(paths: dict, presort: bool = False) -> ODIndex:
+    """
+    Index over the stores that exist. Years computed on other points than
+    the newest store (an older run) are left out.
+    """
+    sig = signature(paths)
+    stores = {}
+    for year, *_ in sig:
+        m = load_matrix(paths[year])
+        if m.time_s.ndim == 2:
+            stores[year] = m
+    if not stores:
+        raise FileNotFoundError(f"no matrix stores found ({', '.join(paths.values())})")
+    newest = max(stores, key=lambda y: os.stat(paths[y]).st_mtime_ns)
+    phash = stores[newest].meta["points_hash"]
+    skipped = sorted(y for y, m in stores.items() if m.meta["points_hash"] != phash)
+    if skipped:
+        print(f"⚠️  {', '.join(map(str, skipped))} computed on other points than {newest}, not served")
+    return ODIndex({y: m for y, m in stores.items() if y not in skipped}, sig, presort)
+
+
+class ODService:
+    """Holds the current ODIndex and swaps in a new one when the stores change."""
+
+    def __init__(self, years=None, reload_s: float = OD_RELOAD_S, presort: bool = False):
+        self.paths = store_paths(years)
+        self.reload_s = reload_s
+        self.presort = presort
+        self.index = load_index(self.paths, presort)
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def start(self) -> None:
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _watch(self) -> None:
+        pending = None
+        while not self._stop.wait(self.reload_s):
+            sig = signature(self.paths)
+            if sig == self.index.signature:
+                pending = None
+                continue
+            if sig != pending:
+                # Changed since the last poll: a run may still be committing its years
+                pending = sig
+                continue
+            try:
+                t0 = time.perf_counter()
+                new = load_index(self.paths, self.presort)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  reload failed, still serving the previous matrices: {e}")
+                pending = None
+                continue
+            self.index = new
+            self.reloads += 1
+            print(f"✅ reloaded {', '.join(map(str, new.years))} ({new.n} points) "
+                  f"in {time.perf_counter() - t0:.2f}s")
+
+    def handle(self, path: str, query: dict):
+        """(HTTP status, JSON-ready body) for one request."""
+        index = self.index
+        q = {k: v[-1] for k, v in query.items()}
+        if path == "/row":
+            r = index.row(q["id"], q.get("year"))
+            return 200, {**r, "ids": index.ids.tolist(), "time_s": _floats(r["time_s"]),
+                         "distance_km": _floats(r["distance_km"], DISTANCE_DECIMALS)}
+        if path == "/column":
+            r = index.column(q["id"], q.get("year"))
+            return 200, {**r, "ids": index.ids.tolist(), "time_s": _floats(r["time_s"]),
+                         "distance_km": _floats(r["distance_km"], DISTANCE_DECIMALS)}
+        if path == "/pair":
+            return 200, {"src": int(q["src"]), "dst": int(q["dst"]), "years": index.pair(q["src"], q["dst"])}
+        if path == "/top":
+            worse = q.get("order", "improved") == "worsened"
+            return 200, {"src": int(q["id"]), "order": "worsened" if worse else "improved",
+                         "destinations": index.top(q["id"], int(q.get("k", 10)), worse,
+                                                   q.get("from"), q.get("to"))}
+        if path == "/status":
+            return 200, {**index.status(), "reloads": self.reloads}
+        return 404, {"error": f"no such endpoint: {path} (row, column, pair, top, status)"}
+
+
+def make_server(service: ODService, port: int = OD_SERVICE_PORT, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body go out in separate writes; without this each reply waits on a delayed ACK
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            try:
+                code, out = service.handle(url.path, parse_qs(url.query))
+            except KeyError as e:
+                code, out = 400, {"error": f"missing parameter {e}"}
+            except LookupError as e:
+                code, out = 404, {"error": str(e)}
+            except ValueError as e:
+                code, out = 400, {"error": f"bad request: {e}"}
+            data = json.dumps(out).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(port=OD_SERVICE_PORT, host="127.0.0.1", years=None, reload_s=OD_RELOAD_S, presort=False):
+    t0 = time.perf_counter()
+    service = ODService(years, reload_s, presort)
+    index = service.index
+    print(f"✅ {', '.join(map(str, index.years))} loaded ({index.n} points) in {time.perf_counter() - t0:.2f}s")
+    if index.sort_seconds is not None:
+        print(f"   sort orders for {index.delta_years}: {index.n:,} rows in {index.sort_seconds:.2f}s")
+    elif index.delta_years:
+        print(f"   sort orders for {index.delta_years}: built per row on its first /top query")
+    service.start()
+    server = make_server(service, port, host)
+    print(f"✅ OD service on http://{host}:{port} (reloading every {reload_s:g}s)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+
+
+def run(args) -> None:
+    """Entry point for parsed cli.serve_arguments() flags."""
+    main(port=args.port, host=args.host, years=args.years, reload_s=args.reload_s, presort=args.presort)
+
+
+if __name__ == "__main__":
+    import cli
+
+    parser = argparse.ArgumentParser(description="HTTP queries over the computed matrices")
+    cli.serve_arguments(parser)
+    run(parser.parse_args())
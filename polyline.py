@@ -0,0 +1,119 @@
+"""
+Encoded polyline decoding (and encoding).
+
+decode_polyline is the reference one-string decoder. decode_many decodes a
+whole batch of shapes in a few NumPy passes over the concatenated bytes,
+returning (k, 2) lat/lon arrays that match decode_polyline exactly.
+encode_polyline is the inverse, also vectorized.
+"""
+import numpy as np
+
+
+def decode_polyline(s, precision=6):
+    index, lat, lon = 0, 0, 0
+    coords = []
+    factor = 10 ** precision
+    while index < len(s):
+        shift = result = 0
+        while True:
+            b = ord(s[index]) - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        dlat = ~(result >> 1) if (result & 1) else (result >> 1)
+        lat += dlat
+        shift = result = 0
+        while True:
+            b = ord(s[index]) - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        dlon = ~(result >> 1) if (result & 1) else (result >> 1)
+        lon += dlon
+        coords.append((lat / factor, lon / factor))
+    return coords
+
+
+def varints_many(shapes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Signed varints of many encoded polylines at once.
+    Returns (values, counts): all values back to back as int64
+    ([lat0, lon0, dlat1, dlon1, ...] per shape) and the number of values per shape.
+    """
+    lengths = np.fromiter((len(s) for s in shapes), dtype=np.int64, count=len(shapes))
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(len(shapes), dtype=np.int64)
+
+    b = np.frombuffer("".join(shapes).encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    last = b < 0x20
+
+    # Each varint runs from the char after the previous terminator to its own terminator
+    ends = np.flatnonzero(last)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    varint_of_char = np.cumsum(last) - last
+    varint_of_char = varint_of_char[:ends[-1] + 1]
+    pos = np.arange(len(varint_of_char)) - starts[varint_of_char]
+    chunks = (b[:len(varint_of_char)] & 0x1f) << (5 * pos)
+    result = np.add.reduceat(chunks, starts)
+    values = np.where(result & 1, ~(result >> 1), result >> 1)
+
+    # Varints per shape = terminators inside its char range
+    term_upto = np.concatenate(([0], np.cumsum(last)))
+    shape_end = np.cumsum(lengths)
+    counts = np.diff(np.concatenate(([0], term_upto[shape_end])))
+    return values, counts
+
+
+def deltas_many(shapes: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Integer (dlat, dlon) rows of many polylines: a flat (total_vertices, 2)
+    int64 array and the vertex count of each shape.
+    """
+    values, counts = varints_many(shapes)
+    return values.reshape(-1, 2), counts // 2
+
+
+def decode_many(shapes: list[str], precision: int = 6) -> list[np.ndarray]:
+    """Decode many polylines into a list of (k, 2) float64 lat/lon arrays."""
+    deltas, counts = deltas_many(shapes)
+    if len(deltas) == 0:
+        return [np.zeros((0, 2)) for _ in shapes]
+
+    # One cumulative sum over everything, minus the running total before each shape
+    absolute = np.cumsum(deltas, axis=0)
+    first = np.cumsum(counts) - counts
+    before = np.zeros((len(counts), 2), dtype=np.int64)
+    has_prev = first > 0
+    before[has_prev] = absolute[first[has_prev] - 1]
+    absolute -= np.repeat(before, counts, axis=0)
+
+    coords = absolute / 10 ** precision
+    return np.split(coords, np.cumsum(counts)[:-1])
+
+
+def encode_polyline(coords, precision: int = 6) -> str:
+    """
+    Encode (k, 2) lat/lon at the given precision; the coordinates are
+    rounded to that many decimals, so this also quantizes.
+    """
+    pts = np.round(np.asarray(coords, dtype=np.float64).reshape(-1, 2) * 10 ** precision).astype(np.int64)
+    if len(pts) == 0:
+        return ""
+    d = np.diff(pts, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    v = np.where(d < 0, ~(d << 1), d << 1)
+
+    # 5-bit groups, low first; every group but a value's last has the continuation bit
+    shifts = 5 * np.arange(7)
+    groups = (v[:, None] >> shifts) & 0x1f
+    ngroups = 1 + (v[:, None] >= (1 << shifts[1:])).sum(axis=1)
+    used = np.arange(7) < ngroups[:, None]
+    more = np.arange(7) < (ngroups - 1)[:, None]
+    chars = (groups | (more * 0x20)) + 63
+    return chars[used].astype(np.uint8).tobytes().decode("ascii")
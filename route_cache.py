@@ -0,0 +1,121 @@
+"""
+Persistent on-disk cache for Valhalla /route responses.
+
+Entries are keyed by engine identity (hash of the snapshot's
+file_hashes.txt), costing, rounded coordinates and request options, so a
+rebuilt tile set never serves stale routes. Stale entries for an engine are
+purged the first time it is used; the cache is kept under a size cap by
+evicting least-recently-used entries.
+"""
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from config import ROUTE_CACHE_DB, ROUTE_CACHE_MAX_MB
+from valhalla_client import engine_id
+
+COORD_DECIMALS = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS routes (
+    key        TEXT PRIMARY KEY,
+    engine     TEXT NOT NULL,
+    engine_id  TEXT NOT NULL,
+    response   BLOB NOT NULL,
+    size       INTEGER NOT NULL,
+    last_used  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS routes_last_used ON routes (last_used);
+CREATE INDEX IF NOT EXISTS routes_engine ON routes (engine, engine_id);
+"""
+
+
+class RouteCache:
+    """Thread-safe SQLite route cache with LRU eviction and hit/miss counters."""
+
+    def __init__(self, path: str = ROUTE_CACHE_DB, max_mb: float = ROUTE_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._engine_ids = {}
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM routes").fetchone()[0]
+
+    def _engine(self, base_url: str) -> str:
+        """Current engine id; drops entries from older tile sets on first sight."""
+        eid = self._engine_ids.get(base_url)
+        if eid is None:
+            eid = self._engine_ids[base_url] = engine_id(base_url)
+            stale_bytes = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM routes WHERE engine = ? AND engine_id != ?",
+                (base_url, eid)).fetchone()[0]
+            self._db.execute("DELETE FROM routes WHERE engine = ? AND engine_id != ?", (base_url, eid))
+            self._total -= stale_bytes
+        return eid
+
+    @staticmethod
+    def make_key(eid: str, payload: dict) -> str:
+        locs = ";".join(f"{round(p['lat'], COORD_DECIMALS)},{round(p['lon'], COORD_DECIMALS)}"
+                        for p in payload["locations"])
+        options = {k: v for k, v in payload.items() if k != "locations"}
+        return f"{eid}|{locs}|{json.dumps(options, sort_keys=True)}"
+
+    def get(self, base_url: str, payload: dict):
+        """Cached response for this request, or None."""
+        with self._lock:
+            key = self.make_key(self._engine(base_url), payload)
+            row = self._db.execute("SELECT response FROM routes WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE routes SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, base_url: str, payload: dict, response) -> None:
+        blob = zlib.compress(json.dumps(response, separators=(",", ":")).encode())
+        with self._lock:
+            eid = self._engine(base_url)
+            key = self.make_key(eid, payload)
+            old = self._db.execute("SELECT size FROM routes WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO routes (key, engine, engine_id, response, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, base_url, eid, blob, len(blob), time.time()))
+            self._total += len(blob) - (old[0] if old else 0)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drop least-recently-used entries until the cache is 10% under its cap."""
+        target = int(self.max_bytes * 0.9)
+        rows = self._db.execute("SELECT key, size FROM routes ORDER BY last_used")
+        doomed = []
+        for key, size in rows:
+            if self._total <= target:
+                break
+            doomed.append((key,))
+            self._total -= size
+        self._db.executemany("DELETE FROM routes WHERE key = ?", doomed)
+        self.evicted += len(doomed)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evicted": self.evicted,
+            "size_mb": self._total / (1024 * 1024),
+        }
+
+    def close(self) -> None:
+        self._db.close()
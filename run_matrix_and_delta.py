@@ -1,55 +1,134 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
 import requests
 
+import metrics
+
 from config import (
     VALHALLA_2018, VALHALLA_2025, COSTING,
     POINTS_CSV, MATRIX_2018_CSV, MATRIX_2025_CSV, MATRIX_DELTA_CSV,
-    MATRIX_TIMEOUT
+    MATRIX_2018_BIN, MATRIX_2025_BIN,
+    MATRIX_TILES_DIR, MATRIX_TIMEOUT, MATRIX_MAX_FAILED_SHARE,
+    SWEEP_2018_BIN, SWEEP_2025_BIN, SWEEP_DATE, SWEEP_TIMES
+)
+from build_snapshots import check_snapshots
+from matrix_store import (
+    CELL_STATUS, CELL_OK, CELL_NO_ROUTE,
+    create_matrix, commit_matrix, export_csv, load_matrix, points_hash, status_counts
 )
+from valhalla_client import engine_id, get_client, iter_completed, service_limits
 
 BASE_2018 = VALHALLA_2018
 BASE_2025 = VALHALLA_2025
 TIMEOUT_SEC = MATRIX_TIMEOUT
 
+# Valhalla's default when service_limits cannot be read
+DEFAULT_MAX_MATRIX_PAIRS = 2500
+
+# Rows copied per step when carrying unchanged cells into an updated store
+COPY_BLOCK_ROWS = 1024
+
+# Valhalla error codes for requests over a service limit (locations, distance)
+LIMIT_ERROR_CODES = {150, 154}
+
+# After a success at the current block size, the per-engine limit grows back
+# by this factor (up to max_pairs); a failure halves it
+GROW_FACTOR = 1.5
+
+
+class MatrixRequestError(RuntimeError):
+    """A matrix request that failed after the client's retries; reason is a CELL_STATUS name."""
+
+    def __init__(self, reason: str, detail: str):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
 
-def _post(base_url: str, path: str, payload: dict):
-    url = f"{base_url}{path}"
-    r = requests.post(url, json=payload, timeout=TIMEOUT_SEC)
+
+class MatrixRunStopped(RuntimeError):
+    """Work of one engine stopped because another engine of the same run failed."""
+
+
+def _failure_reason(r) -> str:
+    if r.status_code >= 500:
+        return "server_error"
+    try:
+        body = r.json()
+    except ValueError:
+        body = {}
+    text = f"{body.get('error', '')} {r.text[:500]}".lower() if isinstance(body, dict) else r.text.lower()
+    if (isinstance(body, dict) and body.get("error_code") in LIMIT_ERROR_CODES) or "exceed" in text:
+        return "too_large"
+    return "rejected"
+
+
+# Server time of the calling thread's last matrix response (r.elapsed): what
+# TIMEOUT_SEC bounds, without the wait for a free connection slot
+_response_time = threading.local()
+
+
+def _post(base_url: str, path: str, payload: dict, retries: int | None = None):
+    try:
+        r = get_client(base_url).post(path, payload, timeout=TIMEOUT_SEC, retries=retries)
+    except requests.Timeout as e:
+        raise MatrixRequestError("timeout", f"no response from {base_url}{path} in {TIMEOUT_SEC}s") from e
+    except requests.ConnectionError as e:
+        raise MatrixRequestError("connection_error", f"{base_url}{path}: {e}") from e
+    _response_time.seconds = r.elapsed.total_seconds()
     if r.status_code == 404:
         return None, r
     if not r.ok:
-        print("\n=== VALHALLA ERROR ===")
-        print("URL:", url)
-        print("HTTP:", r.status_code)
-        print("Response:", r.text[:2000])
-        print("Payload sizes: sources =", len(payload.get("sources", [])),
-              "targets =", len(payload.get("targets", [])))
-        if payload.get("sources"):
-            print("Sample source[0]:", payload["sources"][0])
-        if payload.get("targets"):
-            print("Sample target[0]:", payload["targets"][0])
-        print("=== END ERROR ===\n")
-
-    r.raise_for_status()
-    return r.json(), r
-
-
-def call_matrix(base_url: str, locs: list[dict]) -> list:
+        raise MatrixRequestError(_failure_reason(r), f"HTTP {r.status_code} from {base_url}{path}: {r.text[:200]}")
+    try:
+        return metrics.decode(r), r
+    except ValueError as e:
+        raise MatrixRequestError("bad_response", f"{base_url}{path}: {r.text[:200]}") from e
+
+
+def call_matrix(base_url: str, locs: list[dict], targets: list[dict] | None = None,
+                date_time: str | None = None, backend: str = "valhalla", retries: int | None = None) -> list:
+    """
+    Matrix of locs x targets. date_time ("YYYY-MM-DDTHH:MM") asks for
+    departure at that local time, for engines with time-dependent speeds.
+    backend is "valhalla" (the HTTP engine at base_url) or "local"
+    (local_graph.py's offline graph of that engine's extract).
+    retries overrides the HTTP client's retry count.
+    """
+    if targets is None:
+        targets = locs
+
+    if backend == "local":
+        import local_graph
+        return local_graph.matrix(base_url, locs, targets)
+
     payload_stt = {
         "sources": locs,
-        "targets": locs,
+        "targets": targets,
         "costing": COSTING,
     }
+    if date_time:
+        payload_stt["date_time"] = {"type": 1, "value": date_time}
 
-    data, resp = _post(base_url, "/sources_to_targets", payload_stt)
+    data, resp = _post(base_url, "/sources_to_targets", payload_stt, retries)
     if data is None:
         payload_matrix = {
             "sources": locs,
-            "targets": locs,
+            "targets": targets,
             "costing": COSTING,
             "action": "sources_to_targets",
         }
-        data, resp = _post(base_url, "/matrix", payload_matrix)
+        if date_time:
+            payload_matrix["date_time"] = payload_stt["date_time"]
+        data, resp = _post(base_url, "/matrix", payload_matrix, retries)
 
     if data is None:
         raise RuntimeError(
@@ -66,71 +145,743 @@ def call_matrix(base_url: str, locs: list[dict]) -> list:
     raise RuntimeError(f"Unexpected matrix response shape from {base_url}: {type(data)} keys={list(data.keys()) if isinstance(data, dict) else ''}")
 
 
-def matrix_to_long(m: list, year: int) -> pd.DataFrame:
-    rows = []
-    n = len(m)
-    for i in range(n):
-        for j in range(len(m[i])):
-            cell = m[i][j]
-            rows.append({
-                "src": i + 1,
-                "dst": j + 1,
-                "time_s": None if cell is None else cell.get("time"),
-                "distance_km": None if cell is None else cell.get("distance"),
-                "year": year,
-            })
-    return pd.DataFrame(rows)
-
-
-def main():
-    pts = pd.read_csv(POINTS_CSV)
-    locs = [{"lat": float(r.lat), "lon": float(r.lon)} for r in pts.itertuples(index=False)]
+def max_matrix_pairs(base_url: str) -> int:
+    """
+    Read max_matrix_location_pairs for COSTING from the engine's valhalla.json.
+    Falls back to Valhalla's default if the config is not available locally.
+    """
+    limits = service_limits(base_url)
+    return int(limits.get("max_matrix_location_pairs") or DEFAULT_MAX_MATRIX_PAIRS)
 
-    print(f"Loaded {len(locs)} points from {POINTS_CSV}")
-    print(f"Bounding box coverage check: lat=[{pts['lat'].min():.4f}, {pts['lat'].max():.4f}], lon=[{pts['lon'].min():.4f}, {pts['lon'].max():.4f}]")
 
-    print("\nCalling matrix 2018...")
-    m2018 = call_matrix(BASE_2018, locs)
-    df2018 = matrix_to_long(m2018, 2018)
-    df2018.to_csv(MATRIX_2018_CSV, index=False)
-    print(f"✅ {MATRIX_2018_CSV} saved")
+def tile_shape(n_sources: int, n_targets: int, max_pairs: int) -> tuple[int, int]:
+    """
+    Pick (rows, cols) so that rows * cols <= max_pairs.
+    Tiles are square where possible; a short side gives its slack to the other.
+    """
+    side = max(1, math.isqrt(max_pairs))
+    cols = min(n_targets, side)
+    rows = min(n_sources, max(1, max_pairs // cols))
+    if rows == n_sources:
+        cols = min(n_targets, max(1, max_pairs // rows))
+    return rows, cols
+
+
+class BlockSizer:
+    """Pairs per matrix request for one engine, shared by all of its tiles."""
+
+    def __init__(self, max_pairs: int):
+        self.max_pairs = self.limit = max_pairs
+        self._lock = threading.Lock()
+
+    def failed(self, pairs: int) -> None:
+        with self._lock:
+            self.limit = max(1, min(self.limit, pairs // 2))
+
+    def succeeded(self, pairs: int) -> None:
+        with self._lock:
+            if pairs >= self.limit and self.limit < self.max_pairs:
+                self.limit = min(self.max_pairs, math.ceil(self.limit * GROW_FACTOR))
+
+
+class Throughput:
+    """Requests, answered pairs and time spent per engine."""
+
+    def __init__(self):
+        self.requests = 0
+        self.failures = 0
+        self.pairs = 0
+        self.failed_cells = 0
+        self.busy_s = 0.0
+        self.slowest_s = 0.0
+        self.first = None
+        self.last = None
+        self._lock = threading.Lock()
+
+    def record(self, pairs: int, started: float, elapsed: float, ok: bool, response_s: float | None = None) -> None:
+        with self._lock:
+            self.requests += 1
+            self.busy_s += elapsed
+            if self.first is None or started < self.first:
+                self.first = started
+            self.last = max(self.last or 0.0, started + elapsed)
+            if ok:
+                self.pairs += pairs
+                self.slowest_s = max(self.slowest_s, elapsed if response_s is None else response_s)
+            else:
+                self.failures += 1
+
+    def null_cell(self) -> None:
+        with self._lock:
+            self.failed_cells += 1
+
+    def report(self) -> str:
+        wall = (self.last - self.first) if self.first is not None else 0.0
+        rate = self.pairs / wall if wall > 0 else 0.0
+        return (f"{self.pairs:,} pairs in {wall:.1f}s = {rate:,.0f} pairs/s, "
+                f"{self.requests:,} requests ({self.failures:,} failed), "
+                f"slowest success {self.slowest_s:.1f}s of {TIMEOUT_SEC}s timeout, "
+                f"{self.failed_cells:,} cells left null")
+
+
+_engines: dict[str, tuple] = {}
+_engines_lock = threading.Lock()
+
+
+def _engine_state(base_url: str, max_pairs: int) -> tuple[BlockSizer, Throughput]:
+    """Shared (sizer, throughput) of an engine; the sizer restarts when max_pairs changes."""
+    with _engines_lock:
+        sizer, stats = _engines.get(base_url, (None, None))
+        if stats is None:
+            stats = Throughput()
+        if sizer is None or sizer.max_pairs != max_pairs:
+            sizer = BlockSizer(max_pairs)
+        _engines[base_url] = (sizer, stats)
+        return sizer, stats
+
+
+def print_throughput() -> None:
+    for base_url, (sizer, stats) in _engines.items():
+        print(f"  {base_url}: {stats.report()}, block limit {sizer.limit:,}/{sizer.max_pairs:,} pairs")
+
+
+def fetch_block(base_url: str, sources: list[dict], targets: list[dict], date_time: str | None = None,
+                max_pairs: int | None = None, label: str = "",
+                backend: str = "valhalla", stop: threading.Event | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    sources x targets as ((rows, cols, 2) time/distance, (rows, cols) status),
+    in requests sized by the engine's BlockSizer. A failed request is split
+    in two along its longer side and retried; a single cell that still fails
+    is left NaN with its reason in status instead of aborting the run.
+    Multi-cell requests go out without the client's retries, since a failure
+    is split anyway. A lost connection is not about block size: it gets the
+    client's retries once, and then aborts the run instead of splitting.
+    Once stop is set (another engine of the run failed), the next request
+    raises MatrixRunStopped instead of going out.
+    """
+    if max_pairs is None:
+        max_pairs = max_matrix_pairs(base_url)
+    sizer, stats = _engine_state(base_url, max_pairs)
+    values = np.full((len(sources), len(targets), 2), np.nan)
+    status = np.full((len(sources), len(targets)), CELL_NO_ROUTE, dtype=np.uint8)
+
+    stack = [(0, len(sources), 0, len(targets))]
+    while stack:
+        if stop is not None and stop.is_set():
+            raise MatrixRunStopped(f"[{label}] stopped: another engine of this run failed")
+        i0, i1, j0, j1 = stack.pop()
+        pairs = (i1 - i0) * (j1 - j0)
+        if pairs > sizer.limit:
+            rows, cols = tile_shape(i1 - i0, j1 - j0, sizer.limit)
+            stack.extend((a, min(a + rows, i1), b, min(b + cols, j1))
+                         for a in range(i0, i1, rows) for b in range(j0, j1, cols))
+            continue
+
+        started = time.perf_counter()
+        _response_time.seconds = None
+        try:
+            try:
+                block = call_matrix(base_url, sources[i0:i1], targets[j0:j1], date_time, backend,
+                                    retries=0 if pairs > 1 else None)
+            except MatrixRequestError as e:
+                if e.reason != "connection_error" or pairs == 1:
+                    raise
+                block = call_matrix(base_url, sources[i0:i1], targets[j0:j1], date_time, backend)
+            cells = np.array([[_cell_pair(c) for c in row] for row in block], dtype=np.float64)
+            if cells.shape != (i1 - i0, j1 - j0, 2):
+                raise MatrixRequestError("bad_response", f"expected {i1 - i0}x{j1 - j0} cells, got {cells.shape[:2]}")
+        except MatrixRequestError as e:
+            stats.record(pairs, started, time.perf_counter() - started, ok=False)
+            if e.reason == "connection_error":
+                raise
+            if pairs == 1:
+                # A cell that fails on its own says nothing about block size
+                status[i0, j0] = CELL_STATUS.index(e.reason)
+                stats.null_cell()
+                continue
+            sizer.failed(pairs)
+            if min(i1 - i0, j1 - j0) > 1:
+                # Narrowing down to a row/column is reported in the run summary instead
+                print(f"  ⚠️ [{label}] {i1 - i0}x{j1 - j0} block failed ({e.reason}), splitting")
+            if i1 - i0 >= j1 - j0:
+                mid = (i0 + i1) // 2
+                stack += [(i0, mid, j0, j1), (mid, i1, j0, j1)]
+            else:
+                mid = (j0 + j1) // 2
+                stack += [(i0, i1, j0, mid), (i0, i1, mid, j1)]
+            continue
+
+        stats.record(pairs, started, time.perf_counter() - started, ok=True, response_s=_response_time.seconds)
+        sizer.succeeded(pairs)
+        values[i0:i1, j0:j1] = cells
+        status[i0:i1, j0:j1] = np.where(np.isnan(cells[:, :, 0]), CELL_NO_ROUTE, CELL_OK)
+    return values, status
+
+
+def _output_arrays(out: tuple | None, shape: tuple) -> tuple:
+    """(time_s, distance_km, status) to fill: the ones given in out, new arrays otherwise."""
+    if out is None:
+        out = (np.full(shape, np.nan, dtype=np.float32), np.full(shape, np.nan, dtype=np.float32))
+    if len(out) < 3 or out[2] is None:
+        out = (out[0], out[1], np.full(shape, CELL_NO_ROUTE, dtype=np.uint8))
+    return out
+
+
+def _tiles_key(base_url: str, sources: list[dict], targets: list[dict], rows: int, cols: int,
+               date_time: str | None = None, backend: str = "valhalla") -> str:
+    """
+    Fingerprint of a tiled run, so checkpoints are never reused for other
+    inputs or for another engine (or tile set) behind the same label.
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps([_engine_id(base_url, backend), sources, targets, COSTING, rows, cols, backend,
+                         date_time]).encode())
+    return h.hexdigest()[:12]
+
+
+def _write_json_atomic(path: str, obj) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def call_matrix_tiled(base_url: str, sources: list[dict], targets: list[dict] | None = None,
+                      max_pairs: int | None = None, checkpoint_dir: str | None = None,
+                      label: str = "", out: tuple | None = None, date_time: str | None = None,
+                      backend: str = "valhalla", stop: threading.Event | None = None) -> tuple:
+    """
+    Compute sources x targets as a grid of tiles that each fit the engine's
+    max_matrix_location_pairs, then stitch them into (time_s, distance_km,
+    status) arrays. Pass out=(time_s, distance_km[, status]) to fill existing
+    arrays (e.g. a memory-mapped store) instead of allocating new ones.
+
+    Tiles go through fetch_block, so failing requests are split rather than
+    aborting the run. Finished tiles are saved under checkpoint_dir;
+    re-running with the same inputs skips tiles already on disk. The
+    checkpoints are removed once every cell of the run has been answered.
+    """
+    if targets is None:
+        targets = sources
+    if max_pairs is None:
+        max_pairs = max_matrix_pairs(base_url)
+
+    n_src, n_tgt = len(sources), len(targets)
+    rows, cols = tile_shape(n_src, n_tgt, max_pairs)
+    n_tiles = math.ceil(n_src / rows) * math.ceil(n_tgt / cols)
+
+    run_dir = None
+    if checkpoint_dir:
+        key = _tiles_key(base_url, sources, targets, rows, cols, date_time, backend)
+        run_dir = os.path.join(checkpoint_dir, f"{label or 'matrix'}_{key}")
+        os.makedirs(run_dir, exist_ok=True)
+
+    print(f"  {n_src}x{n_tgt} in {n_tiles} tiles of {rows}x{cols} (max pairs {max_pairs})")
+
+    def tile_path(i0, j0):
+        return os.path.join(run_dir, f"tile_{i0}_{j0}.json") if run_dir else None
+
+    def fetch_tile(origin):
+        i0, j0 = origin
+        values, status = fetch_block(base_url, sources[i0:i0 + rows], targets[j0:j0 + cols],
+                                     date_time, max_pairs, label, backend, stop)
+        path = tile_path(i0, j0)
+        # Tiles with failed cells are not checkpointed, so a rerun retries them
+        if path and (status <= CELL_NO_ROUTE).all():
+            _write_json_atomic(path, values.tolist())
+        return values, status
+
+    time_s, distance_km, status_out = _output_arrays(out, (n_src, n_tgt))
+
+    def place(origin, values, status=None):
+        i0, j0 = origin
+        values = np.asarray(values, dtype=np.float64)
+        if status is None:
+            status = np.where(np.isnan(values[:, :, 0]), CELL_NO_ROUTE, CELL_OK)
+        cells = np.s_[i0:i0 + values.shape[0], j0:j0 + values.shape[1]]
+        time_s[cells] = values[:, :, 0]
+        distance_km[cells] = values[:, :, 1]
+        status_out[cells] = status
+
+    pending = []
+    resumed = 0
+    for i0 in range(0, n_src, rows):
+        for j0 in range(0, n_tgt, cols):
+            path = tile_path(i0, j0)
+            if path and os.path.exists(path):
+                with open(path) as f:
+                    place((i0, j0), json.load(f))
+                resumed += 1
+            else:
+                pending.append((i0, j0))
+
+    if resumed:
+        print(f"  {resumed}/{n_tiles} tiles loaded from checkpoint")
+
+    done = resumed
+    failed = {}
+    for k, (values, status) in iter_completed(fetch_tile, pending, base_url):
+        place(pending[k], values, status)
+        for code, count in zip(*np.unique(status[status > CELL_NO_ROUTE], return_counts=True)):
+            failed[CELL_STATUS[code]] = failed.get(CELL_STATUS[code], 0) + int(count)
+        done += 1
+        if done % 50 == 0 or done == n_tiles:
+            print(f"  [{label}] tiles {done}/{n_tiles}")
+
+    if failed:
+        print(f"  ⚠️ [{label}] cells left null after splitting: "
+              + ", ".join(f"{reason} {count:,}" for reason, count in failed.items())
+              + " (not checkpointed, retried on the next run)")
+    elif run_dir:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    return time_s, distance_km, status_out
 
-    print("\nCalling matrix 2025...")
-    m2025 = call_matrix(BASE_2025, locs)
-    df2025 = matrix_to_long(m2025, 2025)
-    df2025.to_csv(MATRIX_2025_CSV, index=False)
-    print(f"✅ {MATRIX_2025_CSV} saved")
 
-    df = df2018.merge(
-        df2025[["src", "dst", "time_s", "distance_km"]],
-        on=["src", "dst"],
-        suffixes=("_2018", "_2025")
-    )
+def _cell_pair(cell) -> list:
+    """[time, distance] of a matrix cell, NaN for unreachable pairs."""
+    if cell is None or cell.get("time") is None:
+        return [np.nan, np.nan]
+    return [cell.get("time"), cell.get("distance")]
 
-    df["delta_time_s"] = df["time_s_2025"] - df["time_s_2018"]
-    df["delta_distance_km"] = df["distance_km_2025"] - df["distance_km_2018"]
-    df["pct_time"] = (df["delta_time_s"] / df["time_s_2018"]) * 100
-    df["pct_distance"] = (df["delta_distance_km"] / df["distance_km_2018"]) * 100
 
-    df.to_csv(MATRIX_DELTA_CSV, index=False)
-    print(f"✅ {MATRIX_DELTA_CSV} saved")
+def matrix_to_arrays(m: list) -> tuple:
+    """Convert a call_matrix result into (time_s, distance_km) float32 arrays."""
+    values = np.array([[_cell_pair(c) for c in row] for row in m], dtype=np.float64)
+    return values[:, :, 0].astype(np.float32), values[:, :, 1].astype(np.float32)
+
+
+def compute_matrix(base_url: str, locs: list[dict], label: str, tiled: bool = False,
+                   max_pairs: int | None = None, checkpoint_dir: str | None = MATRIX_TILES_DIR,
+                   out: tuple | None = None, date_time: str | None = None, backend: str = "valhalla",
+                   stop: threading.Event | None = None) -> tuple:
+    """
+    (time_s, distance_km, status) for locs x locs: a single request when it
+    fits the engine limit, tiled otherwise (or when forced).
+    """
+    if max_pairs is None:
+        max_pairs = max_matrix_pairs(base_url)
+    if tiled or len(locs) * len(locs) > max_pairs:
+        return call_matrix_tiled(base_url, locs, locs, max_pairs=max_pairs,
+                                 checkpoint_dir=checkpoint_dir, label=label, out=out,
+                                 date_time=date_time, backend=backend, stop=stop)
+
+    values, status = fetch_block(base_url, locs, locs, date_time, max_pairs, label, backend, stop)
+    time_s, distance_km, status_out = _output_arrays(out, status.shape)
+    time_s[:] = values[:, :, 0]
+    distance_km[:] = values[:, :, 1]
+    status_out[:] = status
+    return time_s, distance_km, status_out
+
+
+def point_changes(old, ids, lat, lon) -> dict:
+    """
+    Compare a new point set with the one a store was computed on, by id and
+    coordinates. Returns new/old indices of unchanged points, new indices of
+    points needing fresh rows and columns, and the added/moved/removed ids.
+    """
+    ids = np.asarray(ids)
+    old_pos = {int(p): i for i, p in enumerate(old.ids)}
+    keep_new, keep_old, fresh, added, moved = [], [], [], [], []
+    for i, p in enumerate(ids):
+        k = old_pos.pop(int(p), None)
+        if k is None:
+            added.append(int(p))
+            fresh.append(i)
+        elif old.lat[k] != lat[i] or old.lon[k] != lon[i]:
+            moved.append(int(p))
+            fresh.append(i)
+        else:
+            keep_new.append(i)
+            keep_old.append(k)
+    return {
+        "keep_new": np.array(keep_new, dtype=np.int64),
+        "keep_old": np.array(keep_old, dtype=np.int64),
+        "fresh": np.array(fresh, dtype=np.int64),
+        "added": added,
+        "moved": moved,
+        "removed": sorted(old_pos),
+    }
+
+
+def update_matrix(base_url: str, old, changes: dict, locs: list[dict], label: str,
+                  max_pairs: int | None = None, checkpoint_dir: str | None = MATRIX_TILES_DIR,
+                  out: tuple | None = None, backend: str = "valhalla",
+                  stop: threading.Event | None = None) -> tuple:
+    """
+    Fill out=(time_s, distance_km[, status]) for the new point set from an
+    old store: cells between unchanged points are copied, and only fresh x
+    all plus unchanged x fresh are requested from the engine.
+    """
+    n = len(locs)
+    time_s, distance_km, status = out = _output_arrays(out, (n, n))
+    keep_new, keep_old, fresh = changes["keep_new"], changes["keep_old"], changes["fresh"]
+
+    for r0 in range(0, len(keep_new), COPY_BLOCK_ROWS):
+        rows_new = keep_new[r0:r0 + COPY_BLOCK_ROWS]
+        rows_old = keep_old[r0:r0 + COPY_BLOCK_ROWS]
+        t = np.asarray(old.time_s[rows_old])[:, keep_old]
+        time_s[rows_new[:, None], keep_new] = t
+        distance_km[rows_new[:, None], keep_new] = np.asarray(old.distance_km[rows_old])[:, keep_old]
+        status[rows_new[:, None], keep_new] = (
+            np.asarray(old.status[rows_old])[:, keep_old] if old.status is not None
+            else np.where(np.isnan(t), CELL_NO_ROUTE, CELL_OK))
+
+    if len(fresh) == 0:
+        return out
+
+    fresh_locs = [locs[i] for i in fresh]
+    print(f"  [{label}] {len(fresh)} fresh rows x {len(locs)} + {len(keep_new)} x {len(fresh)} fresh columns")
+    t, d, st = call_matrix_tiled(base_url, fresh_locs, locs, max_pairs=max_pairs,
+                                 checkpoint_dir=checkpoint_dir, label=f"{label}_rows", backend=backend,
+                                 stop=stop)
+    time_s[fresh] = t
+    distance_km[fresh] = d
+    status[fresh] = st
+    if len(keep_new):
+        t, d, st = call_matrix_tiled(base_url, [locs[i] for i in keep_new], fresh_locs, max_pairs=max_pairs,
+                                     checkpoint_dir=checkpoint_dir, label=f"{label}_cols", backend=backend,
+                                     stop=stop)
+        time_s[keep_new[:, None], fresh] = t
+        distance_km[keep_new[:, None], fresh] = d
+        status[keep_new[:, None], fresh] = st
+    return out
+
+
+def _smallest_cells(values: np.ndarray, k: int) -> np.ndarray:
+    """Flat indices of the k smallest non-NaN values, ascending (ties by position)."""
+    flat = np.asarray(values).ravel()
+    valid = np.flatnonzero(~np.isnan(flat))
+    if len(valid) > k:
+        valid = valid[np.argpartition(flat[valid], k - 1)[:k]]
+    return valid[np.lexsort((valid, flat[valid]))]
+
+
+def print_summary(m2018, m2025) -> None:
+    ids = m2018.ids
+    n = m2018.n
+    delta_t = m2025.time_s.astype(np.float64) - m2018.time_s
+    delta_d = (np.round(m2025.distance_km.astype(np.float64), 3)
+               - np.round(m2018.distance_km.astype(np.float64), 3))
 
     print("\n" + "="*60)
     print("SUMMARY")
     print("="*60)
-    print(f"Total OD pairs: {len(df)}")
-    print(f"Null cells 2018: {df['time_s_2018'].isna().sum()}")
-    print(f"Null cells 2025: {df['time_s_2025'].isna().sum()}")
+    print(f"Total OD pairs: {n * n}")
+    print(f"Null cells 2018: {int(np.isnan(m2018.time_s).sum())}")
+    print(f"Null cells 2025: {int(np.isnan(m2025.time_s).sum())}")
+    for year, store in ((2018, m2018), (2025, m2025)):
+        failed = status_counts(store)
+        if failed:
+            print(f"⚠️ Failed requests left null in {year}: "
+                  + ", ".join(f"{name} {count:,}" for name, count in failed.items()))
 
-    best_time = df.dropna(subset=["delta_time_s"]).sort_values("delta_time_s").head(10)
-    best_dist = df.dropna(subset=["delta_distance_km"]).sort_values("delta_distance_km").head(10)
+    def table(flat_idx, cols):
+        i, j = np.divmod(flat_idx, n)
+        data = {"src": ids[i], "dst": ids[j]}
+        for name, arr in cols.items():
+            data[name] = np.asarray(arr)[i, j]
+        return pd.DataFrame(data).to_string(index=False)
+
+    best_time = _smallest_cells(delta_t, 10)
+    best_dist = _smallest_cells(delta_d, 10)
 
     print("\nTop 10 FASTER in 2025 (most negative delta_time_s):")
-    print(best_time[["src", "dst", "time_s_2018", "time_s_2025", "delta_time_s"]].to_string(index=False))
+    print(table(best_time, {"time_s_2018": m2018.time_s, "time_s_2025": m2025.time_s,
+                            "delta_time_s": delta_t}))
 
     print("\nTop 10 SHORTER in 2025 (most negative delta_distance_km):")
-    print(best_dist[["src", "dst", "distance_km_2018", "distance_km_2025", "delta_distance_km"]].to_string(index=False))
+    print(table(best_dist, {"distance_km_2018": np.round(m2018.distance_km.astype(np.float64), 3),
+                            "distance_km_2025": np.round(m2025.distance_km.astype(np.float64), 3),
+                            "delta_distance_km": delta_d}))
+
+
+def time_dependent(base_url: str, backend: str = "valhalla") -> bool:
+    """
+    Whether an engine's matrix can change with the departure time. Valhalla
+    ignores date_time in matrices when max_timedep_distance_matrix is 0 in
+    its valhalla.json; an engine without a readable config is assumed to
+    honour it. The local graph has no time-dependent speeds.
+    """
+    if backend == "local":
+        return False
+    limit = service_limits(base_url, costing=None).get("max_timedep_distance_matrix")
+    return limit is None or float(limit) > 0
+
+
+def plan_sweep(engines: list[str], buckets: list[str], backend: str = "valhalla") -> dict:
+    """
+    {base_url: sources}, where sources[b] is the bucket whose matrix bucket b
+    copies (b itself when it has to be computed). Only engines that cannot
+    be time-dependent copy: for them every bucket is the first one.
+    """
+    return {base: list(range(len(buckets))) if time_dependent(base, backend) else [0] * len(buckets)
+            for base in engines}
+
+
+def sweep(locs: list[dict], stores: dict, buckets: list[str], sources: dict, tiled=False,
+          max_pairs=None, checkpoint_dir=MATRIX_TILES_DIR, backend="valhalla") -> None:
+    """
+    Fill stacked (bucket, N, N) stores {base_url: (year, store)}: buckets
+    planned by plan_sweep() are computed, interleaved across engines, and
+    the rest are copied from their source bucket.
+    """
+    # Bucket-major order keeps both engines busy at the same time
+    todo = [(base, b) for b in range(len(buckets)) for base in stores if sources[base][b] == b]
+    total = len(buckets) * len(stores)
+    print(f"  {len(todo)} of {total} engine x bucket matrices to compute "
+          f"({total - len(todo)} copied on engines that ignore the departure time)")
+
+    def run(base, b, stop):
+        year, store = stores[base]
+        compute_matrix(base, locs, f"{year}_{buckets[b].replace(':', '')}", tiled, max_pairs, checkpoint_dir,
+                       (store.time_s[b], store.distance_km[b], store.status[b]), date_time=buckets[b],
+                       backend=backend, stop=stop)
+        print(f"  [{year}] {buckets[b]} done")
+
+    run_engines(run, todo, len(stores))
+
+    for base, (_, store) in stores.items():
+        for b, src in enumerate(sources[base]):
+            if src != b:
+                store.time_s[b] = store.time_s[src]
+                store.distance_km[b] = store.distance_km[src]
+                store.status[b] = store.status[src]
+
+
+def print_sweep_summary(s2018, s2025, buckets: list[str]) -> None:
+    print("\n" + "=" * 60)
+    print("TIME-OF-DAY SWEEP (mean travel time, s)")
+    print("=" * 60)
+    rows = []
+    for b, label in enumerate(buckets):
+        t18 = np.asarray(s2018.time_s[b], dtype=np.float64)
+        t25 = np.asarray(s2025.time_s[b], dtype=np.float64)
+        rows.append({
+            "departure": label,
+            "mean_2018": np.nanmean(t18),
+            "mean_2025": np.nanmean(t25),
+            "mean_delta": np.nanmean(t25 - t18),
+            "same_as_2018": s2018.meta["bucket_source"][b],
+            "same_as_2025": s2025.meta["bucket_source"][b],
+        })
+    df = pd.DataFrame(rows)
+    for col in ("same_as_2018", "same_as_2025"):
+        df[col] = [buckets[src] if src != b else "" for b, src in enumerate(df[col])]
+    print(df.round(1).to_string(index=False))
+
+
+def main_sweep(pts: pd.DataFrame, locs: list[dict], times: list[str], date: str,
+               tiled=False, max_pairs=None, checkpoint_dir=MATRIX_TILES_DIR, backend="valhalla") -> None:
+    buckets = [f"{date}T{t}" for t in times]
+    lat = pts["lat"].to_numpy(dtype=float)
+    lon = pts["lon"].to_numpy(dtype=float)
+    sources = plan_sweep([BASE_2018, BASE_2025], buckets, backend)
+    for year, base in ((2018, BASE_2018), (2025, BASE_2025)):
+        how = ("time-dependent, every bucket computed" if time_dependent(base, backend)
+               else "departure time ignored, first bucket computed and copied")
+        print(f"  [{year}] {base}: {how}")
+
+    stores = {}
+    for base, path, year in ((BASE_2018, SWEEP_2018_BIN, 2018), (BASE_2025, SWEEP_2025_BIN, 2025)):
+        stores[base] = (year, create_matrix(
+            path, pts["id"], lat, lon, year, extra_shape=(len(buckets),),
+            extra_meta={"engine": base, "engine_id": _engine_id(base, backend), "backend": backend,
+                        "buckets": buckets, "bucket_source": sources[base]}))
+
+    new = [store for _, store in stores.values()]
+    try:
+        with metrics.stage("sweep"):
+            sweep(locs, stores, buckets, sources, tiled, max_pairs, checkpoint_dir, backend)
+    except Exception:
+        discard_matrices(new)
+        raise
+    check_failed_share(new)
+
+    committed = []
+    for year, store in stores.values():
+        committed.append(commit_matrix(store))
+        print(f"✅ {store.final_path} saved ({len(buckets)} x {store.n} x {store.n})")
+    print_sweep_summary(*committed, buckets)
+
+
+def _engine_id(base_url: str, backend: str = "valhalla") -> str:
+    """Identity of whatever computes the matrix, so stores from another backend are never merged."""
+    eid = engine_id(base_url)
+    return f"local-{eid}" if backend == "local" else eid
+
+
+def _previous_store(path: str, base_url: str, backend: str = "valhalla"):
+    """Existing store usable for an incremental update, or None (with the reason)."""
+    if not os.path.exists(path):
+        print(f"  {path} not found, computing from scratch")
+        return None
+    old = load_matrix(path)
+    if old.meta.get("engine_id") not in (None, _engine_id(base_url, backend)):
+        print(f"  {path} was computed on other tiles, computing from scratch")
+        return None
+    return old
+
+
+def run_engines(fn, jobs: list, workers: int) -> None:
+    """
+    Call fn(*job, stop=stop) for every job on a pool of workers (one per
+    engine). The first job to fail sets stop, so the other engines' work
+    ends at its next request instead of running to completion, and that
+    failure is raised once every job has returned.
+    """
+    stop = threading.Event()
+
+    def run(job):
+        try:
+            return fn(*job, stop=stop)
+        except Exception:
+            stop.set()
+            raise
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run, job) for job in jobs]
+    errors = [fut.exception() for fut in futures if fut.exception() is not None]
+    if errors:
+        # The failure itself, not the MatrixRunStopped it caused elsewhere
+        raise next((e for e in errors if not isinstance(e, MatrixRunStopped)), errors[0])
+
+
+def discard_matrices(stores: list) -> None:
+    """Delete uncommitted stores from create_matrix; the committed files are left alone."""
+    for store in stores:
+        if os.path.exists(store.path):
+            os.remove(store.path)
+
+
+def check_failed_share(stores: list) -> None:
+    """
+    Refuse a run where more than MATRIX_MAX_FAILED_SHARE of any new store's
+    cells failed: all the uncommitted stores are discarded, so the previous
+    files stay in place and still match each other.
+    """
+    shares = {store.final_path: sum(status_counts(store).values()) / max(store.status.size, 1)
+              for store in stores}
+    bad = {path: share for path, share in shares.items() if share > MATRIX_MAX_FAILED_SHARE}
+    if not bad:
+        return
+    discard_matrices(stores)
+    for path, share in bad.items():
+        print(f"⚠️  {path}: {share:.1%} of cells failed")
+    raise RuntimeError(f"more than {MATRIX_MAX_FAILED_SHARE:.0%} of cells failed in {', '.join(bad)}; "
+                       f"nothing saved, the previous stores are kept")
+
+
+def main(tiled=False, max_pairs=None, checkpoint_dir=MATRIX_TILES_DIR, csv=False, incremental=False,
+         backend="valhalla", sweep_times=None, sweep_date=SWEEP_DATE):
+    with metrics.stage("read_points"):
+        pts = pd.read_csv(POINTS_CSV)
+    locs = [{"lat": float(r.lat), "lon": float(r.lon)} for r in pts.itertuples(index=False)]
+    if backend == "local" and max_pairs is None:
+        # No request size limit offline: one many-to-many search per run
+        max_pairs = max(1, len(locs) ** 2)
+    lat = pts["lat"].to_numpy(dtype=float)
+    lon = pts["lon"].to_numpy(dtype=float)
+
+    print(f"Loaded {len(locs)} points from {POINTS_CSV}")
+    if backend == "valhalla":
+        check_snapshots([BASE_2018, BASE_2025])
+    print(f"Bounding box coverage check: lat=[{pts['lat'].min():.4f}, {pts['lat'].max():.4f}], lon=[{pts['lon'].min():.4f}, {pts['lon'].max():.4f}]")
+
+    if sweep_times:
+        return main_sweep(pts, locs, sweep_times, sweep_date, tiled, max_pairs, checkpoint_dir, backend)
+
+    phash = points_hash(pts["id"], lat, lon)
+    jobs = []
+    for base, path, year in ((BASE_2018, MATRIX_2018_BIN, 2018), (BASE_2025, MATRIX_2025_BIN, 2025)):
+        old = _previous_store(path, base, backend) if incremental else None
+        if old is not None and old.meta["points_hash"] == phash:
+            jobs.append((path, year, old, None))
+            continue
+        changes = None
+        if old is not None:
+            changes = point_changes(old, pts["id"], lat, lon)
+            print(f"  [{year}] {len(changes['added'])} added, {len(changes['moved'])} moved, "
+                  f"{len(changes['removed'])} removed, {len(changes['keep_new'])} unchanged")
+        # Results go straight into memory-mapped stores, tile by tile
+        store = create_matrix(path, pts["id"], lat, lon, year,
+                              extra_meta={"engine": base, "engine_id": _engine_id(base, backend), "backend": backend})
+        jobs.append((path, year, store, (base, old, changes)))
+
+    def run(year, store, base, old, changes, stop):
+        out = (store.time_s, store.distance_km, store.status)
+        with metrics.stage(f"matrix_{year}"):
+            if old is None:
+                return compute_matrix(base, locs, str(year), tiled, max_pairs, checkpoint_dir, out,
+                                      backend=backend, stop=stop)
+            return update_matrix(base, old, changes, locs, str(year), max_pairs, checkpoint_dir, out, backend,
+                                 stop)
+
+    # Both engines work at the same time; tiles of each year share the client pool
+    print("\nCalling matrix 2018 and 2025...")
+    new = [store for _, _, store, work in jobs if work]
+    try:
+        run_engines(run, [(year, store, *work) for _, year, store, work in jobs if work], 2)
+    except Exception:
+        # An unreachable engine aborts the run (both years) before anything is committed
+        discard_matrices(new)
+        raise
+    check_failed_share(new)
+
+    stores = []
+    for path, _, store, work in jobs:
+        if work is None:
+            print(f"✅ {path} unchanged")
+            stores.append(store)
+        else:
+            with metrics.stage("commit_store"):
+                stores.append(commit_matrix(store))
+            print(f"✅ {path} saved")
+    m2018, m2025 = stores
+    if _engines:
+        print("\nMatrix throughput:")
+        print_throughput()
+    report(m2018, m2025, csv)
+
+
+def report(m2018, m2025, csv=False) -> None:
+    if csv:
+        with metrics.stage("export_csv"):
+            export_csv(m2018, m2025)
+        print(f"✅ {MATRIX_2018_CSV}, {MATRIX_2025_CSV}, {MATRIX_DELTA_CSV} saved")
+
+    with metrics.stage("summary"):
+        print_summary(m2018, m2025)
+
+
+def main_delta(csv=False) -> None:
+    """Summary (and CSVs) of the stores from the last run, without calling an engine."""
+    m2018, m2025 = load_matrix(MATRIX_2018_BIN), load_matrix(MATRIX_2025_BIN)
+    if m2018.meta["points_hash"] != m2025.meta["points_hash"]:
+        raise ValueError(f"{MATRIX_2018_BIN} and {MATRIX_2025_BIN} were computed on different points; "
+                         f"rerun the matrix step")
+    report(m2018, m2025, csv)
+
+
+def run(args) -> None:
+    """Entry point for parsed cli.matrix_arguments() flags."""
+    sweep_times = None
+    if args.sweep is not None:
+        sweep_times = args.sweep or list(SWEEP_TIMES)
+    with metrics.session(args):
+        main(tiled=args.tiled, max_pairs=args.max_pairs, checkpoint_dir=args.checkpoint_dir, csv=args.csv,
+             incremental=args.incremental, backend=args.backend, sweep_times=sweep_times,
+             sweep_date=args.sweep_date)
+
+
+def run_delta(args) -> None:
+    """Entry point for parsed cli.delta_arguments() flags."""
+    with metrics.session(args):
+        main_delta(csv=args.csv)
 
 
 if __name__ == "__main__":
-    main()
+    import cli
+
+    parser = argparse.ArgumentParser(description="Compute 2018/2025 matrices and their delta")
+    cli.matrix_arguments(parser)
+    run(parser.parse_args())
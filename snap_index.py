@@ -0,0 +1,248 @@
+"""
+Offline point snapping against a snapshot's car-accessible road segments.
+
+Segments are the undirected edges of the local_graph.py graph (same highway
+classes and access rules), bucketed into a uniform grid in a local metric
+projection and cached next to the graph. snap() projects a whole batch of
+points onto every segment in the grid cells within the search radius and
+keeps the closest one, returning the same snapped position /locate would
+(nearest point on the nearest road) plus the OSM way it lies on.
+"""
+import argparse
+import json
+import math
+import os
+
+import numpy as np
+
+from config import VALHALLA_2018, VALHALLA_2025, LOCAL_GRAPH_DIRS, SNAP_CELL_M
+from local_graph import M_PER_DEG_LAT, graph_for, haversine_m, require_extract
+
+INDEX_VERSION = 1
+ARRAYS = ("seg_a", "seg_b", "seg_way", "cell_ptr", "cell_seg")
+
+
+class SnapIndex:
+    """Grid of segment ids over the graph nodes; arrays may be memory-mapped."""
+
+    def __init__(self, meta: dict, arrays: dict, lat, lon):
+        self.meta = meta
+        self.seg_a = arrays["seg_a"]
+        self.seg_b = arrays["seg_b"]
+        self.seg_way = arrays["seg_way"]
+        self.cell_ptr = arrays["cell_ptr"]
+        self.cell_seg = arrays["cell_seg"]
+        self.node_x, self.node_y = self.project(lat, lon)
+
+    def project(self, lat, lon) -> tuple[np.ndarray, np.ndarray]:
+        """Metres east/north of the grid origin."""
+        m = self.meta
+        x = (np.asarray(lon, dtype=np.float64) - m["lon0"]) * M_PER_DEG_LAT * m["kx"]
+        y = (np.asarray(lat, dtype=np.float64) - m["lat0"]) * M_PER_DEG_LAT
+        return x, y
+
+    def unproject(self, x, y) -> tuple[np.ndarray, np.ndarray]:
+        m = self.meta
+        return y / M_PER_DEG_LAT + m["lat0"], x / (M_PER_DEG_LAT * m["kx"]) + m["lon0"]
+
+    def nearest(self, lat, lon, max_snap_m: float, allowed: np.ndarray | None = None) -> tuple:
+        """
+        Closest segment to each point within max_snap_m, among the allowed
+        ones (boolean mask over segment ids; all when None). Returns (seg, t,
+        slat, slon, snap_m): the segment id, the snapped position as a
+        fraction of the way from seg_a to seg_b, and that position;
+        -1 / NaN where nothing is in range.
+        """
+        m = self.meta
+        cell = m["cell_m"]
+        px, py = self.project(lat, lon)
+        n = len(px)
+        reach = int(math.ceil(max_snap_m / cell))
+
+        # Every (point, nearby cell) pair, then every segment listed in that cell
+        cx = np.floor(px / cell).astype(np.int64)
+        cy = np.floor(py / cell).astype(np.int64)
+        offsets = np.arange(-reach, reach + 1)
+        qx = (cx[:, None, None] + offsets[None, :, None]).repeat(len(offsets), axis=2).reshape(n, -1)
+        qy = (cy[:, None, None] + offsets[None, None, :]).repeat(len(offsets), axis=1).reshape(n, -1)
+        inside = (qx >= 0) & (qx < m["nx"]) & (qy >= 0) & (qy < m["ny"])
+        point = np.broadcast_to(np.arange(n)[:, None], qx.shape)[inside]
+        cells = (qy * m["nx"] + qx)[inside]
+
+        starts = self.cell_ptr[cells]
+        counts = self.cell_ptr[cells + 1] - starts
+        point = np.repeat(point, counts)
+        first = np.cumsum(counts) - counts
+        seg = np.asarray(self.cell_seg)[np.repeat(starts - first, counts) + np.arange(counts.sum())]
+        if allowed is not None:
+            point, seg = point[allowed[seg]], seg[allowed[seg]]
+
+        ax, ay = self.node_x[self.seg_a[seg]], self.node_y[self.seg_a[seg]]
+        dx = self.node_x[self.seg_b[seg]] - ax
+        dy = self.node_y[self.seg_b[seg]] - ay
+        len2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.clip(((px[point] - ax) * dx + (py[point] - ay) * dy) / len2, 0.0, 1.0)
+        t = np.where(len2 > 0, t, 0.0)
+        sx = ax + t * dx
+        sy = ay + t * dy
+        d2 = (px[point] - sx) ** 2 + (py[point] - sy) ** 2
+
+        # Closest candidate per point (ties by segment id, so results are stable)
+        order = np.lexsort((seg, d2, point))
+        point, first_of_point = np.unique(point[order], return_index=True)
+        best = order[first_of_point]
+
+        out_seg = np.full(n, -1, dtype=np.int64)
+        out_t = np.full(n, np.nan)
+        slat = np.full(n, np.nan)
+        slon = np.full(n, np.nan)
+        out_seg[point], out_t[point] = seg[best], t[best]
+        slat[point], slon[point] = self.unproject(sx[best], sy[best])
+        snap_m = haversine_m(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64),
+                              slat, slon)
+        far = ~(snap_m <= max_snap_m)
+        out_seg[far] = -1
+        out_t[far] = slat[far] = slon[far] = snap_m[far] = np.nan
+        return out_seg, out_t, slat, slon, snap_m
+
+    def snap(self, lat, lon, max_snap_m: float) -> tuple:
+        """
+        Nearest road position for each point within max_snap_m.
+        Returns (slat, slon, snap_m, way_id); NaN / -1 where nothing is in range.
+        """
+        seg, _, slat, slon, snap_m = self.nearest(lat, lon, max_snap_m)
+        way = np.where(seg >= 0, np.asarray(self.seg_way)[np.maximum(seg, 0)], -1)
+        return slat, slon, snap_m, way
+
+
+def build_index(graph, cell_m: float = SNAP_CELL_M) -> tuple[dict, dict]:
+    """Meta and arrays of a snapping grid over the graph's undirected segments."""
+    u = np.repeat(np.arange(graph.n_nodes), np.diff(graph.indptr))
+    v = np.asarray(graph.indices, dtype=np.int64)
+    a, b = np.minimum(u, v), np.maximum(u, v)
+    _, keep = np.unique(a * graph.n_nodes + b, return_index=True)
+    seg_a, seg_b = a[keep], b[keep]
+    seg_way = np.asarray(graph.way_id)[keep]
+
+    lat, lon = np.asarray(graph.lat), np.asarray(graph.lon)
+    meta = {
+        "version": INDEX_VERSION,
+        "graph_created": graph.meta["created"],
+        "cell_m": cell_m,
+        "lat0": float(lat.min()),
+        "lon0": float(lon.min()),
+        "kx": math.cos(math.radians(float(lat.mean()))),
+    }
+    x = (lon - meta["lon0"]) * M_PER_DEG_LAT * meta["kx"]
+    y = (lat - meta["lat0"]) * M_PER_DEG_LAT
+    meta["nx"] = int(x.max() // cell_m) + 1
+    meta["ny"] = int(y.max() // cell_m) + 1
+
+    # Register each segment in every cell its bounding box touches
+    x0 = (np.minimum(x[seg_a], x[seg_b]) // cell_m).astype(np.int64)
+    x1 = (np.maximum(x[seg_a], x[seg_b]) // cell_m).astype(np.int64)
+    y0 = (np.minimum(y[seg_a], y[seg_b]) // cell_m).astype(np.int64)
+    y1 = (np.maximum(y[seg_a], y[seg_b]) // cell_m).astype(np.int64)
+    w, h = x1 - x0 + 1, y1 - y0 + 1
+    counts = w * h
+    seg = np.repeat(np.arange(len(seg_a)), counts)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    cells = (y0[seg] + k // w[seg]) * meta["nx"] + (x0[seg] + k % w[seg])
+
+    order = np.argsort(cells, kind="stable")
+    cell_ptr = np.zeros(meta["nx"] * meta["ny"] + 1, dtype=np.int64)
+    np.add.at(cell_ptr, cells + 1, 1)
+    arrays = {
+        "seg_a": seg_a.astype(np.int32),
+        "seg_b": seg_b.astype(np.int32),
+        "seg_way": seg_way,
+        "cell_ptr": np.cumsum(cell_ptr),
+        "cell_seg": seg[order].astype(np.int32),
+    }
+    meta["segments"] = int(len(seg_a))
+    return meta, arrays
+
+
+_indexes = {}
+
+
+def index_for(base_url: str, cell_m: float = SNAP_CELL_M) -> SnapIndex:
+    """Snapping index of an engine's extract, cached in its graph directory."""
+    idx = _indexes.get(base_url)
+    if idx is not None:
+        return idx
+    graph = graph_for(base_url)
+    index_dir = os.path.join(LOCAL_GRAPH_DIRS[base_url], "snap")
+    meta_path = os.path.join(index_dir, "meta.json")
+
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if (meta.get("version") != INDEX_VERSION or meta.get("cell_m") != cell_m
+                or meta.get("graph_created") != graph.meta["created"]):
+            meta = None
+    if meta is None:
+        meta, arrays = build_index(graph, cell_m)
+        os.makedirs(index_dir, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(index_dir, f"{name}.npy"), arrays[name])
+        tmp = f"{meta_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, meta_path)
+
+    arrays = {name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode="r") for name in ARRAYS}
+    idx = _indexes[base_url] = SnapIndex(meta, arrays, graph.lat, graph.lon)
+    return idx
+
+
+def compare_snapshots(lat, lon, max_snap_m: float) -> dict:
+    """
+    Snap the same points against 2018 and 2025. road_changed marks points
+    whose nearest road differs (another OSM way, or no road in range in one year).
+    Both extracts are checked before either index is built.
+    """
+    for base in (VALHALLA_2018, VALHALLA_2025):
+        require_extract(base)
+    s18 = index_for(VALHALLA_2018).snap(lat, lon, max_snap_m)
+    s25 = index_for(VALHALLA_2025).snap(lat, lon, max_snap_m)
+    return {
+        "snap_m_2018": s18[2],
+        "snap_m_2025": s25[2],
+        "way_2018": s18[3],
+        "way_2025": s25[3],
+        "road_changed": s18[3] != s25[3],
+    }
+
+
+if __name__ == "__main__":
+    import time
+
+    import pandas as pd
+
+    from config import POINTS_CSV
+
+    parser = argparse.ArgumentParser(description="Build snapping indexes and check points against both snapshots")
+    parser.add_argument("--points", default=POINTS_CSV, help=f"Points to check (default: {POINTS_CSV})")
+    parser.add_argument("--max-snap-m", type=float, default=40, help="Maximum snap distance in meters (default: 40)")
+    args = parser.parse_args()
+
+    for base in (VALHALLA_2018, VALHALLA_2025):
+        require_extract(base)
+    for base in (VALHALLA_2018, VALHALLA_2025):
+        idx = index_for(base)
+        print(f"✅ {LOCAL_GRAPH_DIRS[base]}/snap: {idx.meta['segments']:,} segments, "
+              f"{idx.meta['nx']}x{idx.meta['ny']} cells of {idx.meta['cell_m']} m")
+
+    pts = pd.read_csv(args.points)
+    t0 = time.perf_counter()
+    cmp = compare_snapshots(pts["lat"].to_numpy(), pts["lon"].to_numpy(), args.max_snap_m)
+    elapsed = time.perf_counter() - t0
+    changed = pts.assign(**cmp)[cmp["road_changed"]]
+    print(f"Snapped {len(pts)} points against both snapshots in {elapsed * 1000:.0f} ms")
+    print(f"Points on different roads in 2018 and 2025: {len(changed)}")
+    if len(changed):
+        print(changed[["id", "lat", "lon", "snap_m_2018", "snap_m_2025", "way_2018", "way_2025"]]
+              .to_string(index=False))
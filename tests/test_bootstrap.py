@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import bootstrap
+from bootstrap import VARIABLES, _Variable
+from matrix_store import save_matrix
+
+
+def _delta(n, seed):
+    """N x N deltas with ties, NaN cells and a NaN diagonal."""
+    rng = np.random.default_rng(seed)
+    d = rng.integers(-120, 120, size=(n, n)).astype(np.float64)
+    d[rng.random((n, n)) < 0.1] = np.nan
+    np.fill_diagonal(d, np.nan)
+    return d
+
+
+def _brute_force(d, w):
+    """Mean and median over the resampled matrix built explicitly, repeats included."""
+    idx = np.repeat(np.arange(len(w)), w.astype(np.int64))
+    cells = d[np.ix_(idx, idx)]
+    return np.nanmean(cells), np.nanmedian(cells)
+
+
+@pytest.mark.parametrize("band", [bootstrap.MEDIAN_BAND, 0.0, 0.5])
+def test_weighted_stats_match_resampled_matrix(band):
+    n = 30
+    d = _delta(n, seed=1)
+    var = _Variable(d, band)
+    rng = np.random.default_rng(2)
+    w = rng.multinomial(n, np.full(n, 1.0 / n), size=50).astype(np.float64)
+    w = np.vstack([np.ones(n), w])
+    mean, median = var.stats(w)
+    for k in range(len(w)):
+        ref_mean, ref_median = _brute_force(d, w[k])
+        assert mean[k] == pytest.approx(ref_mean, rel=1e-12)
+        assert median[k] == ref_median
+
+
+def _stores(tmp_path, n=25):
+    rng = np.random.default_rng(5)
+    ids = np.arange(100, 100 + n)
+    lat = 10.77 + rng.random(n) * 0.05
+    lon = 106.68 + rng.random(n) * 0.05
+    paths = []
+    for year, seed in ((2018, 3), (2025, 4)):
+        t = np.abs(_delta(n, seed)) * 10 + 60
+        dist = np.round(t / 400, 3)
+        path = str(tmp_path / f"matrix_{year}.bin")
+        save_matrix(path, ids, lat, lon, t, dist, year)
+        paths.append(path)
+    return paths
+
+
+def test_bootstrap_resamples_match_brute_force(tmp_path):
+    path_a, path_b = _stores(tmp_path)
+    bootstrap._init(path_a, path_b)
+    seed = np.random.SeedSequence(9)
+    samples = bootstrap._task(seed, 40)
+
+    # Same draws as _task, resampled by hand
+    n = bootstrap._variables[VARIABLES[0]].n
+    w = np.random.default_rng(np.random.SeedSequence(9)).multinomial(n, np.full(n, 1.0 / n), size=40)
+    deltas = bootstrap.delta_matrices(*(bootstrap.load_matrix(p) for p in (path_a, path_b)))
+    for k in range(len(w)):
+        ref = []
+        for name in VARIABLES:
+            ref.extend(_brute_force(deltas[name], w[k]))
+        np.testing.assert_allclose(samples[k], ref, rtol=1e-12)
+
+
+def test_bootstrap_does_not_depend_on_workers(tmp_path):
+    path_a, path_b = _stores(tmp_path)
+    one = bootstrap.bootstrap(path_a, path_b, resamples=250, seed=1, workers=1)
+    two = bootstrap.bootstrap(path_a, path_b, resamples=250, seed=1, workers=2)
+    assert one.equals(two)
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from delta_stream import DeltaStats, QuantileSketch, TOP_COLUMNS
+
+QUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+def _weight(sketch):
+    return sum(len(p) * 2 ** h for h, parts in enumerate(sketch.levels) for p in parts)
+
+
+def _rank_error(values, q, estimate):
+    """Distance in normalized rank between the estimate and the true q-quantile."""
+    s = np.sort(values)
+    lo = np.searchsorted(s, estimate, side="left") / len(s)
+    hi = np.searchsorted(s, estimate, side="right") / len(s)
+    return max(lo - q, q - hi, 0.0)
+
+
+def _chunks(rng, n_rows, chunk_rows):
+    """Delta chunks with nulls and many tied values, like store_chunks yields."""
+    t18 = rng.integers(60, 3600, n_rows).astype(np.float64)
+    t25 = t18 + rng.integers(-300, 300, n_rows)
+    t18[rng.random(n_rows) < 0.02] = np.nan
+    t25[rng.random(n_rows) < 0.02] = np.nan
+    dist = np.round(rng.normal(0, 0.5, n_rows), 3)
+    dist[np.isnan(t18) | np.isnan(t25)] = np.nan
+    full = {
+        "src": np.arange(n_rows) // 100,
+        "dst": np.arange(n_rows) % 100,
+        "time_s_2018": t18,
+        "time_s_2025": t25,
+        "delta_time_s": t25 - t18,
+        "delta_distance_km": dist,
+    }
+    return [{c: a[i:i + chunk_rows] for c, a in full.items()} for i in range(0, n_rows, chunk_rows)]
+
+
+def test_sketch_exact_until_compacted():
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=1001)
+    sketch = QuantileSketch(k=2000)
+    for part in np.array_split(values, 7):
+        sketch.update(part)
+    assert sketch.exact
+    for q in QUANTILES:
+        assert sketch.quantile(q) == np.quantile(values, q)
+    assert sketch.quantile(0.5) == np.median(values)
+
+
+@pytest.mark.parametrize("k", [64, 256])
+def test_sketch_compress_keeps_weight_and_rank(k):
+    rng = np.random.default_rng(k)
+    values = rng.lognormal(size=50_000)
+    sketch = QuantileSketch(k=k, seed=1)
+    for part in np.array_split(values, 97):
+        sketch.update(np.concatenate([part, [np.nan]]))
+    assert not sketch.exact
+    assert sketch.n == len(values)
+    assert _weight(sketch) == len(values)
+    assert all(sum(len(p) for p in parts) <= k for parts in sketch.levels)
+    # Worst rank error seen over 20 seeds is under 2/k
+    bound = 3 / k
+    for q in QUANTILES:
+        assert _rank_error(values, q, sketch.quantile(q)) <= bound
+
+
+def test_sketch_merge_matches_single_sketch():
+    rng = np.random.default_rng(3)
+    values = rng.normal(size=40_000)
+    parts = np.array_split(values, 8)
+    merged = QuantileSketch(k=128, seed=0)
+    for i, part in enumerate(parts):
+        s = QuantileSketch(k=128, seed=i + 1)
+        s.update(part)
+        merged.merge(s)
+    assert merged.n == len(values)
+    assert _weight(merged) == len(values)
+    bound = 3 / 128
+    for q in QUANTILES:
+        assert _rank_error(values, q, merged.quantile(q)) <= bound
+
+
+def _reference(chunks, top):
+    df = pd.DataFrame({c: np.concatenate([ch[c] for ch in chunks]) for c in chunks[0]})
+    valid = df.dropna(subset=["delta_time_s"])
+    faster = valid.sort_values("delta_time_s", kind="stable").head(top)
+    slower = valid.assign(neg=-valid["delta_time_s"]).sort_values("neg", kind="stable").head(top)
+    return df, faster[TOP_COLUMNS].reset_index(drop=True), slower[TOP_COLUMNS].reset_index(drop=True)
+
+
+@pytest.mark.parametrize("split", [None, 3])
+def test_delta_stats_matches_pandas(split):
+    chunks = _chunks(np.random.default_rng(7), 25_000, 4_000)
+    if split is None:
+        stats = DeltaStats(top=20)
+        for ch in chunks:
+            stats.update(ch)
+    else:
+        # Accumulators over consecutive chunk runs, merged in order
+        stats = DeltaStats(top=20)
+        for part in (chunks[:split], chunks[split:]):
+            s = DeltaStats(top=20)
+            for ch in part:
+                s.update(ch)
+            stats.merge(s)
+
+    df, faster, slower = _reference(chunks, 20)
+    summary = stats.summary()
+    assert summary["rows"] == len(df)
+    assert summary["null_2018_time"] == df["time_s_2018"].isna().sum()
+    assert summary["null_2025_time"] == df["time_s_2025"].isna().sum()
+    for col in ("delta_time_s", "delta_distance_km"):
+        assert summary[f"avg_{col}"] == pytest.approx(df[col].mean(), rel=1e-12)
+        assert summary[f"median_{col}"] == df[col].median()
+    pd.testing.assert_frame_equal(stats.top_frame(), faster, check_dtype=False)
+    pd.testing.assert_frame_equal(stats.top_frame(largest=True), slower, check_dtype=False)
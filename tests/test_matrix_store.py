@@ -0,0 +1,102 @@
+import json
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from matrix_store import (
+    ALIGN, CELL_STATUS, CELL_NO_ROUTE, CELL_OK, MAGIC,
+    commit_matrix, create_matrix, load_matrix, points_hash, read_meta, save_matrix, status_counts
+)
+
+TIMEOUT = CELL_STATUS.index("timeout")
+
+
+def _points(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(1, n + 1), 10.77 + rng.random(n) * 0.05, 106.68 + rng.random(n) * 0.05
+
+
+def _matrices(n, seed=0, extra_shape=()):
+    rng = np.random.default_rng(seed)
+    t = rng.uniform(60, 3600, extra_shape + (n, n)).astype(np.float32)
+    t[rng.random(t.shape) < 0.1] = np.nan
+    d = (t / 400).astype(np.float32)
+    return t, d
+
+
+def _read_raw(path):
+    """Header and arrays parsed by hand from the documented layout."""
+    with open(path, "rb") as f:
+        buf = f.read()
+    assert buf[:len(MAGIC)] == MAGIC
+    (hlen,) = struct.unpack("<I", buf[len(MAGIC):len(MAGIC) + 4])
+    meta = json.loads(buf[len(MAGIC) + 4:len(MAGIC) + 4 + hlen])
+    data_start = -(-(len(MAGIC) + 4 + hlen) // ALIGN) * ALIGN
+    arrays = {}
+    for name, spec in meta["arrays"].items():
+        assert (data_start + spec["offset"]) % ALIGN == 0
+        count = int(np.prod(spec["shape"]))
+        arrays[name] = np.frombuffer(buf, dtype=spec["dtype"], count=count,
+                                     offset=data_start + spec["offset"]).reshape(spec["shape"])
+    return meta, arrays
+
+@pytest.mark.parametrize("extra_shape", [(), (3,)], ids=["matrix", "buckets"])
+def test_create_commit_round_trip(tmp_path, extra_shape):
+    n = 17
+    ids, lat, lon = _points(n)
+    t, d = _matrices(n, extra_shape=extra_shape)
+    path = str(tmp_path / "m.bin")
+    with open(path, "wb") as f:
+        f.write(b"previous store")
+
+    store = create_matrix(path, ids, lat, lon, 2025, extra_meta={"engine_id": "abc"}, extra_shape=extra_shape)
+    # Filled tile by tile; the previous file stays in place until the commit
+    for r0 in range(0, n, 5):
+        store.time_s[..., r0:r0 + 5, :] = t[..., r0:r0 + 5, :]
+        store.distance_km[..., r0:r0 + 5, :] = d[..., r0:r0 + 5, :]
+        store.status[..., r0:r0 + 5, :] = np.where(np.isnan(t[..., r0:r0 + 5, :]), TIMEOUT, CELL_OK)
+    with open(path, "rb") as f:
+        assert f.read() == b"previous store"
+    assert os.path.exists(f"{path}.tmp")
+
+    committed = commit_matrix(store)
+    assert not os.path.exists(f"{path}.tmp")
+    meta, raw = _read_raw(path)
+    assert read_meta(path) == meta == committed.meta
+    assert meta["n"] == n and meta["snapshot"] == 2025 and meta["engine_id"] == "abc"
+    assert meta["points_hash"] == points_hash(ids, lat, lon)
+    expected = {"ids": ids, "lat": lat, "lon": lon, "time_s": t, "distance_km": d,
+                "status": np.where(np.isnan(t), TIMEOUT, CELL_OK)}
+    for mmap in (True, False):
+        loaded = load_matrix(path, mmap=mmap)
+        for name, want in expected.items():
+            np.testing.assert_array_equal(raw[name], want)
+            np.testing.assert_array_equal(getattr(loaded, name), want)
+    assert status_counts(committed) == {"timeout": int(np.isnan(t).sum())}
+
+
+def test_unfilled_cells_are_no_route(tmp_path):
+    ids, lat, lon = _points(4)
+    store = commit_matrix(create_matrix(str(tmp_path / "m.bin"), ids, lat, lon, 2018))
+    assert np.isnan(store.time_s).all() and np.isnan(store.distance_km).all()
+    assert (np.asarray(store.status) == CELL_NO_ROUTE).all()
+    assert status_counts(store) == {}
+
+
+def test_save_matrix_status_and_hash(tmp_path):
+    ids, lat, lon = _points(9, seed=1)
+    t, d = _matrices(9, seed=1)
+    store = save_matrix(str(tmp_path / "m.bin"), ids, lat, lon, t, d, 2018)
+    np.testing.assert_array_equal(store.status, np.where(np.isnan(t), CELL_NO_ROUTE, CELL_OK))
+    # Any change to an id or coordinate changes the hash
+    assert store.meta["points_hash"] != points_hash(ids, lat + np.eye(1, 9, 4).ravel() * 1e-9, lon)
+    assert store.meta["points_hash"] != points_hash(ids[::-1], lat[::-1], lon[::-1])
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not_a_store.bin"
+    path.write_bytes(b"HCMGEO1\n" + bytes(64))
+    with pytest.raises(ValueError, match="not a matrix store"):
+        load_matrix(str(path))
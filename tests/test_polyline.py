@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from polyline import decode_many, decode_polyline, encode_polyline
+
+# Google's reference example, precision 5
+GOOGLE = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+GOOGLE_COORDS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+# Near the poles and the antimeridian: deltas that need every 5-bit group
+LARGE = [(0.0, 0.0), (89.999999, 179.999999), (-89.999999, -179.999999), (0.000001, -0.000001)]
+
+
+def _random_shapes(count, seed=0):
+    rng = np.random.default_rng(seed)
+    shapes = []
+    for _ in range(count):
+        k = int(rng.integers(0, 40))
+        start = rng.uniform((10.7, 106.6), (10.9, 106.8))
+        steps = rng.normal(scale=0.001, size=(k, 2))
+        shapes.append(encode_polyline(start + np.cumsum(steps, axis=0)))
+    return shapes
+
+
+def assert_matches_reference(shapes, precision=6):
+    decoded = decode_many(shapes, precision)
+    assert len(decoded) == len(shapes)
+    for s, got in zip(shapes, decoded):
+        expected = np.array(decode_polyline(s, precision), dtype=np.float64).reshape(-1, 2)
+        assert got.shape == expected.shape
+        # Same integer accumulation and division, so bit-identical
+        assert np.array_equal(got, expected)
+
+
+def test_google_example():
+    assert decode_polyline(GOOGLE, 5) == GOOGLE_COORDS
+    assert_matches_reference([GOOGLE], precision=5)
+
+
+@pytest.mark.parametrize("shapes", [
+    [],
+    [""],
+    ["", "", ""],
+    [encode_polyline([(10.786429, 106.667809)])],
+    [encode_polyline(LARGE)],
+    ["", encode_polyline([(10.78, 106.66)]), "", encode_polyline(LARGE), ""],
+    _random_shapes(200),
+], ids=["none", "empty", "all-empty", "single-vertex", "large-delta", "mixed", "multi-shape"])
+def test_decode_many_matches_decode_polyline(shapes):
+    assert_matches_reference(shapes)
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_encode_decode_round_trip(precision):
+    rng = np.random.default_rng(precision)
+    coords = np.round(rng.uniform((-90, -180), (90, 180), size=(500, 2)), precision)
+    for pts in (coords, coords[:1], np.array(LARGE)):
+        s = encode_polyline(pts, precision)
+        np.testing.assert_allclose(decode_polyline(s, precision), pts, rtol=0, atol=10 ** -precision / 2)
+        np.testing.assert_array_equal(decode_many([s], precision)[0], np.array(decode_polyline(s, precision)))
+    assert encode_polyline(np.zeros((0, 2)), precision) == ""
+
+
+def test_encode_matches_reference_string():
+    assert encode_polyline(GOOGLE_COORDS, 5) == GOOGLE
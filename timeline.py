@@ -0,0 +1,193 @@
+"""
+Timeline over every snapshot in config.SNAPSHOTS.
+
+All years are computed against the same points.csv in one run: each year
+gets a dense store (matrix_<year>.bin; stores that already match the points
+and tiles are reused), and the years' tiles are scheduled side by side,
+each year spread over its replicas. The deltas between every pair of years
+are then taken over the stacked matrices, row block by row block, with all
+pairs in one vectorized subtraction; consecutive years are marked.
+"""
+import argparse
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from build_snapshots import check_snapshots
+from config import SNAPSHOTS, POINTS_CSV, MATRIX_TILES_DIR, TIMELINE_MATRIX_BIN, TIMELINE_DELTAS_CSV
+from delta_stream import QuantileSketch
+from matrix_store import DISTANCE_DECIMALS, create_matrix, commit_matrix, load_matrix, points_hash
+from run_matrix_and_delta import (
+    _engine_id, check_failed_share, compute_matrix, discard_matrices, print_throughput, run_engines
+)
+
+# Delta values held per block (pairs of years x rows x N), per variable
+BLOCK_ELEMENTS = 4_000_000
+
+
+def snapshot_url(year: int) -> str:
+    """The snapshot's name: its first replica (requests go to all of them)."""
+    return SNAPSHOTS[year]["replicas"][0]
+
+
+def _reusable(path: str, base_url: str, phash: str, backend: str = "valhalla"):
+    """Existing store for this year if it was computed on these points and tiles, else None."""
+    if not os.path.exists(path):
+        return None
+    old = load_matrix(path)
+    if old.meta["points_hash"] != phash or old.meta.get("engine_id") != _engine_id(base_url, backend):
+        return None
+    return old
+
+
+def compute_snapshots(pts: pd.DataFrame, years: list[int], tiled=False, max_pairs=None,
+                      checkpoint_dir=MATRIX_TILES_DIR, backend="valhalla") -> dict:
+    """{year: committed store} for every year, computing the ones that are missing or stale."""
+    locs = [{"lat": float(r.lat), "lon": float(r.lon)} for r in pts.itertuples(index=False)]
+    lat = pts["lat"].to_numpy(dtype=float)
+    lon = pts["lon"].to_numpy(dtype=float)
+    phash = points_hash(pts["id"], lat, lon)
+
+    stores, todo = {}, []
+    for year in years:
+        base, path = snapshot_url(year), TIMELINE_MATRIX_BIN.format(year=year)
+        old = _reusable(path, base, phash, backend)
+        if old is not None:
+            print(f"✅ {path} unchanged")
+            stores[year] = old
+            continue
+        store = create_matrix(path, pts["id"], lat, lon, year,
+                              extra_meta={"engine": base, "engine_id": _engine_id(base, backend),
+                                          "backend": backend})
+        todo.append((year, base, store))
+
+    def run(year, base, store, stop):
+        replicas = len(SNAPSHOTS[year]["replicas"])
+        print(f"  [{year}] {base} ({replicas} replica{'s' if replicas > 1 else ''})")
+        with metrics.stage(f"matrix_{year}"):
+            compute_matrix(base, locs, str(year), tiled, max_pairs, checkpoint_dir,
+                           (store.time_s, store.distance_km, store.status), backend=backend, stop=stop)
+
+    if todo:
+        print(f"\nCalling matrix {', '.join(str(y) for y, _, _ in todo)}...")
+        # Every year at once; each year's tiles go to its own replicas
+        new = [store for _, _, store in todo]
+        try:
+            run_engines(run, todo, len(todo))
+        except Exception:
+            discard_matrices(new)
+            raise
+        check_failed_share(new)
+        for year, _, store in todo:
+            stores[year] = commit_matrix(store)
+            print(f"✅ {store.final_path} saved")
+        print("\nMatrix throughput:")
+        print_throughput()
+    return stores
+
+
+def timeline_deltas(stores: dict, block_elements: int = BLOCK_ELEMENTS) -> pd.DataFrame:
+    """
+    One row per pair of years (earlier -> later): cells, mean/median time and
+    distance delta, and the share of cells faster/slower. All pairs of a row
+    block come from one subtraction over the stacked (years, rows, N) block.
+    """
+    years = sorted(stores)
+    mats = [stores[y] for y in years]
+    if len({m.meta["points_hash"] for m in mats}) > 1:
+        raise ValueError("timeline stores were computed on different point sets")
+    n = mats[0].n
+    ia, ib = np.triu_indices(len(years), 1)
+    pairs = len(ia)
+    block = max(1, block_elements // max(1, pairs * n))
+
+    count = np.zeros((2, pairs), dtype=np.int64)
+    faster = np.zeros(pairs, dtype=np.int64)
+    slower = np.zeros(pairs, dtype=np.int64)
+    sums = [[[] for _ in range(pairs)] for _ in range(2)]
+    sketches = [[QuantileSketch() for _ in range(pairs)] for _ in range(2)]
+
+    for r0 in range(0, n, block):
+        r1 = min(n, r0 + block)
+        t = np.stack([np.asarray(m.time_s[r0:r1], dtype=np.float64) for m in mats])
+        d = np.stack([np.round(np.asarray(m.distance_km[r0:r1], dtype=np.float64), DISTANCE_DECIMALS)
+                      for m in mats])
+        for v, stacked in enumerate((t, d)):
+            delta = (stacked[ib] - stacked[ia]).reshape(pairs, -1)
+            valid = ~np.isnan(delta)
+            count[v] += valid.sum(axis=1)
+            if v == 0:
+                faster += (delta < 0).sum(axis=1)
+                slower += (delta > 0).sum(axis=1)
+            block_sums = np.nansum(delta, axis=1)
+            for p in range(pairs):
+                sums[v][p].append(block_sums[p])
+                sketches[v][p].update(delta[p][valid[p]])
+
+    consecutive = set(zip(range(len(years) - 1), range(1, len(years))))
+    rows = []
+    for p, (a, b) in enumerate(zip(ia, ib)):
+        rows.append({
+            "year_from": years[a],
+            "year_to": years[b],
+            "consecutive": (a, b) in consecutive,
+            "pairs": int(count[0, p]),
+            "mean_delta_time_s": math.fsum(sums[0][p]) / count[0, p] if count[0, p] else np.nan,
+            "median_delta_time_s": sketches[0][p].quantile(0.5),
+            "mean_delta_distance_km": math.fsum(sums[1][p]) / count[1, p] if count[1, p] else np.nan,
+            "median_delta_distance_km": sketches[1][p].quantile(0.5),
+            "pct_faster": 100 * faster[p] / count[0, p] if count[0, p] else np.nan,
+            "pct_slower": 100 * slower[p] / count[0, p] if count[0, p] else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+def main(years=None, tiled=False, max_pairs=None, checkpoint_dir=MATRIX_TILES_DIR, backend="valhalla"):
+    years = sorted(years or SNAPSHOTS)
+    unknown = [y for y in years if y not in SNAPSHOTS]
+    if unknown:
+        raise ValueError(f"no snapshot registered for {unknown}; add it to config.SNAPSHOTS")
+    if len(years) < 2:
+        raise ValueError("a timeline needs at least two years")
+
+    if backend == "valhalla":
+        check_snapshots([snapshot_url(y) for y in years])
+    pts = pd.read_csv(POINTS_CSV)
+    if backend == "local" and max_pairs is None:
+        max_pairs = max(1, len(pts) ** 2)
+    print(f"Loaded {len(pts)} points from {POINTS_CSV}; snapshots {', '.join(map(str, years))}")
+    stores = compute_snapshots(pts, years, tiled, max_pairs, checkpoint_dir, backend)
+
+    with metrics.stage("deltas"):
+        df = timeline_deltas(stores)
+    df.to_csv(TIMELINE_DELTAS_CSV, index=False)
+    print(f"✅ {TIMELINE_DELTAS_CSV} saved")
+
+    print("\n" + "=" * 60)
+    print("TIMELINE DELTAS (consecutive years first)")
+    print("=" * 60)
+    shown = df.sort_values(["consecutive", "year_from", "year_to"], ascending=[False, True, True])
+    print(shown.round(3).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Matrices for every registered snapshot and the deltas between them")
+    parser.add_argument("--years", type=int, nargs="+", default=None,
+                        help=f"Snapshots to include (default: all of {sorted(SNAPSHOTS)})")
+    parser.add_argument("--tiled", action="store_true",
+                        help="Force tiled mode (automatic when N*N exceeds the engine limit)")
+    parser.add_argument("--max-pairs", type=int, default=None,
+                        help="Pairs per tile (default: max_matrix_location_pairs from valhalla.json)")
+    parser.add_argument("--checkpoint-dir", default=MATRIX_TILES_DIR,
+                        help=f"Directory for finished tiles, used to resume (default: {MATRIX_TILES_DIR})")
+    parser.add_argument("--backend", choices=["valhalla", "local"], default="valhalla",
+                        help="Matrix engine: the Valhalla containers, or the offline graph from local_graph.py")
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+
+    with metrics.session(args):
+        main(years=args.years, tiled=args.tiled, max_pairs=args.max_pairs,
+             checkpoint_dir=args.checkpoint_dir, backend=args.backend)
@@ -0,0 +1,217 @@
+"""
+Shared HTTP layer for the Valhalla engines.
+
+One pooled keep-alive session per base URL, a per-endpoint concurrency limit
+for each engine, retries with exponential backoff on 5xx / timeouts, and a
+shared thread pool so 2018 and 2025 requests run side by side. A snapshot
+with several replicas (config.SNAPSHOTS) is one EngineFleet: callers keep
+using the first replica's URL, and each request goes to the replica with
+the fewest requests in flight.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from config import (
+    COSTING, ENGINE_CONFIGS, HTTP_POOL_SIZE, HTTP_MAX_WORKERS, HTTP_RETRIES, HTTP_BACKOFF_S,
+    ENDPOINT_CONCURRENCY, SNAPSHOTS
+)
+
+RETRY_STATUS = {500, 502, 503, 504}
+
+
+class ValhallaClient:
+    """Pooled client for one engine (one base URL)."""
+
+    def __init__(self, base_url: str, pool_size: int = HTTP_POOL_SIZE,
+                 limits: dict | None = None, retries: int = HTTP_RETRIES,
+                 backoff_s: float = HTTP_BACKOFF_S):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff_s = backoff_s
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        limits = ENDPOINT_CONCURRENCY if limits is None else limits
+        self._limits = {path: threading.BoundedSemaphore(n) for path, n in limits.items()}
+        self._default_limit = threading.BoundedSemaphore(pool_size)
+
+        # Own queue per engine, so a long backlog for one engine never starves the other
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="valhalla")
+
+    def _sleep_before_retry(self, attempt: int) -> None:
+        delay = self.backoff_s * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, delay / 2))
+
+    def post(self, path: str, payload: dict, timeout: float, retries: int | None = None) -> requests.Response:
+        """
+        POST payload to path. Retries timeouts, connection errors and 5xx
+        (retries overrides the client's count for this call; 0 = one attempt).
+        Returns the last response (callers decide how to treat 4xx / final 5xx).
+        """
+        url = f"{self.base_url}{path}"
+        sem = self._limits.get(path, self._default_limit)
+        retries = self.retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            t0 = time.perf_counter()
+            try:
+                with sem:
+                    r = self.session.post(url, json=payload, timeout=timeout)
+            except (requests.Timeout, requests.ConnectionError):
+                if metrics.ENABLED:
+                    metrics.record_request(self.base_url, path, time.perf_counter() - t0, None, attempt > 0)
+                if last:
+                    raise
+                self._sleep_before_retry(attempt)
+                continue
+            if metrics.ENABLED:
+                metrics.record_request(self.base_url, path, time.perf_counter() - t0, r, attempt > 0)
+
+            if r.status_code in RETRY_STATUS and not last:
+                self._sleep_before_retry(attempt)
+                continue
+            return r
+
+
+class EngineFleet:
+    """
+    Replicas of one snapshot behind a single client interface. Each post()
+    goes to the replica with the fewest outstanding requests (ties to the
+    one picked least recently), and the worker pool grows with the replica
+    count, so per-replica endpoint limits add up.
+    """
+
+    def __init__(self, replicas: list[str], pool_size: int = HTTP_POOL_SIZE):
+        self.replicas = [ValhallaClient(url, pool_size) for url in replicas]
+        self.base_url = self.replicas[0].base_url
+        self._outstanding = [0] * len(self.replicas)
+        self._last_pick = [0] * len(self.replicas)
+        self._picks = 0
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=pool_size * len(self.replicas),
+                                           thread_name_prefix="valhalla")
+
+    def _acquire(self) -> int:
+        with self._lock:
+            k = min(range(len(self.replicas)), key=lambda i: (self._outstanding[i], self._last_pick[i]))
+            self._outstanding[k] += 1
+            self._picks += 1
+            self._last_pick[k] = self._picks
+            return k
+
+    def post(self, path: str, payload: dict, timeout: float, retries: int | None = None) -> requests.Response:
+        k = self._acquire()
+        try:
+            return self.replicas[k].post(path, payload, timeout, retries)
+        finally:
+            with self._lock:
+                self._outstanding[k] -= 1
+
+
+def _replica_sets() -> dict[str, list[str]]:
+    """Replica URLs of every multi-replica snapshot, by the snapshot's first URL."""
+    out = {}
+    for snap in SNAPSHOTS.values():
+        urls = [u.rstrip("/") for u in snap["replicas"]]
+        if len(urls) > 1:
+            out[urls[0]] = urls
+    return out
+
+
+def service_limits(base_url: str, costing: str | None = COSTING) -> dict:
+    """
+    service_limits for a costing from the engine's valhalla.json (the whole
+    section, with the global limits, when costing is None).
+    Empty dict when the config is not available locally.
+    """
+    path = ENGINE_CONFIGS.get(base_url.rstrip("/"))
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        limits = json.load(f).get("service_limits", {})
+    return limits if costing is None else limits.get(costing, {})
+
+
+def engine_id(base_url: str) -> str:
+    """
+    Identity of the tile set an engine serves: its tileset_id in the
+    snapshot manifest (build_snapshots.py), else a hash of file_hashes.txt
+    next to its valhalla.json, which changes whenever the tiles are rebuilt
+    from different input. Falls back to the base URL when neither is available.
+    """
+    from build_snapshots import tileset_id
+
+    tid = tileset_id(base_url)
+    if tid:
+        return tid
+    config_path = ENGINE_CONFIGS.get(base_url.rstrip("/"))
+    if config_path:
+        hashes = os.path.join(os.path.dirname(config_path), "file_hashes.txt")
+        if os.path.exists(hashes):
+            with open(hashes, "rb") as f:
+                return hashlib.sha1(f.read()).hexdigest()[:16]
+    return base_url.rstrip("/")
+
+
+_clients: dict[str, ValhallaClient | EngineFleet] = {}
+_clients_lock = threading.Lock()
+_executor = None
+_replicas = _replica_sets()
+
+
+def get_client(base_url: str) -> ValhallaClient | EngineFleet:
+    """
+    Shared client per base URL, so every caller reuses the same connection
+    pool; the fleet of all replicas when base_url names a replicated snapshot.
+    """
+    key = base_url.rstrip("/")
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            replicas = _replicas.get(key)
+            client = _clients[key] = EngineFleet(replicas) if replicas else ValhallaClient(key)
+        return client
+
+
+def get_executor(base_url: str | None = None) -> ThreadPoolExecutor:
+    """
+    Worker pool for jobs that target one engine (base_url given), or a shared
+    pool for jobs that mix engines. Per-endpoint semaphores in the client keep
+    each engine within its limits either way.
+    """
+    if base_url is not None:
+        return get_client(base_url).executor
+
+    global _executor
+    with _clients_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HTTP_MAX_WORKERS,
+                                           thread_name_prefix="valhalla")
+        return _executor
+
+
+def run_concurrent(fn, items: list, base_url: str | None = None) -> list:
+    """Apply fn to every item concurrently; results come back in input order."""
+    pool = get_executor(base_url)
+    return list(pool.map(fn, items))
+
+
+def iter_completed(fn, items: list, base_url: str | None = None):
+    """Yield (index, result) as soon as each call finishes."""
+    pool = get_executor(base_url)
+    futures = {pool.submit(fn, item): i for i, item in enumerate(items)}
+    for fut in as_completed(futures):
+        yield futures[fut], fut.result()